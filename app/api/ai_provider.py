@@ -94,3 +94,12 @@ async def update_ai_provider(provider_id: str, provider: AIProviderCreate, curre
         enabled=bool(db_provider.enabled),
         config_json=db_provider.config_json
     )
+
+@router.post("/reload", summary="Reload provider configuration", response_description="Configured providers and pooled clients")
+async def reload_providers(current_admin=Depends(get_current_user_with_role("ROLE_ADMIN"))):
+    """
+    Re-reads provider configuration (environment and .env) without a restart. Pooled clients
+    whose provider configuration changed are dropped and recreated on next use.
+    """
+    from app.services.provider_manager import provider_manager
+    return {"status": "success", **provider_manager.reload(), "clients": provider_manager.pooled_clients()}
@@ -3,7 +3,7 @@ from typing import List
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy.exc import IntegrityError
-from app.schemas import DocumentCreate, DocumentOut
+from app.schemas import DocumentCreate, DocumentOut, DocumentUpdate
 from app.models import Document as DocModel, KnowledgeBase as KBModel
 from app.core.auth import get_current_user, get_current_user_with_role, get_current_user_with_permission
 from app.db.database import get_db
@@ -24,10 +24,14 @@ async def list_documents(kb_id: str, current_user=Depends(get_current_user), db:
         title=doc.title,
         source=doc.source,
         status=doc.status,
-        created_at=doc.created_at
+        status_reason=doc.status_reason,
+        created_at=doc.created_at,
+        tags=doc.tags
     ) for doc in docs]
 
 from app.services.rag import get_rag_service
+from app.services.metadata_index import metadata_registry, normalize_tags
+from app.services.semantic_cache import semantic_cache
 import json
 
 @router.post("knowledge_bases/{kb_id}/documents", response_model=DocumentOut, summary="Add document", response_description="Document metadata")
@@ -44,7 +48,7 @@ async def add_document(kb_id: str, doc: DocumentCreate, current_admin=Depends(ge
             raise HTTPException(status_code=400, detail="Document 'source' (raw text) required for ingestion")
         rag_service = get_rag_service(db)
         # Simulate file ingestion with in-memory bytes
-        ingestion_result = await rag_service.ingest_document(kb, doc.source.encode("utf-8"), filename=doc.title)
+        ingestion_result = await rag_service.ingest_document(kb, doc.source.encode("utf-8"), filename=doc.title, tags=doc.tags)
         # Fetch the document metadata after ingestion
         new_doc = await db.get(DocModel, uuid.UUID(ingestion_result["document_id"]))
         return DocumentOut(
@@ -53,16 +57,53 @@ async def add_document(kb_id: str, doc: DocumentCreate, current_admin=Depends(ge
             title=new_doc.title,
             source=new_doc.source,
             status=new_doc.status,
-            created_at=new_doc.created_at
+            status_reason=new_doc.status_reason,
+            created_at=new_doc.created_at,
+            tags=new_doc.tags
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Document ingestion failed: {str(e)}")
 
-@router.delete("{doc_id}")
-async def delete_document(doc_id: str, current_admin=Depends(get_current_user_with_role("admin")), db: AsyncSession = Depends(get_db)):
+@router.patch("/{doc_id}", response_model=DocumentOut)
+async def update_document(doc_id: str, update: DocumentUpdate, current_admin=Depends(get_current_user_with_role("admin")), db: AsyncSession = Depends(get_db)):
+    """
+    Update a document's title or tags (admin only). Filtered searches see the change right away.
+    """
     doc = await db.get(DocModel, uuid.UUID(doc_id))
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
-    await db.delete(doc)
+    update_data = update.model_dump(exclude_unset=True)
+    if "tags" in update_data:
+        update_data["tags"] = normalize_tags(update_data["tags"]) or None
+    for key, value in update_data.items():
+        setattr(doc, key, value)
     await db.commit()
-    return {"detail": "Deleted"}
+    # Tag bitmaps cannot drop a document's bits in place; the index is rebuilt on the next filtered search
+    metadata_registry.invalidate(doc.knowledge_base_id)
+    semantic_cache.invalidate(str(doc.knowledge_base_id))
+    return DocumentOut(
+        id=str(doc.id),
+        knowledge_base_id=str(doc.knowledge_base_id),
+        title=doc.title,
+        source=doc.source,
+        status=doc.status,
+        status_reason=doc.status_reason,
+        created_at=doc.created_at,
+        tags=doc.tags
+    )
+
+@router.delete("/{doc_id}")
+async def delete_document(doc_id: str, current_admin=Depends(get_current_user_with_role("admin")), db: AsyncSession = Depends(get_db)):
+    """
+    Delete a document (admin only), along with its chunks, embeddings and vectors in the KB index.
+    """
+    doc = await db.get(DocModel, uuid.UUID(doc_id))
+    if not doc:
+        raise HTTPException(status_code=404, detail="Document not found")
+    try:
+        kb = await db.get(KBModel, doc.knowledge_base_id)
+        rag_service = get_rag_service(db)
+        result = await rag_service.delete_document(kb, doc.id)
+        return {"detail": "Deleted", **result}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Document deletion failed: {str(e)}")
@@ -1,24 +1,38 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Request, Body
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form, Request, Body, Query, Response
+from typing import List, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy import delete
 from sqlalchemy.exc import IntegrityError
-from app.schemas import KnowledgeBaseCreate, KnowledgeBaseOut, KnowledgeBaseUpdate
+from app.schemas import KnowledgeBaseCreate, KnowledgeBaseOut, KnowledgeBaseUpdate, IndexRebuildRequest, IngestJobOut, BatchSearchRequest, BatchSearchResponse, SearchRequest, SearchResponse, SearchFilter
 from app.models import KnowledgeBase as KBModel
 from app.models.document import Document as DocumentModel
 from app.models.document_chunk import DocumentChunk as ChunkModel
 from app.models.embedding import Embedding as EmbeddingModel
+from app.models.ingest_job import IngestJob
 from app.core.auth import get_current_user_with_role, get_current_user_with_permission, get_current_user
 from app.db.database import get_db
 import uuid
 from sqlalchemy.exc import IntegrityError
-from app.services.faiss_manager import get_index_path
+from app.services.faiss_manager import get_index_files, index_registry, normalize_index_config
+from app.services.rag import get_rag_service
+from app.services.semantic_cache import semantic_cache
+from app.services.bm25_index import bm25_registry
+from app.services.metadata_index import metadata_registry
+from app.services.chunking import get_chunker
+from app.services.ingest_queue import ingest_queue
+from app.core.sse import sse_response
 import logging
+import json
 import os
+import time
+import asyncio
 
 logger = logging.getLogger(__name__)
 
+BATCH_SEARCH_MAX_QUERIES = int(os.getenv("BATCH_SEARCH_MAX_QUERIES", "256"))
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", "1000"))  # Deepest result (offset + limit) search pages reach
+
 router = APIRouter()
 
 @router.get("", response_model=List[KnowledgeBaseOut])
@@ -33,34 +47,109 @@ async def list_knowledge_bases(current_user=Depends(get_current_user), db: Async
         chunking_strategy=kb.chunking_strategy,
         chunk_size=kb.chunk_size,
         chunk_overlap=kb.chunk_overlap,
-        embedding_model=kb.embedding_model
+        embedding_model=kb.embedding_model,
+        context_max_tokens=kb.context_max_tokens,
+        lexical_weight=kb.lexical_weight,
+        index_type=kb.index_type,
+        index_nlist=kb.index_nlist,
+        index_pq_m=kb.index_pq_m,
+        index_hnsw_m=kb.index_hnsw_m,
+        index_nprobe=kb.index_nprobe,
+        index_ef_search=kb.index_ef_search,
+        semantic_cache_enabled=kb.semantic_cache_enabled,
+        semantic_cache_threshold=kb.semantic_cache_threshold
     ) for kb in kbs]
 
-@router.post("/{kb_id}/ingest", summary="Ingest documents", response_description="Ingestion results")
+@router.post("/{kb_id}/ingest", status_code=202, summary="Ingest documents", response_description="Queued ingest jobs, or ingestion results with wait=true")
 async def ingest_documents(
     kb_id: str,
+    response: Response,
     files: List[UploadFile] = File(..., description="Files to ingest"),
+    tags: List[str] = Form(default=[], description="Tags applied to every uploaded document, for filtered searches"),
+    wait: bool = Query(False, description="Ingest within the request and return per-file results instead of queueing jobs"),
+    concurrency: int = Query(4, ge=1, le=32, description="With wait=true, files extracted and embedded at the same time"),
     current_admin=Depends(get_current_user_with_role("admin")),
     db: AsyncSession = Depends(get_db)
 ):
     """
-    Ingest one or more documents into a knowledge base. Only accessible by admins.
-    Returns a list of ingestion results for each file.
+    Queue one or more documents for ingestion into a knowledge base. Only accessible by admins.
+    Returns a job per file right away; poll GET /{kb_id}/ingest/jobs/{job_id} for progress.
+    With wait=true the files are ingested concurrently within the request and a list of
+    ingestion results for each file is returned.
     """
     try:
         kb = await db.get(KBModel, uuid.UUID(kb_id))
         if not kb:
             raise HTTPException(status_code=404, detail="Knowledge base not found")
-        rag_service = get_rag_service(db)
-        results = []
-        for file in files:
-            content = await file.read()
-            res = await rag_service.ingest_document(kb, content, filename=file.filename)
-            results.append(res)
-        return {"status": "success", "results": results}
+        uploads = [(file.filename, await file.read()) for file in files]
+        if wait:
+            results = await get_rag_service(db).ingest_documents(kb, uploads, concurrency=concurrency, tags=tags)
+            response.status_code = status.HTTP_200_OK
+            return {"status": "success", "results": results}
+        jobs = await ingest_queue.enqueue(db, kb, uploads, tags=tags)
+        return {"status": "queued", "jobs": [_ingest_job_out(job) for job in jobs]}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ingestion failed: {str(e)}")
 
+def _ingest_job_out(job: IngestJob, document: Optional[DocumentModel] = None) -> IngestJobOut:
+    return IngestJobOut(
+        id=str(job.id),
+        knowledge_base_id=str(job.knowledge_base_id),
+        document_id=str(job.document_id) if job.document_id else None,
+        filename=job.filename,
+        status=job.status,
+        attempts=job.attempts or 0,
+        error=job.error,
+        result=json.loads(job.result) if job.result else None,
+        document_status=document.status if document is not None else None,
+        document_status_reason=document.status_reason if document is not None else None,
+        created_at=job.created_at,
+        started_at=job.started_at,
+        finished_at=job.finished_at
+    )
+
+@router.get("/{kb_id}/ingest/jobs", response_model=List[IngestJobOut], summary="List ingest jobs")
+async def list_ingest_jobs(
+    kb_id: str,
+    job_status: Optional[str] = Query(None, alias="status", pattern="^(queued|processing|completed|failed)$", description="Only jobs with this status"),
+    limit: int = Query(100, ge=1, le=1000, description="Maximum number of jobs returned"),
+    current_admin=Depends(get_current_user_with_role("admin")),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Lists the most recent ingest jobs of a knowledge base, optionally filtered by status
+    (queued, processing, completed, failed), with the status of each job's document.
+    """
+    stmt = (
+        select(IngestJob, DocumentModel)
+        .outerjoin(DocumentModel, IngestJob.document_id == DocumentModel.id)
+        .where(IngestJob.knowledge_base_id == uuid.UUID(kb_id))
+        .order_by(IngestJob.created_at.desc())
+        .limit(limit)
+    )
+    if job_status:
+        stmt = stmt.where(IngestJob.status == job_status)
+    rows = (await db.execute(stmt)).all()
+    return [_ingest_job_out(job, document) for job, document in rows]
+
+@router.get("/{kb_id}/ingest/jobs/{job_id}", response_model=IngestJobOut, summary="Get ingest job status")
+async def get_ingest_job(
+    kb_id: str,
+    job_id: str,
+    current_admin=Depends(get_current_user_with_role("admin")),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Returns the status of one ingest job, including its result once completed or the error if it failed.
+    """
+    job = await db.get(IngestJob, uuid.UUID(job_id))
+    if not job or str(job.knowledge_base_id) != kb_id:
+        raise HTTPException(status_code=404, detail="Ingest job not found")
+    document = await db.get(DocumentModel, job.document_id) if job.document_id else None
+    return _ingest_job_out(job, document)
+
 from fastapi import Body
 
 @router.post("/{kb_id}/chat", summary="Query knowledge base", response_description="LLM answer and context")
@@ -68,6 +157,7 @@ async def chat(
     kb_id: str,
     query: str = Body(..., embed=True, description="User query for the knowledge base"),
     top_k: int = Body(3, embed=True, description="Number of relevant chunks to use for context"),
+    filters: Optional[SearchFilter] = Body(None, embed=True, description="Only use chunks of documents matching these metadata filters"),
     current_user=Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
@@ -79,10 +169,129 @@ async def chat(
         if not kb:
             raise HTTPException(status_code=404, detail="Knowledge base not found")
         rag_service = get_rag_service(db)
-        response = await rag_service.query(kb, query, top_k=top_k)
-        return {"answer": response["answer"], "context": response["context"]}
+        response = await rag_service.query(kb, query, top_k=top_k, filters=filters)
+        return {"answer": response["answer"], "context": response["context"], "log_id": response["log_id"], "cache_hit": response["cache_hit"]}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Query failed: {str(e)}")
+
+@router.post("/{kb_id}/chat/stream", summary="Query knowledge base (streaming)", response_description="Server-Sent Events: context, token..., done")
+async def chat_stream(
+    kb_id: str,
+    query: str = Body(..., embed=True, description="User query for the knowledge base"),
+    top_k: int = Body(3, embed=True, description="Number of relevant chunks to use for context"),
+    filters: Optional[SearchFilter] = Body(None, embed=True, description="Only use chunks of documents matching these metadata filters"),
+    current_user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Streaming variant of chat. Responds with Server-Sent Events: a 'context' event with the
+    retrieved context and citations, 'token' events as the answer is generated, then a 'done'
+    event with the query log id and token usage.
+    """
+    try:
+        kb = await db.get(KBModel, uuid.UUID(kb_id))
+        if not kb:
+            raise HTTPException(status_code=404, detail="Knowledge base not found")
+        rag_service = get_rag_service(db)
+        events = await rag_service.query_stream(kb, query, top_k=top_k, filters=filters)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Query failed: {str(e)}")
+    return sse_response(events)
+
+@router.post("/{kb_id}/search", response_model=SearchResponse, summary="Search knowledge base", response_description="Ranked chunks")
+async def search(
+    kb_id: str,
+    search: SearchRequest,
+    current_user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Retrieve ranked chunks with their document metadata, without generating an answer or
+    logging the query. Pages with offset/limit; with latency_budget_ms, retrieval steps that
+    would exceed the budget are skipped and the response is marked degraded.
+    """
+    if search.offset + search.limit > SEARCH_MAX_RESULTS:
+        raise HTTPException(status_code=400, detail=f"offset + limit may not exceed {SEARCH_MAX_RESULTS}")
+    try:
+        kb = await db.get(KBModel, uuid.UUID(kb_id))
+        if not kb:
+            raise HTTPException(status_code=404, detail="Knowledge base not found")
+        rag_service = get_rag_service(db)
+        return await rag_service.search(kb, search.query, limit=search.limit, offset=search.offset, latency_budget_ms=search.latency_budget_ms, filters=search.filters)
+    except HTTPException:
+        raise
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Search exceeded the latency budget")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
+
+@router.post("/{kb_id}/search:batch", response_model=BatchSearchResponse, summary="Search knowledge base (batch)", response_description="Retrieved chunks per query")
+async def search_batch(
+    kb_id: str,
+    search: BatchSearchRequest,
+    current_user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Retrieve chunks for many queries in one request, without generating answers. All queries are
+    embedded in one provider call and searched together; results come back in query order.
+    """
+    if len(search.queries) > BATCH_SEARCH_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_SEARCH_MAX_QUERIES} queries per batch")
+    try:
+        kb = await db.get(KBModel, uuid.UUID(kb_id))
+        if not kb:
+            raise HTTPException(status_code=404, detail="Knowledge base not found")
+        start_time = time.time()
+        rag_service = get_rag_service(db)
+        results = await rag_service.search_batch(kb, search.queries, top_k=search.top_k, filters=search.filters)
+        return BatchSearchResponse(results=results, latency_ms=round((time.time() - start_time) * 1000, 1))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
+
+@router.post("/{kb_id}/index/rebuild", summary="Rebuild vector index", response_description="Rebuild results")
+async def rebuild_index(
+    kb_id: str,
+    rebuild: Optional[IndexRebuildRequest] = Body(None),
+    current_admin=Depends(get_current_user_with_role("admin")),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Rebuild a knowledge base's vector index from its stored embeddings, optionally switching
+    to a new index type or parameters. Embeddings are streamed in batches, and queries keep being
+    served from the old index until the rebuilt one is swapped in. Also recovers a KB whose index
+    file was lost or corrupted. Only accessible by admins.
+    """
+    try:
+        kb_uuid = uuid.UUID(kb_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Knowledge Base ID format")
+
+    kb = await db.get(KBModel, kb_uuid)
+    if not kb:
+        raise HTTPException(status_code=404, detail="Knowledge base not found")
+
+    update_data = rebuild.model_dump(exclude_unset=True, exclude={"batch_size"}) if rebuild else {}
+    for key, value in update_data.items():
+        setattr(kb, key, value)
+    try:
+        normalize_index_config({"type": kb.index_type})
+    except ValueError as e:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        rag_service = get_rag_service(db)
+        result = await rag_service.rebuild_index(kb, batch_size=rebuild.batch_size if rebuild else None)
+        await db.commit()
+        return {"status": "success", **result}
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=f"Index rebuild failed: {str(e)}")
 
 @router.get("health")
 async def health():
@@ -117,9 +326,18 @@ async def update_knowledge_base(
         raise HTTPException(status_code=404, detail="Knowledge base not found")
 
     update_data = kb_update.model_dump(exclude_unset=True) # Use model_dump
+    try:
+        if "index_type" in update_data:
+            normalize_index_config({"type": update_data["index_type"]})
+        if "chunking_strategy" in update_data:
+            get_chunker(update_data["chunking_strategy"])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     for key, value in update_data.items():
         setattr(db_kb, key, value)
+    if {"semantic_cache_enabled", "semantic_cache_threshold", "context_max_tokens", "lexical_weight"} & update_data.keys():
+        semantic_cache.invalidate(kb_id)
 
     db.add(db_kb)
     try:
@@ -137,6 +355,11 @@ async def update_knowledge_base(
 
 @router.post("", response_model=KnowledgeBaseOut)
 async def create_knowledge_base(kb: KnowledgeBaseCreate, current_admin=Depends(get_current_user_with_role("admin")), db: AsyncSession = Depends(get_db)):
+    try:
+        normalize_index_config({"type": kb.index_type})
+        get_chunker(kb.chunking_strategy)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     new_kb = KBModel(
         name=kb.name,
         description=kb.description,
@@ -144,7 +367,17 @@ async def create_knowledge_base(kb: KnowledgeBaseCreate, current_admin=Depends(g
         chunking_strategy=kb.chunking_strategy,
         chunk_size=kb.chunk_size,
         chunk_overlap=kb.chunk_overlap,
-        embedding_model=kb.embedding_model
+        embedding_model=kb.embedding_model,
+        context_max_tokens=kb.context_max_tokens,
+        lexical_weight=kb.lexical_weight,
+        index_type=kb.index_type,
+        index_nlist=kb.index_nlist,
+        index_pq_m=kb.index_pq_m,
+        index_hnsw_m=kb.index_hnsw_m,
+        index_nprobe=kb.index_nprobe,
+        index_ef_search=kb.index_ef_search,
+        semantic_cache_enabled=kb.semantic_cache_enabled,
+        semantic_cache_threshold=kb.semantic_cache_threshold
     )
     db.add(new_kb)
     try:
@@ -161,7 +394,17 @@ async def create_knowledge_base(kb: KnowledgeBaseCreate, current_admin=Depends(g
         chunking_strategy=new_kb.chunking_strategy,
         chunk_size=new_kb.chunk_size,
         chunk_overlap=new_kb.chunk_overlap,
-        embedding_model=new_kb.embedding_model
+        embedding_model=new_kb.embedding_model,
+        context_max_tokens=new_kb.context_max_tokens,
+        lexical_weight=new_kb.lexical_weight,
+        index_type=new_kb.index_type,
+        index_nlist=new_kb.index_nlist,
+        index_pq_m=new_kb.index_pq_m,
+        index_hnsw_m=new_kb.index_hnsw_m,
+        index_nprobe=new_kb.index_nprobe,
+        index_ef_search=new_kb.index_ef_search,
+        semantic_cache_enabled=new_kb.semantic_cache_enabled,
+        semantic_cache_threshold=new_kb.semantic_cache_threshold
     )
 
 @router.delete("/{kb_id}", status_code=204) # Use 204 No Content for successful deletion
@@ -180,6 +423,9 @@ async def delete_knowledge_base(
     if not db_kb:
         raise HTTPException(status_code=404, detail="Knowledge base not found")
 
+    # Drop ingest jobs first; a worker holding one of them finds it gone and stops
+    await db.execute(delete(IngestJob).where(IngestJob.knowledge_base_id == kb_uuid))
+
     doc_stmt = select(DocumentModel).where(DocumentModel.knowledge_base_id == kb_uuid) # Correct column name
     documents_result = await db.execute(doc_stmt)
     documents = documents_result.scalars().all()
@@ -211,24 +457,18 @@ async def delete_knowledge_base(
     await db.delete(db_kb)
     logger.info(f"Deleted Knowledge Base DB record {kb_id}")
 
-    # Delete the FAISS index file and chunk map file from the filesystem
+    # Drop the resident indexes, then delete the FAISS index, chunk map, WAL and BM25 files from the filesystem
+    index_registry.evict(kb_id)
+    bm25_registry.evict(kb_id)
+    metadata_registry.invalidate(kb_id)
+    semantic_cache.invalidate(kb_id)
     try:
-        faiss_index_path = get_index_path(kb_id) # Use centralized function
-        chunk_map_path = faiss_index_path + ".chunks.npy" # Path for the chunk map
-
-        # Delete FAISS index
-        if os.path.exists(faiss_index_path):
-            os.remove(faiss_index_path)
-            logger.info(f"Successfully deleted FAISS index file: {faiss_index_path}")
-        else:
-            logger.warning(f"FAISS index file not found, skipping deletion: {faiss_index_path}")
-
-        # Delete Chunk Map
-        if os.path.exists(chunk_map_path):
-            os.remove(chunk_map_path)
-            logger.info(f"Successfully deleted FAISS chunk map file: {chunk_map_path}")
-        else:
-            logger.warning(f"FAISS chunk map file not found, skipping deletion: {chunk_map_path}")
+        index_files = get_index_files(kb_id) # Use centralized function
+        if not index_files:
+            logger.warning(f"No FAISS files found for KB {kb_id}, skipping deletion.")
+        for path in index_files:
+            os.remove(path)
+            logger.info(f"Successfully deleted FAISS file: {path}")
 
     except OSError as e:
         # Log error but don't block the commit if DB deletion was okay
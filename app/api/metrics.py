@@ -0,0 +1,33 @@
+from fastapi import APIRouter, Depends
+from app.core.auth import get_current_user_with_role
+from app.services.embedding_scheduler import embedding_scheduler
+from app.services.embedding_cache import embedding_cache
+from app.services.query_embedding_cache import query_embedding_cache
+from app.services.semantic_cache import semantic_cache
+
+router = APIRouter()
+
+@router.get("/embeddings", summary="Embedding scheduler metrics", response_description="Batching, throughput and retry counters")
+async def embedding_metrics(current_admin=Depends(get_current_user_with_role("admin"))):
+    """
+    Returns counters for embedding requests made by this process: requests, texts embedded,
+    estimated tokens, retries and rate-limit hits, throughput, and embedding cache hit rates.
+    Only accessible by admins.
+    """
+    return {**embedding_scheduler.stats(), "cache": embedding_cache.stats()}
+
+@router.get("/query_cache", summary="Query embedding cache metrics", response_description="Hit/miss counters")
+async def query_cache_metrics(current_admin=Depends(get_current_user_with_role("admin"))):
+    """
+    Returns hit/miss counters for the query embedding cache used by the query and chat endpoints.
+    Only accessible by admins.
+    """
+    return query_embedding_cache.stats()
+
+@router.get("/semantic_cache", summary="Semantic answer cache metrics", response_description="Hit/miss counters")
+async def semantic_cache_metrics(current_admin=Depends(get_current_user_with_role("admin"))):
+    """
+    Returns hit/miss counters and entry counts for the per-KB semantic answer cache.
+    Only accessible by admins.
+    """
+    return semantic_cache.stats()
@@ -3,14 +3,19 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from fastapi import APIRouter, Depends, HTTPException, Body
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.schemas import QueryResponse
+from app.schemas import QueryResponse, FederatedQueryRequest, FederatedQueryResponse, SearchFilter
 from app.models import KnowledgeBase as KBModel
 from app.models.query_log import QueryLog 
 from app.schemas.query_log import QueryFeedbackCreate, QueryFeedbackOut 
 from app.core.auth import get_current_user_with_role, get_current_user_with_permission, get_current_user 
 from app.db.database import get_db
 from app.services.rag import get_rag_service
+from app.core.sse import sse_response
 import uuid
+import os
+from typing import Optional
+
+FEDERATED_MAX_KBS = int(os.getenv("FEDERATED_MAX_KBS", "64"))
 
 router = APIRouter()
 
@@ -19,6 +24,7 @@ async def query_knowledge_base(
     knowledge_base_id: str = Body(..., embed=True, description="Knowledge base UUID"),
     query: str = Body(..., embed=True, description="User query"),
     top_k: int = Body(3, embed=True, description="Number of relevant chunks to use for context"),
+    filters: Optional[SearchFilter] = Body(None, embed=True, description="Only use chunks of documents matching these metadata filters"),
     current_user=Depends(get_current_user), 
     db: AsyncSession = Depends(get_db)
 ):
@@ -32,16 +38,78 @@ async def query_knowledge_base(
             raise HTTPException(status_code=404, detail="Knowledge base not found")
 
         rag_service = get_rag_service(db)
-        response = await rag_service.query(kb, query, top_k=top_k)
+        response = await rag_service.query(kb, query, top_k=top_k, filters=filters)
 
         # Include log_id in the response
-        return QueryResponse(answer=response["answer"], context=response["context"], log_id=response["log_id"])
+        return QueryResponse(answer=response["answer"], context=response["context"], log_id=response["log_id"], cache_hit=response["cache_hit"])
     except Exception as e:
         import traceback
         traceback.print_exc() 
         raise HTTPException(status_code=500, detail=f"Query failed: {str(e)}")
 
 
+@router.post("/stream", summary="Query knowledge base (generic, streaming)", response_description="Server-Sent Events: context, token..., done")
+async def query_knowledge_base_stream(
+    knowledge_base_id: str = Body(..., embed=True, description="Knowledge base UUID"),
+    query: str = Body(..., embed=True, description="User query"),
+    top_k: int = Body(3, embed=True, description="Number of relevant chunks to use for context"),
+    filters: Optional[SearchFilter] = Body(None, embed=True, description="Only use chunks of documents matching these metadata filters"),
+    current_user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Streaming variant of the generic query endpoint. Responds with Server-Sent Events: a 'context'
+    event with the retrieved context and citations, 'token' events as the answer is generated, then
+    a 'done' event with the query log id and token usage.
+    """
+    try:
+        kb = await db.get(KBModel, uuid.UUID(knowledge_base_id))
+        if not kb:
+            raise HTTPException(status_code=404, detail="Knowledge base not found")
+        rag_service = get_rag_service(db)
+        events = await rag_service.query_stream(kb, query, top_k=top_k, filters=filters)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Query failed: {str(e)}")
+    return sse_response(events)
+
+
+@router.post("/federated", response_model=FederatedQueryResponse, summary="Query several knowledge bases", response_description="LLM answer over the merged context")
+async def query_federated(
+    federated: FederatedQueryRequest,
+    current_user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Searches several knowledge bases concurrently and answers from their merged top chunks with a
+    single completion. A knowledge base that does not return within the per-KB timeout is left out
+    and reported in `knowledge_bases` rather than failing the request.
+    """
+    kb_ids = list(dict.fromkeys(federated.knowledge_base_ids))
+    if len(kb_ids) > FEDERATED_MAX_KBS:
+        raise HTTPException(status_code=400, detail=f"At most {FEDERATED_MAX_KBS} knowledge bases per query")
+    try:
+        kb_uuids = [uuid.UUID(kb_id) for kb_id in kb_ids]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Knowledge Base ID format")
+    try:
+        found = {kb.id: kb for kb in (await db.execute(select(KBModel).where(KBModel.id.in_(kb_uuids)))).scalars().all()}
+        if not found:
+            raise HTTPException(status_code=404, detail="Knowledge base not found")
+        rag_service = get_rag_service(db)
+        kb_timeout = federated.kb_timeout_ms / 1000 if federated.kb_timeout_ms else None
+        response = await rag_service.query_federated([found[kb_uuid] for kb_uuid in kb_uuids if kb_uuid in found], federated.query, top_k=federated.top_k, kb_timeout=kb_timeout)
+        response["knowledge_bases"] += [
+            {"knowledge_base_id": str(kb_uuid), "status": "not_found"} for kb_uuid in kb_uuids if kb_uuid not in found
+        ]
+        return response
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Query failed: {str(e)}")
+
+
 @router.post("/feedback", response_model=QueryFeedbackOut, summary="Submit feedback for a query", response_description="Feedback submission confirmation")
 async def submit_query_feedback(
     feedback: QueryFeedbackCreate,
@@ -1,26 +1,47 @@
 import anthropic
-from typing import List
-import os
+from typing import List, Dict, Any, AsyncIterator
+from app.core.providers.http import with_shared_pool, provider_timeout, provider_max_retries
 
 class AnthropicProviderClient:
     def __init__(self, api_key: str, completion_model: str = "claude-3-opus-20240229"):
         self.api_key = api_key
         self.completion_model = completion_model
-        self.client = anthropic.Anthropic(api_key=api_key)
+        self.client = with_shared_pool(
+            anthropic.AsyncAnthropic,
+            api_key=api_key,
+            timeout=provider_timeout(),
+            max_retries=provider_max_retries()
+        )
 
     async def embed_texts(self, texts: List[str]) -> List[List[float]]:
         # Anthropic does not (yet) provide embeddings as of 2024-04
         raise NotImplementedError("Anthropic does not support embeddings yet.")
 
-    async def complete(self, prompt: str, **kwargs) -> str:
-        import asyncio
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, self._complete_sync, prompt, kwargs)
+    @staticmethod
+    def _usage(usage) -> Dict[str, int]:
+        return {
+            "prompt_tokens": usage.input_tokens,
+            "completion_tokens": usage.output_tokens,
+            "total_tokens": usage.input_tokens + usage.output_tokens
+        }
 
-    def _complete_sync(self, prompt: str, kwargs) -> str:
-        response = self.client.messages.create(
-            model=self.completion_model,
+    async def complete(self, prompt: str, **kwargs) -> Dict[str, Any]:
+        response = await self.client.messages.create(
+            model=kwargs.get("model", self.completion_model),
             max_tokens=kwargs.get("max_tokens", 512),
             messages=[{"role": "user", "content": prompt}]
         )
-        return response.content[0].text.strip() if response.content else ""
+        content = response.content[0].text.strip() if response.content else ""
+        return {"content": content, "usage": self._usage(response.usage), "model": response.model}
+
+    async def stream_complete(self, prompt: str, **kwargs) -> AsyncIterator[Dict[str, Any]]:
+        """Streams the completion as token events followed by a final 'done' event."""
+        async with self.client.messages.stream(
+            model=kwargs.get("model", self.completion_model),
+            max_tokens=kwargs.get("max_tokens", 512),
+            messages=[{"role": "user", "content": prompt}]
+        ) as stream:
+            async for text in stream.text_stream:
+                yield {"type": "token", "content": text}
+            message = await stream.get_final_message()
+        yield {"type": "done", "usage": self._usage(message.usage), "model": message.model}
@@ -1,44 +1,67 @@
 import openai
-from typing import List
 import os
+from typing import List, Dict, Any, AsyncIterator
+from app.core.providers.http import with_shared_pool, provider_timeout, provider_max_retries
 
 class AzureOpenAIProviderClient:
-    def __init__(self, api_key: str, endpoint: str, embedding_model: str, completion_model: str):
+    def __init__(self, api_key: str, endpoint: str, embedding_model: str, completion_model: str, api_version: str = None):
         self.api_key = api_key
         self.endpoint = endpoint.rstrip("/")
+        # Azure routes requests by deployment name, passed as the model
         self.embedding_model = embedding_model
         self.completion_model = completion_model
-        openai.api_key = api_key
-        openai.api_base = endpoint
-        
+        self.client = with_shared_pool(
+            openai.AsyncAzureOpenAI,
+            api_key=api_key,
+            azure_endpoint=self.endpoint,
+            api_version=api_version or os.getenv("AZURE_OPENAI_API_VERSION", "2024-06-01"),
+            timeout=provider_timeout(),
+            max_retries=provider_max_retries()
+        )
 
     async def embed_texts(self, texts: List[str]) -> List[List[float]]:
-        import asyncio
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, self._embed_texts_sync, texts)
-
-    def _embed_texts_sync(self, texts: List[str]) -> List[List[float]]:
         # Ensure texts are strings - important for PDF processing
         texts = [str(text) if not isinstance(text, str) else text for text in texts]
-        
-        # For Azure OpenAI, we need to use the deployment name as the engine
-        response = openai.Embedding.create(
+        response = await self.client.embeddings.create(
             input=texts,
-            engine=self.embedding_model
+            model=self.embedding_model
         )
-        
-        # Azure returns data in a different format
-        return [item["embedding"] for item in response["data"]]
+        return [item.embedding for item in response.data]
 
-    async def complete(self, prompt: str, **kwargs) -> str:
-        import asyncio
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, self._complete_sync, prompt, kwargs)
+    async def complete(self, prompt: str, **kwargs) -> Dict[str, Any]:
+        kwargs.pop("model", None)  # Always the configured deployment
+        response = await self.client.chat.completions.create(
+            model=self.completion_model,
+            messages=[{"role": "user", "content": prompt}],
+            **kwargs
+        )
+        usage = response.usage
+        usage_dict = {
+            "prompt_tokens": usage.prompt_tokens,
+            "completion_tokens": usage.completion_tokens,
+            "total_tokens": usage.total_tokens
+        } if usage else {}
+        return {"content": response.choices[0].message.content.strip(), "usage": usage_dict, "model": response.model}
 
-    def _complete_sync(self, prompt: str, kwargs) -> str:
-        response = openai.ChatCompletion.create(
-            engine=self.completion_model,
+    async def stream_complete(self, prompt: str, **kwargs) -> AsyncIterator[Dict[str, Any]]:
+        """Streams the completion as token events followed by a final 'done' event."""
+        kwargs.pop("model", None)
+        stream = await self.client.chat.completions.create(
+            model=self.completion_model,
             messages=[{"role": "user", "content": prompt}],
+            stream=True,
+            stream_options={"include_usage": True},
             **kwargs
         )
-        return response["choices"][0]["message"]["content"].strip()
+        usage_dict, model = {}, self.completion_model
+        async for chunk in stream:
+            model = chunk.model or model
+            if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+                yield {"type": "token", "content": chunk.choices[0].delta.content}
+            if chunk.usage:
+                usage_dict = {
+                    "prompt_tokens": chunk.usage.prompt_tokens,
+                    "completion_tokens": chunk.usage.completion_tokens,
+                    "total_tokens": chunk.usage.total_tokens
+                }
+        yield {"type": "done", "usage": usage_dict, "model": model}
@@ -1,32 +1,55 @@
 import cohere
-from typing import List
-import os
+from typing import List, Dict, Any, AsyncIterator
+from app.core.providers.http import get_http_client, provider_timeout
 
 class CohereProviderClient:
     def __init__(self, api_key: str, embedding_model: str = "embed-english-v3.0", completion_model: str = "command-r-plus"):
         self.api_key = api_key
         self.embedding_model = embedding_model
         self.completion_model = completion_model
-        self.client = cohere.Client(api_key)
+        self.client = cohere.AsyncClient(
+            api_key,
+            httpx_client=get_http_client(),
+            timeout=provider_timeout()
+        )
 
     async def embed_texts(self, texts: List[str]) -> List[List[float]]:
-        import asyncio
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, self._embed_texts_sync, texts)
-
-    def _embed_texts_sync(self, texts: List[str]) -> List[List[float]]:
-        response = self.client.embed(texts=texts, model=self.embedding_model)
+        response = await self.client.embed(texts=texts, model=self.embedding_model)
         return response.embeddings
 
-    async def complete(self, prompt: str, **kwargs) -> str:
-        import asyncio
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, self._complete_sync, prompt, kwargs)
+    @staticmethod
+    def _usage(meta) -> Dict[str, int]:
+        billed = getattr(meta, "billed_units", None)
+        if billed is None:
+            return {}
+        prompt_tokens = int(billed.input_tokens or 0)
+        completion_tokens = int(billed.output_tokens or 0)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
 
-    def _complete_sync(self, prompt: str, kwargs) -> str:
-        response = self.client.generate(
-            prompt=prompt,
-            model=self.completion_model,
+    async def complete(self, prompt: str, **kwargs) -> Dict[str, Any]:
+        model_to_use = kwargs.get("model", self.completion_model)
+        response = await self.client.chat(
+            message=prompt,
+            model=model_to_use,
             max_tokens=kwargs.get("max_tokens", 512)
         )
-        return response.generations[0].text.strip()
+        return {"content": response.text.strip(), "usage": self._usage(response.meta), "model": model_to_use}
+
+    async def stream_complete(self, prompt: str, **kwargs) -> AsyncIterator[Dict[str, Any]]:
+        """Streams the completion as token events followed by a final 'done' event."""
+        model_to_use = kwargs.get("model", self.completion_model)
+        usage_dict = {}
+        async for event in self.client.chat_stream(
+            message=prompt,
+            model=model_to_use,
+            max_tokens=kwargs.get("max_tokens", 512)
+        ):
+            if event.event_type == "text-generation":
+                yield {"type": "token", "content": event.text}
+            elif event.event_type == "stream-end":
+                usage_dict = self._usage(getattr(event.response, "meta", None))
+        yield {"type": "done", "usage": usage_dict, "model": model_to_use}
@@ -0,0 +1,54 @@
+import os
+import httpx
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def provider_timeout() -> float:
+    """Request timeout in seconds for provider calls (PROVIDER_HTTP_TIMEOUT_SECONDS)."""
+    return float(os.getenv("PROVIDER_HTTP_TIMEOUT_SECONDS", "60"))
+
+
+def provider_max_retries() -> int:
+    """Retries performed by the provider SDKs themselves (connection errors, 408/409/429/5xx)."""
+    return int(os.getenv("PROVIDER_SDK_MAX_RETRIES", "2"))
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Returns the process-wide keep-alive connection pool shared by every provider client."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        limits = httpx.Limits(
+            max_connections=int(os.getenv("PROVIDER_HTTP_MAX_CONNECTIONS", "100")),
+            max_keepalive_connections=int(os.getenv("PROVIDER_HTTP_MAX_KEEPALIVE", "20")),
+            keepalive_expiry=float(os.getenv("PROVIDER_HTTP_KEEPALIVE_EXPIRY_SECONDS", "30"))
+        )
+        timeout = httpx.Timeout(provider_timeout(), connect=float(os.getenv("PROVIDER_HTTP_CONNECT_TIMEOUT_SECONDS", "10")))
+        _http_client = httpx.AsyncClient(limits=limits, timeout=timeout, follow_redirects=True)
+        logger.info(f"Created provider HTTP pool (max_connections={limits.max_connections}, max_keepalive={limits.max_keepalive_connections})")
+    return _http_client
+
+
+async def close_http_client():
+    """Closes the shared pool; called on application shutdown."""
+    global _http_client
+    if _http_client is not None and not _http_client.is_closed:
+        await _http_client.aclose()
+    _http_client = None
+
+
+def with_shared_pool(factory, **kwargs):
+    """Constructs an SDK client on the shared pool.
+
+    SDK builds that bundle their own HTTP library reject an `httpx.AsyncClient`;
+    those fall back to the SDK's own keep-alive pool (one per client instance).
+    """
+    try:
+        return factory(http_client=get_http_client(), **kwargs)
+    except TypeError as e:
+        logger.info(f"{getattr(factory, '__name__', factory)} does not accept the shared httpx pool ({e}); using its own connection pool.")
+        return factory(**kwargs)
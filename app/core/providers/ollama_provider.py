@@ -1,5 +1,6 @@
-import requests
-from typing import List
+import json
+from typing import List, Dict, Any, AsyncIterator
+from app.core.providers.http import get_http_client
 
 class OllamaProviderClient:
     def __init__(self, host: str, model: str = "llama2"):
@@ -11,11 +12,36 @@ class OllamaProviderClient:
         # You would need to add your own embedding logic or call a compatible endpoint
         raise NotImplementedError("Ollama embedding not implemented. Use OpenAI or another provider.")
 
-    async def complete(self, prompt: str, **kwargs) -> str:
-        # Call Ollama's completion endpoint
+    @staticmethod
+    def _usage(data: Dict[str, Any]) -> Dict[str, int]:
+        prompt_tokens = data.get("prompt_eval_count", 0)
+        completion_tokens = data.get("eval_count", 0)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+
+    async def complete(self, prompt: str, **kwargs) -> Dict[str, Any]:
+        # Call Ollama's completion endpoint on the shared async connection pool
         url = f"{self.host}/api/generate"
-        payload = {"model": self.model, "prompt": prompt}
-        response = requests.post(url, json=payload, timeout=60)
+        payload = {"model": kwargs.get("model", self.model), "prompt": prompt, "stream": False}
+        response = await get_http_client().post(url, json=payload)
         response.raise_for_status()
         data = response.json()
-        return data.get("response", "")
+        return {"content": data.get("response", ""), "usage": self._usage(data), "model": data.get("model", payload["model"])}
+
+    async def stream_complete(self, prompt: str, **kwargs) -> AsyncIterator[Dict[str, Any]]:
+        """Streams the completion as token events followed by a final 'done' event."""
+        url = f"{self.host}/api/generate"
+        payload = {"model": kwargs.get("model", self.model), "prompt": prompt, "stream": True}
+        async with get_http_client().stream("POST", url, json=payload) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                data = json.loads(line)
+                if data.get("response"):
+                    yield {"type": "token", "content": data["response"]}
+                if data.get("done"):
+                    yield {"type": "done", "usage": self._usage(data), "model": data.get("model", payload["model"])}
@@ -1,60 +1,74 @@
 import openai
-from typing import List, Dict, Any
-import os
+from typing import List, Dict, Any, AsyncIterator
+from app.core.providers.http import with_shared_pool, provider_timeout, provider_max_retries
 
 class OpenAIProviderClient:
     def __init__(self, api_key: str, embedding_model: str = "text-embedding-ada-002", completion_model: str = "gpt-3.5-turbo"):
         self.api_key = api_key
         self.embedding_model = embedding_model
         self.completion_model = completion_model
-        openai.api_key = api_key
+        # Native async client on the shared connection pool; credentials stay on this instance
+        self.client = with_shared_pool(
+            openai.AsyncOpenAI,
+            api_key=api_key,
+            timeout=provider_timeout(),
+            max_retries=provider_max_retries()
+        )
 
     async def embed_texts(self, texts: List[str]) -> List[List[float]]:
-        # OpenAI's API is synchronous, so run in thread executor if needed
-        import asyncio
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, self._embed_texts_sync, texts)
-
-    def _embed_texts_sync(self, texts: List[str]) -> List[List[float]]:
         # Ensure texts are strings - important for PDF processing
         texts = [str(text) if not isinstance(text, str) else text for text in texts]
-        
-        response = openai.embeddings.create(
+        response = await self.client.embeddings.create(
             input=texts,
             model=self.embedding_model
         )
-        # Fix: openai>=1.0 returns an object, not a dict
         return [item.embedding for item in response.data]
 
     async def complete(self, prompt: str, **kwargs) -> Dict[str, Any]:
         """
-        Calls the OpenAI completion API and returns the content and usage info.
+        Calls the OpenAI chat completion API and returns the content and usage info.
         Returns:
-            Dict containing 'content' (str) and 'usage' (Dict)
+            Dict containing 'content' (str), 'usage' (Dict) and 'model' (str)
         """
-        import asyncio
-        loop = asyncio.get_event_loop()
-        # _complete_sync now returns the full response object
-        response = await loop.run_in_executor(None, self._complete_sync, prompt, kwargs)
+        # Use the completion_model specified during init unless overridden in kwargs
+        model_to_use = kwargs.pop('model', self.completion_model)
+        response = await self.client.chat.completions.create(
+            model=model_to_use,
+            messages=[{"role": "user", "content": prompt}],
+            **kwargs
+        )
         content = response.choices[0].message.content.strip()
         usage = response.usage
-        # Convert usage Pydantic model to dict for easier handling/serialization
         usage_dict = {
             "prompt_tokens": usage.prompt_tokens,
             "completion_tokens": usage.completion_tokens,
             "total_tokens": usage.total_tokens
         }
-        return {"content": content, "usage": usage_dict, "model": response.model} # Also return model used
+        return {"content": content, "usage": usage_dict, "model": response.model}
 
-    def _complete_sync(self, prompt: str, kwargs) -> Any:
+    async def stream_complete(self, prompt: str, **kwargs) -> AsyncIterator[Dict[str, Any]]:
         """
-        Synchronous call to OpenAI completion API. Returns the full response object.
+        Streams the completion. Yields {'type': 'token', 'content'} events as the model
+        emits them, then a final {'type': 'done', 'usage', 'model'} event.
         """
-        # Use the completion_model specified during init unless overridden in kwargs
         model_to_use = kwargs.pop('model', self.completion_model)
-        response = openai.chat.completions.create(
+        stream = await self.client.chat.completions.create(
             model=model_to_use,
             messages=[{"role": "user", "content": prompt}],
+            stream=True,
+            stream_options={"include_usage": True},
             **kwargs
         )
-        return response # Return the whole response object
+        usage_dict, model = {}, model_to_use
+        async for chunk in stream:
+            model = chunk.model or model
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield {"type": "token", "content": chunk.choices[0].delta.content}
+            if chunk.usage:
+                # Sent in a final chunk with no choices when include_usage is set
+                usage_dict = {
+                    "prompt_tokens": chunk.usage.prompt_tokens,
+                    "completion_tokens": chunk.usage.completion_tokens,
+                    "total_tokens": chunk.usage.total_tokens
+                }
+        yield {"type": "done", "usage": usage_dict, "model": model}
@@ -0,0 +1,29 @@
+import json
+import logging
+from typing import Any, AsyncIterator, Tuple
+from fastapi.responses import StreamingResponse
+
+logger = logging.getLogger(__name__)
+
+
+def format_sse(event: str, data: Any) -> str:
+    """Encodes one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def sse_response(events: AsyncIterator[Tuple[str, Any]]) -> StreamingResponse:
+    """Streams (event, data) pairs as text/event-stream; failures mid-stream become an 'error' event."""
+    async def body():
+        try:
+            async for event, data in events:
+                yield format_sse(event, data)
+        except Exception as e:
+            logger.error(f"Streaming response failed: {e}", exc_info=True)
+            yield format_sse("error", {"detail": f"Query failed: {str(e)}"})
+
+    return StreamingResponse(
+        body(),
+        media_type="text/event-stream",
+        # Keep proxies (e.g. nginx) from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -0,0 +1,110 @@
+"""
+Migrates rag_embedding from JSON text vectors to the binary vector_blob column.
+
+Adds the new columns if they are missing, then converts rows in batches:
+
+    python -m app.db.migrate_embeddings [--dtype float32|float16|int8] [--batch-size 1000] [--keep-json]
+
+The script can be interrupted and re-run; it only touches rows whose
+vector_blob is still NULL. Unless --keep-json is given, the JSON text is
+cleared once the blob is written. Afterwards, rows without a content_hash
+get one computed from their chunk text so the embedding cache can reuse them.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+from sqlalchemy import text, update, bindparam
+from sqlalchemy.future import select
+from app.db.database import engine, AsyncSessionLocal
+from app.models import Embedding, DocumentChunk
+from app.services.embedding_cache import content_hash
+from app.services.vector_codec import encode_vector, default_storage_dtype, STORAGE_DTYPES
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_STATEMENTS = [
+    "ALTER TABLE rag_embedding ADD COLUMN IF NOT EXISTS vector_blob BYTEA",
+    "ALTER TABLE rag_embedding ADD COLUMN IF NOT EXISTS vector_dtype VARCHAR(16)",
+    "ALTER TABLE rag_embedding ADD COLUMN IF NOT EXISTS vector_scale DOUBLE PRECISION",
+    "ALTER TABLE rag_embedding ALTER COLUMN vector DROP NOT NULL",
+    "ALTER TABLE rag_embedding ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)",
+    "CREATE INDEX IF NOT EXISTS ix_rag_embedding_content_hash ON rag_embedding (content_hash)",
+]
+
+
+async def migrate(dtype: str, batch_size: int, keep_json: bool):
+    async with engine.begin() as conn:
+        for statement in SCHEMA_STATEMENTS:
+            await conn.execute(text(statement))
+
+    start_time = time.time()
+    converted = 0
+    stmt = (
+        update(Embedding)
+        .where(Embedding.id == bindparam("row_id"))
+        .values(
+            vector_blob=bindparam("blob"),
+            vector_dtype=bindparam("dtype"),
+            vector_scale=bindparam("scale"),
+            **({} if keep_json else {"vector": None})
+        )
+        .execution_options(synchronize_session=False)
+    )
+    while True:
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                select(Embedding.id, Embedding.vector)
+                .where(Embedding.vector_blob.is_(None), Embedding.vector.isnot(None))
+                .limit(batch_size)
+            )).all()
+            if not rows:
+                break
+            params = []
+            for row_id, vector_json in rows:
+                blob, row_dtype, scale = encode_vector(json.loads(vector_json), dtype)
+                params.append({"row_id": row_id, "blob": blob, "dtype": row_dtype, "scale": scale})
+            await (await db.connection()).execute(stmt, params)
+            await db.commit()
+        converted += len(rows)
+        elapsed = time.time() - start_time
+        logger.info(f"Converted {converted} embeddings ({converted / elapsed:.0f} rows/s)")
+
+    elapsed = time.time() - start_time
+    print(f"Migrated {converted} embeddings to {dtype} in {elapsed:.1f}s")
+    await backfill_content_hashes(batch_size)
+
+
+async def backfill_content_hashes(batch_size: int):
+    hashed = 0
+    stmt = (
+        update(Embedding)
+        .where(Embedding.id == bindparam("row_id"))
+        .values(content_hash=bindparam("hash"))
+        .execution_options(synchronize_session=False)
+    )
+    while True:
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                select(Embedding.id, DocumentChunk.text)
+                .join(DocumentChunk, Embedding.chunk_id == DocumentChunk.id)
+                .where(Embedding.content_hash.is_(None))
+                .limit(batch_size)
+            )).all()
+            if not rows:
+                break
+            await (await db.connection()).execute(stmt, [{"row_id": row_id, "hash": content_hash(chunk_text)} for row_id, chunk_text in rows])
+            await db.commit()
+        hashed += len(rows)
+    print(f"Backfilled content hashes for {hashed} embeddings")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert JSON embedding vectors to binary storage.")
+    parser.add_argument("--dtype", choices=list(STORAGE_DTYPES), default=None, help="Storage dtype (defaults to EMBEDDING_STORAGE_DTYPE)")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--keep-json", action="store_true", help="Keep the legacy JSON text after conversion")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(migrate(args.dtype or default_storage_dtype(), args.batch_size, args.keep_json))
@@ -0,0 +1,47 @@
+"""
+Adds columns introduced since a database was created to its existing tables.
+
+`init_db` only creates missing tables; this script brings older tables up to
+the current models:
+
+    python -m app.db.migrate_schema
+
+Every statement uses IF NOT EXISTS, so the script is safe to re-run.
+"""
+import asyncio
+from sqlalchemy import text
+from app.db.database import engine
+
+SCHEMA_STATEMENTS = [
+    # Per-KB vector index configuration
+    "ALTER TABLE rag_knowledge_base ADD COLUMN IF NOT EXISTS index_type VARCHAR(32) DEFAULT 'flat'",
+    "ALTER TABLE rag_knowledge_base ADD COLUMN IF NOT EXISTS index_nlist INTEGER",
+    "ALTER TABLE rag_knowledge_base ADD COLUMN IF NOT EXISTS index_pq_m INTEGER",
+    "ALTER TABLE rag_knowledge_base ADD COLUMN IF NOT EXISTS index_hnsw_m INTEGER",
+    "ALTER TABLE rag_knowledge_base ADD COLUMN IF NOT EXISTS index_nprobe INTEGER",
+    "ALTER TABLE rag_knowledge_base ADD COLUMN IF NOT EXISTS index_ef_search INTEGER",
+    # Semantic answer cache
+    "ALTER TABLE rag_knowledge_base ADD COLUMN IF NOT EXISTS semantic_cache_enabled BOOLEAN DEFAULT FALSE",
+    "ALTER TABLE rag_knowledge_base ADD COLUMN IF NOT EXISTS semantic_cache_threshold DOUBLE PRECISION",
+    "ALTER TABLE rag_query_log ADD COLUMN IF NOT EXISTS cache_hit BOOLEAN DEFAULT FALSE",
+    # Ingest jobs, context budgets, hybrid retrieval and document tags
+    "ALTER TABLE rag_document ADD COLUMN IF NOT EXISTS status_reason TEXT",
+    "ALTER TABLE rag_document ADD COLUMN IF NOT EXISTS tags JSON",
+    "ALTER TABLE rag_knowledge_base ADD COLUMN IF NOT EXISTS context_max_tokens INTEGER",
+    "ALTER TABLE rag_knowledge_base ADD COLUMN IF NOT EXISTS lexical_weight DOUBLE PRECISION",
+    "ALTER TABLE rag_query_log ADD COLUMN IF NOT EXISTS context_tokens INTEGER",
+    "ALTER TABLE rag_query_log ADD COLUMN IF NOT EXISTS context_tokens_saved INTEGER",
+    # Ingest job leases
+    "ALTER TABLE rag_ingest_job ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMP WITH TIME ZONE",
+]
+
+
+async def migrate():
+    async with engine.begin() as conn:
+        for statement in SCHEMA_STATEMENTS:
+            await conn.execute(text(statement))
+    print(f"Applied {len(SCHEMA_STATEMENTS)} schema statements")
+
+
+if __name__ == "__main__":
+    asyncio.run(migrate())
@@ -0,0 +1,54 @@
+"""
+Rebuilds knowledge base FAISS indexes from the embeddings stored in the database.
+
+    python -m app.db.rebuild_index <kb_id> [<kb_id> ...] [--batch-size 2048]
+    python -m app.db.rebuild_index --all
+
+Embeddings are streamed with a server-side cursor, so memory stays bounded by
+one batch. Each rebuilt index is swapped into place atomically.
+"""
+import argparse
+import asyncio
+import logging
+import uuid
+from sqlalchemy.future import select
+from app.db.database import AsyncSessionLocal
+from app.models import KnowledgeBase as KBModel
+from app.services.rag import get_rag_service
+
+logger = logging.getLogger(__name__)
+
+
+def print_progress(progress):
+    print(f"  {progress.rows} vectors, {progress.batches} batches, {progress.rows_per_sec:.0f} vectors/s", flush=True)
+
+
+async def rebuild(kb_ids, rebuild_all: bool, batch_size: int):
+    async with AsyncSessionLocal() as db:
+        if rebuild_all:
+            kbs = (await db.execute(select(KBModel))).scalars().all()
+        else:
+            kbs = []
+            for kb_id in kb_ids:
+                kb = await db.get(KBModel, uuid.UUID(kb_id))
+                if not kb:
+                    raise SystemExit(f"Knowledge base not found: {kb_id}")
+                kbs.append(kb)
+
+        rag_service = get_rag_service(db)
+        for kb in kbs:
+            print(f"Rebuilding index for KB {kb.id} ({kb.name}, {kb.index_type or 'flat'})", flush=True)
+            result = await rag_service.rebuild_index(kb, batch_size=batch_size, on_progress=print_progress)
+            print(f"Done: {result['vectors']} vectors in {result['seconds']}s ({result['vectors_per_sec']} vectors/s)", flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild FAISS indexes from stored embeddings.")
+    parser.add_argument("kb_ids", nargs="*", help="Knowledge base IDs to rebuild")
+    parser.add_argument("--all", action="store_true", help="Rebuild every knowledge base")
+    parser.add_argument("--batch-size", type=int, default=None, help="Embeddings per batch (defaults to INDEX_REBUILD_BATCH_SIZE)")
+    args = parser.parse_args()
+    if not args.kb_ids and not args.all:
+        parser.error("pass one or more kb_ids or --all")
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(rebuild(args.kb_ids, args.all, args.batch_size))
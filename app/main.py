@@ -5,6 +5,7 @@ from dotenv import load_dotenv
 from app.api import knowledge_base, query
 from app.api import document
 from app.api import ai_provider
+from app.api import metrics
 
 app = FastAPI(title="RAG Knowledge Management Service")
 
@@ -30,5 +31,22 @@ def include_routers(app: FastAPI):
     app.include_router(document.router, prefix="/api/v1/documents", tags=["Document"])
     app.include_router(ai_provider.router, prefix="/api/v1/ai_providers", tags=["AIProvider"])
     app.include_router(query.router, prefix="/api/v1/query", tags=["Query"])
+    app.include_router(metrics.router, prefix="/api/v1/metrics", tags=["Metrics"])
 
 include_routers(app)
+
+
+@app.on_event("startup")
+async def start_ingest_workers():
+    from app.services.ingest_queue import ingest_queue
+    ingest_queue.start()
+
+
+@app.on_event("shutdown")
+async def release_background_resources():
+    from app.services.ingest_queue import ingest_queue
+    await ingest_queue.stop()
+    from app.core.providers.http import close_http_client
+    await close_http_client()
+    from app.services.text_extraction import shutdown_extraction_pool
+    shutdown_extraction_pool()
@@ -5,6 +5,7 @@ from .document import Document
 from .document_chunk import DocumentChunk
 from .embedding import Embedding
 from .query_log import QueryLog
+from .ingest_job import IngestJob
 
 # You can define __all__ here if you want to control imports explicitly
 # __all__ = ["Base", "AIProvider", "KnowledgeBase", "Document", "DocumentChunk", "Embedding"]
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Text, DateTime, ForeignKey
+from sqlalchemy import Column, String, Text, DateTime, ForeignKey, JSON
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.sql import func
 import uuid
@@ -12,5 +12,7 @@ class Document(Base):
     title = Column(String(256), nullable=False)
     source = Column(Text, nullable=True)
     status = Column(String(32), default="pending")
+    status_reason = Column(Text, nullable=True)  # Why ingestion failed, when status is "failed"
+    tags = Column(JSON, nullable=True)  # List of lower-case tags, filterable in searches
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     knowledge_base = relationship("KnowledgeBase", back_populates="documents")
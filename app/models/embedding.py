@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Text, DateTime, ForeignKey
+from sqlalchemy import Column, String, Text, DateTime, ForeignKey, LargeBinary, Float
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.sql import func
 import uuid
@@ -12,6 +12,10 @@ class Embedding(Base):
     provider = Column(String(64), nullable=False)
     model = Column(String(128), nullable=False)
     version = Column(String(64), nullable=True)
-    vector = Column(Text, nullable=False)
+    vector = Column(Text, nullable=True)  # Legacy JSON-encoded vector; NULL once migrated to vector_blob
+    vector_blob = Column(LargeBinary, nullable=True)  # Packed little-endian vector (see app.services.vector_codec)
+    vector_dtype = Column(String(16), nullable=True)  # float32 | float16 | int8
+    vector_scale = Column(Float, nullable=True)  # Dequantization scale for int8 vectors
+    content_hash = Column(String(64), nullable=True, index=True)  # sha256 of the chunk text, for the embedding cache
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     chunk = relationship("DocumentChunk", back_populates="embeddings")
@@ -0,0 +1,23 @@
+from sqlalchemy import Column, String, Text, Integer, DateTime, ForeignKey, LargeBinary
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.sql import func
+import uuid
+from .base import Base
+from sqlalchemy.orm import relationship
+
+class IngestJob(Base):
+    __tablename__ = "rag_ingest_job"
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    knowledge_base_id = Column(UUID(as_uuid=True), ForeignKey("rag_knowledge_base.id"), nullable=False, index=True)
+    document_id = Column(UUID(as_uuid=True), ForeignKey("rag_document.id", ondelete="SET NULL"), nullable=True)
+    filename = Column(String(256), nullable=True)
+    content = Column(LargeBinary, nullable=True)  # Uploaded file; cleared once the job finishes
+    status = Column(String(32), nullable=False, default="queued", index=True)  # queued | processing | completed | failed
+    attempts = Column(Integer, nullable=False, default=0)
+    error = Column(Text, nullable=True)
+    result = Column(Text, nullable=True)  # JSON-encoded ingestion result
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)  # Renewed by the worker running the job (its lease)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    document = relationship("Document")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Text, Integer
+from sqlalchemy import Column, String, Text, Integer, Boolean, Float
 from sqlalchemy.dialects.postgresql import UUID
 import uuid
 from .base import Base
@@ -17,3 +17,17 @@ class KnowledgeBase(Base):
     chunk_size = Column(Integer, nullable=True, default=1000)
     chunk_overlap = Column(Integer, nullable=True, default=200)
     embedding_model = Column(String(128), nullable=True, default="text-embedding-ada-002")
+    context_max_tokens = Column(Integer, nullable=True)  # Prompt context budget; defaults to CONTEXT_MAX_TOKENS
+    lexical_weight = Column(Float, nullable=True)  # BM25 share of hybrid retrieval; defaults to HYBRID_LEXICAL_WEIGHT
+
+    # Vector index configuration (see app.services.faiss_manager.create_index)
+    index_type = Column(String(32), nullable=True, default="flat")  # flat, ivf_flat, ivf_pq, hnsw
+    index_nlist = Column(Integer, nullable=True)
+    index_pq_m = Column(Integer, nullable=True)
+    index_hnsw_m = Column(Integer, nullable=True)
+    index_nprobe = Column(Integer, nullable=True)
+    index_ef_search = Column(Integer, nullable=True)
+
+    # Semantic answer cache (see app.services.semantic_cache)
+    semantic_cache_enabled = Column(Boolean, nullable=True, default=False)
+    semantic_cache_threshold = Column(Float, nullable=True)  # Cosine similarity; defaults to SEMANTIC_CACHE_DEFAULT_THRESHOLD
@@ -25,6 +25,9 @@ class QueryLog(Base):
     total_tokens = Column(Integer, nullable=True)
 
     latency_ms = Column(Float, nullable=True) # Time taken for the RAG query + LLM call
+    cache_hit = Column(Boolean, nullable=True, default=False) # Answer served from the semantic answer cache
+    context_tokens = Column(Integer, nullable=True) # Tokens of retrieved context placed in the prompt
+    context_tokens_saved = Column(Integer, nullable=True) # Tokens dropped by overlap dedupe and the context budget
 
     # Feedback fields
     feedback_rating = Column(Integer, nullable=True) # e.g., 1 (good), -1 (bad), 0 (neutral/removed)
@@ -1,4 +1,5 @@
-from .knowledge_base import KnowledgeBaseCreate, KnowledgeBaseOut, KnowledgeBase, KnowledgeBaseUpdate
-from .document import DocumentCreate, DocumentOut
-from .query import QueryRequest, QueryResponse
-from .ai_provider import AIProviderCreate, AIProviderOut
\ No newline at end of file
+from .knowledge_base import KnowledgeBaseCreate, KnowledgeBaseOut, KnowledgeBase, KnowledgeBaseUpdate, IndexRebuildRequest
+from .document import DocumentCreate, DocumentOut, DocumentUpdate
+from .query import QueryRequest, QueryResponse, BatchSearchRequest, BatchSearchResponse, SearchResult, SearchHit, SearchRequest, SearchResponse, FederatedQueryRequest, FederatedQueryResponse, SearchFilter
+from .ai_provider import AIProviderCreate, AIProviderOut
+from .ingest_job import IngestJobOut
\ No newline at end of file
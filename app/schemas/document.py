@@ -1,11 +1,12 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 
 class DocumentCreate(BaseModel):
     title: str
     source: Optional[str] = None
     status: Optional[str] = None
+    tags: Optional[List[str]] = None
 
 class DocumentOut(BaseModel):
     id: str
@@ -13,4 +14,10 @@ class DocumentOut(BaseModel):
     title: str
     source: Optional[str] = None
     status: str
+    status_reason: Optional[str] = None
     created_at: Optional[datetime] = None
+    tags: Optional[List[str]] = None
+
+class DocumentUpdate(BaseModel):
+    title: Optional[str] = None
+    tags: Optional[List[str]] = None
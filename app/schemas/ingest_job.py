@@ -0,0 +1,18 @@
+from pydantic import BaseModel
+from typing import Any, Dict, Optional
+from datetime import datetime
+
+class IngestJobOut(BaseModel):
+    id: str
+    knowledge_base_id: str
+    document_id: Optional[str] = None
+    filename: Optional[str] = None
+    status: str
+    attempts: int = 0
+    error: Optional[str] = None
+    result: Optional[Dict[str, Any]] = None
+    document_status: Optional[str] = None
+    document_status_reason: Optional[str] = None
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
@@ -6,10 +6,20 @@ class KnowledgeBaseCreate(BaseModel):
     name: str
     description: Optional[str] = None
     ai_provider: Optional[str] = None  # Provider ID or name
-    chunking_strategy: Optional[str] = Field(default="recursive", description="Chunking strategy (e.g., 'recursive', 'fixed_size')")
-    chunk_size: Optional[int] = Field(default=1000, description="Target chunk size")
+    chunking_strategy: Optional[str] = Field(default="recursive", description="Chunking strategy ('recursive', 'fixed_size', 'token')")
+    chunk_size: Optional[int] = Field(default=1000, description="Target chunk size (words; tokens for the 'token' strategy)")
     chunk_overlap: Optional[int] = Field(default=200, description="Chunk overlap size")
     embedding_model: Optional[str] = Field(default="text-embedding-ada-002", description="Embedding model name")
+    context_max_tokens: Optional[int] = Field(default=None, ge=1, description="Token budget for retrieved context in prompts")
+    lexical_weight: Optional[float] = Field(default=None, ge=0, le=1, description="Weight of BM25 keyword search in hybrid retrieval (0 = vector search only)")
+    index_type: Optional[str] = Field(default="flat", description="Vector index type ('flat', 'ivf_flat', 'ivf_pq', 'hnsw')")
+    index_nlist: Optional[int] = Field(default=None, description="IVF: number of clusters")
+    index_pq_m: Optional[int] = Field(default=None, description="IVF-PQ: number of sub-quantizers")
+    index_hnsw_m: Optional[int] = Field(default=None, description="HNSW: graph degree")
+    index_nprobe: Optional[int] = Field(default=None, description="IVF: clusters searched per query")
+    index_ef_search: Optional[int] = Field(default=None, description="HNSW: search candidate list size")
+    semantic_cache_enabled: Optional[bool] = Field(default=False, description="Reuse answers for near-duplicate questions")
+    semantic_cache_threshold: Optional[float] = Field(default=None, ge=0, le=1, description="Cosine similarity needed for a semantic cache hit")
 
 
 class KnowledgeBaseOut(BaseModel):
@@ -21,6 +31,16 @@ class KnowledgeBaseOut(BaseModel):
     chunk_size: Optional[int] = None
     chunk_overlap: Optional[int] = None
     embedding_model: Optional[str] = None
+    context_max_tokens: Optional[int] = None
+    lexical_weight: Optional[float] = None
+    index_type: Optional[str] = None
+    index_nlist: Optional[int] = None
+    index_pq_m: Optional[int] = None
+    index_hnsw_m: Optional[int] = None
+    index_nprobe: Optional[int] = None
+    index_ef_search: Optional[int] = None
+    semantic_cache_enabled: Optional[bool] = None
+    semantic_cache_threshold: Optional[float] = None
 
     class Config:
         from_attributes = True # Renamed from orm_mode
@@ -34,6 +54,26 @@ class KnowledgeBaseUpdate(BaseModel):
     chunk_size: Optional[int] = None
     chunk_overlap: Optional[int] = None
     embedding_model: Optional[str] = None
+    context_max_tokens: Optional[int] = None
+    lexical_weight: Optional[float] = None
+    index_type: Optional[str] = None
+    index_nlist: Optional[int] = None
+    index_pq_m: Optional[int] = None
+    index_hnsw_m: Optional[int] = None
+    index_nprobe: Optional[int] = None
+    index_ef_search: Optional[int] = None
+    semantic_cache_enabled: Optional[bool] = None
+    semantic_cache_threshold: Optional[float] = Field(default=None, ge=0, le=1)
+
+
+class IndexRebuildRequest(BaseModel):
+    index_type: Optional[str] = Field(default=None, description="Target index type; defaults to the KB's current setting")
+    index_nlist: Optional[int] = None
+    index_pq_m: Optional[int] = None
+    index_hnsw_m: Optional[int] = None
+    index_nprobe: Optional[int] = None
+    index_ef_search: Optional[int] = None
+    batch_size: Optional[int] = Field(default=None, gt=0, description="Embeddings streamed from the database per batch")
 
 
 class KnowledgeBase(KnowledgeBaseOut):
@@ -1,5 +1,6 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, List
+from datetime import datetime
 import uuid
 
 class QueryRequest(BaseModel):
@@ -12,3 +13,79 @@ class QueryResponse(BaseModel):
     citations: Optional[List[str]] = None
     provider: Optional[str] = None
     log_id: uuid.UUID
+    cache_hit: Optional[bool] = None
+
+
+class SearchFilter(BaseModel):
+    """Metadata filter applied inside the vector search; all given conditions must hold."""
+    document_ids: Optional[List[str]] = Field(default=None, description="Only chunks of these documents")
+    tags: Optional[List[str]] = Field(default=None, description="Only documents with at least one of these tags")
+    created_after: Optional[datetime] = Field(default=None, description="Only documents created at or after this time")
+    created_before: Optional[datetime] = Field(default=None, description="Only documents created before this time")
+    title_contains: Optional[str] = Field(default=None, description="Only documents whose title contains this text (case-insensitive)")
+
+class BatchSearchRequest(BaseModel):
+    queries: List[str] = Field(..., min_length=1, description="Queries to retrieve chunks for")
+    top_k: int = Field(default=5, ge=1, le=100, description="Chunks returned per query")
+    filters: Optional[SearchFilter] = None
+
+class SearchHit(BaseModel):
+    chunk_id: str
+    document_id: str
+    title: Optional[str] = None  # Document title
+    chunk_index: int
+    text: str
+    score: float  # Rank score (reciprocal rank fusion of vector and BM25 results), higher is better
+    distance: Optional[float] = None  # Vector distance, when the chunk was a vector search hit
+
+class SearchResult(BaseModel):
+    query: str
+    hits: List[SearchHit]
+
+class BatchSearchResponse(BaseModel):
+    results: List[SearchResult]
+    latency_ms: float
+
+class SearchRequest(BaseModel):
+    query: str
+    limit: int = Field(default=10, ge=1, le=100, description="Results per page")
+    offset: int = Field(default=0, ge=0, description="Results to skip")
+    latency_budget_ms: Optional[float] = Field(default=None, gt=0, description="Drop retrieval steps that would exceed this budget")
+    filters: Optional[SearchFilter] = None
+
+class SearchResponse(BaseModel):
+    query: str
+    hits: List[SearchHit]
+    offset: int
+    limit: int
+    next_offset: Optional[int] = None  # Offset of the next page, if there is one
+    degraded: bool = False  # Part of the retrieval was skipped to meet the latency budget
+    latency_ms: float
+
+class FederatedQueryRequest(BaseModel):
+    knowledge_base_ids: List[str] = Field(..., min_length=1, description="Knowledge bases to search; the first responding one answers and logs the query")
+    query: str
+    top_k: int = Field(default=5, ge=1, le=100, description="Chunks used for context across all knowledge bases")
+    kb_timeout_ms: Optional[float] = Field(default=None, gt=0, description="Per knowledge base retrieval timeout; defaults to FEDERATED_KB_TIMEOUT_SECONDS")
+
+class FederatedCitation(BaseModel):
+    knowledge_base_id: str
+    chunk_id: str
+    document_id: str
+    title: Optional[str] = None
+    chunk_index: int
+    score: float  # Cosine similarity between the query and the chunk's embedding
+
+class FederatedKBStatus(BaseModel):
+    knowledge_base_id: str
+    status: str  # ok | timeout | error | not_found
+    hits: int = 0  # Chunks of this knowledge base in the merged top_k
+    latency_ms: Optional[float] = None
+    error: Optional[str] = None
+
+class FederatedQueryResponse(BaseModel):
+    answer: str
+    context: str
+    citations: List[FederatedCitation]
+    knowledge_bases: List[FederatedKBStatus]
+    log_id: uuid.UUID
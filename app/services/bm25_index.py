@@ -0,0 +1,482 @@
+import os
+import re
+import json
+import math
+import time
+import glob
+import logging
+import threading
+import numpy as np
+from collections import Counter, OrderedDict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from app.services.faiss_manager import file_lock
+
+logger = logging.getLogger(__name__)
+
+# Identifiers such as ERR-1042, SKU_88-B or pkg.module.func are kept whole *and* split into parts
+TOKEN_PATTERN = re.compile(r"[0-9a-z_]+(?:[-.:/#][0-9a-z_]+)*")
+PART_PATTERN = re.compile(r"[0-9a-z]+")
+MAX_TOKEN_LENGTH = 64
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have if in into is it its of on or that the their then there "
+    "these they this to was were will with".split()
+)
+
+K1 = float(os.getenv("BM25_K1", "1.2"))
+B = float(os.getenv("BM25_B", "0.75"))
+# Terms in more than this share of the documents are skipped when the query has rarer terms
+MAX_DF_RATIO = float(os.getenv("BM25_MAX_DF_RATIO", "0.2"))
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if len(token) > MAX_TOKEN_LENGTH:
+            continue
+        parts = PART_PATTERN.findall(token)
+        if parts != [token]:
+            tokens.append(token)
+            tokens.extend(part for part in parts if part not in STOPWORDS)
+        elif token not in STOPWORDS:
+            tokens.append(token)
+    return tokens
+
+
+class Delta:
+    """Postings added since the last merge, held in memory."""
+
+    def __init__(self):
+        self.postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        self.doc_len: Dict[int, int] = {}
+        self.total_len = 0
+
+    def add(self, doc_id: int, term_counts: Dict[str, int]):
+        if doc_id in self.doc_len:
+            return
+        length = sum(term_counts.values())
+        self.doc_len[doc_id] = length
+        self.total_len += length
+        for term, tf in term_counts.items():
+            ids, tfs = self.postings.setdefault(term, ([], []))
+            ids.append(doc_id)
+            tfs.append(min(tf, 65535))
+
+
+class BM25Index:
+    """Per-KB inverted index scored with BM25, keyed by the KB's FAISS vector ids.
+
+    The merged base is stored as CSR arrays (term offsets, doc ids, term
+    frequencies, doc lengths) in .npy files that are memory-mapped on load,
+    plus a newline-separated vocabulary. Adds and deletes are appended to a
+    JSON-lines log and kept in an in-memory delta; once the delta holds
+    BM25_MERGE_DOCS documents the log is sealed and a background thread
+    merges it into a new base. Loading replays any sealed logs the base does
+    not cover, then the active log.
+
+    Writes and merges take an exclusive `flock` on ``<path>.lock`` and first
+    reload records other processes wrote, so several processes can share the
+    files; take it before `lock`.
+    """
+
+    FILES = ("vocab", "offsets.npy", "ids.npy", "tfs.npy", "doclen.npy", "meta")
+
+    def __init__(self, path: str, merge_docs: Optional[int] = None):
+        self.path = path
+        self.log_path = path + ".log"
+        self.lock_path = path + ".lock"
+        self.merge_docs = merge_docs or int(os.getenv("BM25_MERGE_DOCS", "20000"))
+        self.lock = threading.RLock()
+        self._merge_lock = threading.Lock()
+        self.disk_signature = None
+        # Set while the FAISS index is swapped for a rebuilt one and vector ids no longer match
+        self.suspended = False
+        self._reset()
+        with file_lock(self.lock_path):
+            self.load()
+
+    def _reset(self):
+        self.terms: Dict[str, int] = {}
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.post_ids = np.zeros(0, dtype=np.int64)
+        self.post_tfs = np.zeros(0, dtype=np.uint16)
+        self.doc_len = np.zeros(0, dtype=np.uint32)
+        self.base_docs = 0
+        self.base_total_len = 0
+        self.covered: List[str] = []
+        self.merging: Optional[Delta] = None
+        self.delta = Delta()
+        self.deleted = set()
+
+    def _file(self, name: str) -> str:
+        return f"{self.path}.{name}"
+
+    # Persistence
+
+    def load(self):
+        with self.lock:
+            self._reset()
+            if os.path.exists(self._file("meta")):
+                try:
+                    with open(self._file("meta")) as f:
+                        meta = json.load(f)
+                    with open(self._file("vocab"), encoding="utf-8") as f:
+                        vocab = f.read()
+                    self.terms = {term: i for i, term in enumerate(vocab.split("\n"))} if vocab else {}
+                    self.offsets = np.load(self._file("offsets.npy"), mmap_mode="r")
+                    self.post_ids = np.load(self._file("ids.npy"), mmap_mode="r")
+                    self.post_tfs = np.load(self._file("tfs.npy"), mmap_mode="r")
+                    self.doc_len = np.load(self._file("doclen.npy"), mmap_mode="r")
+                    self.base_docs = meta["doc_count"]
+                    self.base_total_len = meta["total_len"]
+                    self.covered = meta.get("covered", [])
+                except Exception as e:
+                    logger.error(f"Error loading BM25 index {self.path}: {e}. Rebuild the KB index to recreate it.", exc_info=True)
+                    self._reset()
+            for log in self._sealed_logs() + [self.log_path]:
+                if os.path.basename(log) not in self.covered:
+                    self._replay(log)
+            self.disk_signature = self.read_disk_signature()
+
+    def _replay(self, log_path: str):
+        if not os.path.exists(log_path):
+            return
+        with open(log_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logger.warning(f"Skipping torn record at the end of {log_path}")
+                    break
+                self._apply(record)
+
+    def _apply(self, record: dict):
+        if record["op"] == "add":
+            for doc_id, term_counts in zip(record["ids"], record["tf"]):
+                self.delta.add(int(doc_id), term_counts)
+        else:
+            self.deleted.update(int(doc_id) for doc_id in record["ids"])
+
+    def _append(self, record: dict):
+        with open(self.log_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.disk_signature = self.read_disk_signature()
+
+    def _sealed_logs(self) -> List[str]:
+        return sorted(glob.glob(glob.escape(self.log_path) + ".*"), key=lambda p: int(p.rsplit(".", 1)[1]))
+
+    def read_disk_signature(self):
+        stats = []
+        for path in (self._file("meta"), self.log_path):
+            try:
+                st = os.stat(path)
+                stats.append((st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                stats.append(None)
+        return tuple(stats)
+
+    def reload_if_stale(self) -> bool:
+        """Reloads when another process has written to the index since this one last did."""
+        if self.read_disk_signature() == self.disk_signature or self._merge_lock.locked():
+            return False
+        # A merge elsewhere replaces the CSR files one at a time; only load once it has finished
+        with file_lock(self.lock_path), self.lock:
+            if self.read_disk_signature() == self.disk_signature:
+                return False
+            logger.info(f"BM25 index {self.path} changed on disk, reloading.")
+            self.load()
+        return True
+
+    def _catch_up(self):
+        # Caller holds the file lock, so nothing is being written to the log meanwhile
+        if self.read_disk_signature() != self.disk_signature:
+            logger.info(f"BM25 index {self.path} changed on disk, reloading.")
+            self.load()
+
+    # Writes
+
+    def add(self, doc_ids: Sequence[int], texts: Sequence[str]):
+        """Indexes `texts` under the FAISS vector ids they were stored with."""
+        if not len(doc_ids):
+            return
+        record = {"op": "add", "ids": [int(i) for i in doc_ids], "tf": [dict(Counter(tokenize(text))) for text in texts]}
+        with file_lock(self.lock_path), self.lock:
+            self._catch_up()
+            self._append(record)
+            self._apply(record)
+            should_merge = len(self.delta.doc_len) >= self.merge_docs
+        if should_merge:
+            self.merge_in_background()
+
+    def delete(self, doc_ids: Iterable[int]):
+        ids = [int(i) for i in doc_ids]
+        if not ids:
+            return
+        record = {"op": "delete", "ids": ids}
+        with file_lock(self.lock_path), self.lock:
+            self._catch_up()
+            self._append(record)
+            self._apply(record)
+
+    def replace(self, delta: "Delta"):
+        """Makes `delta` the whole index (written as a new base), dropping every log; used by rebuilds."""
+        with self._merge_lock, file_lock(self.lock_path), self.lock:
+            empty = ({}, np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint16), np.zeros(0, dtype=np.uint32), 0, 0)
+            for path in self._sealed_logs() + [self.log_path]:
+                if os.path.exists(path):
+                    os.remove(path)
+            self._write_base(*self._merged(empty, delta, set()), covered=[])
+            self.load()
+            self.suspended = False
+
+    def merge_in_background(self):
+        threading.Thread(target=self.merge, name=f"bm25-merge-{os.path.basename(self.path)}", daemon=True).start()
+
+    def merge(self):
+        """Folds the delta and deletes into a new base, written next to the old one and swapped in."""
+        if not self._merge_lock.acquire(blocking=False):
+            return
+        try:
+            # Held for the whole merge so another process neither appends to the log being
+            # sealed nor writes a base of its own meanwhile
+            with file_lock(self.lock_path):
+                self._merge_file_locked()
+        except Exception as e:
+            logger.error(f"Error merging BM25 index {self.path}: {e}", exc_info=True)
+        finally:
+            self._merge_lock.release()
+
+    def _merge_file_locked(self):
+        with self.lock:
+            self._catch_up()
+            sealed_name = f"{self.log_path}.{time.time_ns()}"
+            if os.path.exists(self.log_path):
+                os.replace(self.log_path, sealed_name)
+            self.merging, self.delta = self.delta, Delta()
+            merging = self.merging
+            deleted = set(self.deleted)
+            base = (self.terms, self.offsets, self.post_ids, self.post_tfs, self.doc_len, self.base_docs, self.base_total_len)
+            sealed = [os.path.basename(p) for p in self._sealed_logs()]
+        start = time.time()
+        terms, offsets, post_ids, post_tfs, doc_len, doc_count, total_len = self._merged(base, merging, deleted)
+        self._write_base(terms, offsets, post_ids, post_tfs, doc_len, doc_count, total_len, covered=sealed)
+        with self.lock:
+            self.terms = {term: i for i, term in enumerate(terms)}
+            self.offsets = np.load(self._file("offsets.npy"), mmap_mode="r")
+            self.post_ids = np.load(self._file("ids.npy"), mmap_mode="r")
+            self.post_tfs = np.load(self._file("tfs.npy"), mmap_mode="r")
+            self.doc_len = np.load(self._file("doclen.npy"), mmap_mode="r")
+            self.base_docs, self.base_total_len = doc_count, total_len
+            self.merging = None
+            self.deleted -= deleted
+            # The new base covers the sealed logs; drop them, then the marker
+            for name in sealed:
+                os.remove(os.path.join(os.path.dirname(self.log_path), name))
+            self.covered = []
+            self._write_meta(doc_count, total_len, covered=[])
+            self.disk_signature = self.read_disk_signature()
+        logger.info(f"Merged BM25 index {self.path}: {doc_count} documents, {len(terms)} terms in {time.time() - start:.2f}s")
+
+    @staticmethod
+    def _merged(base, delta: Delta, deleted: set):
+        terms, offsets, post_ids, post_tfs, doc_len, doc_count, total_len = base
+        base_terms = sorted(terms, key=terms.get)
+        new_terms = sorted(set(base_terms).union(delta.postings))
+        position = {term: i for i, term in enumerate(new_terms)}
+
+        remap = np.array([position[term] for term in base_terms], dtype=np.int64)
+        term_idx = [np.repeat(remap, np.diff(np.asarray(offsets)))]
+        ids = [np.asarray(post_ids, dtype=np.int64)]
+        tfs = [np.asarray(post_tfs, dtype=np.uint16)]
+        for term, (term_ids, term_tfs) in delta.postings.items():
+            term_idx.append(np.full(len(term_ids), position[term], dtype=np.int64))
+            ids.append(np.asarray(term_ids, dtype=np.int64))
+            tfs.append(np.asarray(term_tfs, dtype=np.uint16))
+        term_idx, ids, tfs = np.concatenate(term_idx), np.concatenate(ids), np.concatenate(tfs)
+
+        max_id = max([len(doc_len) - 1] + list(delta.doc_len))
+        lengths = np.zeros(max_id + 1, dtype=np.uint32)
+        lengths[:len(doc_len)] = doc_len
+        for doc_id, length in delta.doc_len.items():
+            lengths[doc_id] = length
+        doc_count += len(delta.doc_len)
+        total_len += delta.total_len
+
+        if deleted:
+            dead = np.fromiter(deleted, dtype=np.int64)
+            dead = dead[(dead < len(lengths))]
+            doc_count -= int(np.count_nonzero(lengths[dead]))
+            total_len -= int(lengths[dead].sum())
+            lengths[dead] = 0
+            keep = ~np.isin(ids, dead)
+            term_idx, ids, tfs = term_idx[keep], ids[keep], tfs[keep]
+
+        order = np.lexsort((ids, term_idx))
+        term_idx, ids, tfs = term_idx[order], ids[order], tfs[order]
+        counts = np.bincount(term_idx, minlength=len(new_terms))
+        # Drop terms whose postings were all deleted
+        if len(new_terms) and not counts.all():
+            alive = counts > 0
+            new_terms = [term for term, keep_term in zip(new_terms, alive) if keep_term]
+            counts = counts[alive]
+        new_offsets = np.zeros(len(new_terms) + 1, dtype=np.int64)
+        np.cumsum(counts, out=new_offsets[1:])
+        return new_terms, new_offsets, ids, tfs, lengths, max(0, doc_count), max(0, total_len)
+
+    def _write_base(self, terms, offsets, post_ids, post_tfs, doc_len, doc_count, total_len, covered):
+        # Arrays and vocabulary first, then the meta file that makes them current
+        id_dtype = np.uint32 if len(doc_len) < 2 ** 32 else np.int64
+        for name, arr in (("offsets.npy", offsets), ("ids.npy", post_ids.astype(id_dtype)), ("tfs.npy", post_tfs), ("doclen.npy", doc_len)):
+            tmp = self._file(name) + ".tmp"
+            with open(tmp, "wb") as f:
+                np.save(f, arr)
+            os.replace(tmp, self._file(name))
+        tmp = self._file("vocab") + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write("\n".join(terms))
+        os.replace(tmp, self._file("vocab"))
+        self._write_meta(doc_count, total_len, covered)
+
+    def _write_meta(self, doc_count, total_len, covered):
+        tmp = self._file("meta") + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"doc_count": int(doc_count), "total_len": int(total_len), "covered": covered}, f)
+        os.replace(tmp, self._file("meta"))
+
+    # Search
+
+    @property
+    def doc_count(self) -> int:
+        deltas = [d for d in (self.merging, self.delta) if d is not None]
+        return max(0, self.base_docs + sum(len(d.doc_len) for d in deltas) - len(self.deleted))
+
+    def _document_frequency(self, term: str, deltas: List[Delta]) -> int:
+        idx = self.terms.get(term)
+        df = int(self.offsets[idx + 1] - self.offsets[idx]) if idx is not None else 0
+        return df + sum(len(d.postings[term][0]) for d in deltas if term in d.postings)
+
+    def _informative_terms(self, query_terms: List[str], deltas: List[Delta], n_docs: int) -> List[str]:
+        """Drops near-ubiquitous terms (their postings dominate the cost and barely move the
+        ranking) unless the query consists of nothing else."""
+        rare = [term for term in query_terms if self._document_frequency(term, deltas) <= MAX_DF_RATIO * n_docs]
+        return rare or query_terms
+
+    def search(self, query: str, top_k: int = 10) -> List[Tuple[int, float]]:
+        """Returns (vector id, BM25 score) pairs of the best-matching live documents."""
+        query_terms = list(dict.fromkeys(tokenize(query)))
+        if not query_terms:
+            return []
+        with self.lock:
+            deltas = [d for d in (self.merging, self.delta) if d is not None]
+            n_docs = self.doc_count
+            if n_docs == 0:
+                return []
+            total_len = self.base_total_len + sum(d.total_len for d in deltas)
+            avg_len = max(1.0, total_len / max(1, self.base_docs + sum(len(d.doc_len) for d in deltas)))
+            all_ids, all_scores = [], []
+            query_terms = self._informative_terms(query_terms, deltas, n_docs)
+            for term in query_terms:
+                ids, tfs, lengths = [], [], []
+                idx = self.terms.get(term)
+                if idx is not None:
+                    start, end = int(self.offsets[idx]), int(self.offsets[idx + 1])
+                    base_ids = np.asarray(self.post_ids[start:end], dtype=np.int64)
+                    ids.append(base_ids)
+                    tfs.append(np.asarray(self.post_tfs[start:end], dtype=np.float32))
+                    lengths.append(np.asarray(self.doc_len[base_ids], dtype=np.float32))
+                for d in deltas:
+                    posting = d.postings.get(term)
+                    if posting:
+                        ids.append(np.asarray(posting[0], dtype=np.int64))
+                        tfs.append(np.asarray(posting[1], dtype=np.float32))
+                        lengths.append(np.fromiter((d.doc_len[i] for i in posting[0]), dtype=np.float32, count=len(posting[0])))
+                if not ids:
+                    continue
+                ids, tfs, lengths = np.concatenate(ids), np.concatenate(tfs), np.concatenate(lengths)
+                df = len(ids)
+                idf = math.log(1 + (max(n_docs, df) - df + 0.5) / (df + 0.5))
+                all_ids.append(ids)
+                all_scores.append(idf * tfs * (K1 + 1) / (tfs + K1 * (1 - B + B * lengths / avg_len)))
+            deleted = np.fromiter(self.deleted, dtype=np.int64, count=len(self.deleted)) if self.deleted else None
+        if not all_ids:
+            return []
+        ids, scores = np.concatenate(all_ids), np.concatenate(all_scores)
+        if len(all_ids) > 1 and len(ids) > 65536:
+            # Dense accumulation is linear in the postings; sorting them (np.unique) is not
+            totals = np.bincount(ids, weights=scores)
+            unique_ids = np.flatnonzero(totals)
+            totals = totals[unique_ids]
+        elif len(all_ids) > 1:
+            unique_ids, inverse = np.unique(ids, return_inverse=True)
+            totals = np.bincount(inverse, weights=scores)
+        else:
+            unique_ids, totals = ids, scores
+        if deleted is not None:
+            live = ~np.isin(unique_ids, deleted)
+            unique_ids, totals = unique_ids[live], totals[live]
+        if len(totals) > top_k:
+            best = np.argpartition(-totals, top_k)[:top_k]
+        else:
+            best = np.arange(len(totals))
+        best = best[np.argsort(-totals[best])]
+        return [(int(unique_ids[i]), float(totals[i])) for i in best]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], weights: Sequence[float], k: int = 60) -> List[Tuple[str, float]]:
+    """Fuses ranked id lists: score(id) = sum(weight / (k + rank)), best first."""
+    scores: Dict[str, float] = {}
+    for ranking, weight in zip(rankings, weights):
+        if weight <= 0:
+            continue
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + weight / (k + rank)
+    return sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
+
+
+class BM25Registry:
+    """Process-wide LRU of loaded BM25 indexes keyed by KB id."""
+
+    def __init__(self, max_indexes: Optional[int] = None):
+        self.max_indexes = max_indexes if max_indexes is not None else int(os.getenv("BM25_REGISTRY_MAX_INDEXES", "32"))
+        self._entries: "OrderedDict[str, BM25Index]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Per-KB locks so a slow load of one index does not block lookups of others
+        self._load_locks: Dict[str, threading.Lock] = {}
+
+    def get(self, kb_id: str) -> BM25Index:
+        from app.services.faiss_manager import get_index_path
+        kb_id = str(kb_id)
+        index = self._lookup(kb_id)
+        if index is not None:
+            index.reload_if_stale()
+            return index
+
+        with self._lock:
+            load_lock = self._load_locks.setdefault(kb_id, threading.Lock())
+        with load_lock:
+            # Another thread may have finished loading while we waited
+            index = self._lookup(kb_id)
+            if index is not None:
+                return index
+            index = BM25Index(get_index_path(kb_id) + ".bm25")
+            with self._lock:
+                self._entries[kb_id] = index
+                while self.max_indexes and len(self._entries) > self.max_indexes:
+                    self._entries.popitem(last=False)
+        return index
+
+    def _lookup(self, kb_id: str) -> Optional[BM25Index]:
+        with self._lock:
+            index = self._entries.get(kb_id)
+            if index is not None:
+                self._entries.move_to_end(kb_id)
+            return index
+
+    def evict(self, kb_id: str):
+        with self._lock:
+            self._entries.pop(str(kb_id), None)
+            self._load_locks.pop(str(kb_id), None)
+
+
+bm25_registry = BM25Registry()
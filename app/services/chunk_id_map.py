@@ -0,0 +1,205 @@
+import numpy as np
+import os
+import uuid
+import logging
+from typing import Iterable, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+UUID_BYTES = 16
+# An all-zero slot marks a FAISS id with no chunk assigned
+EMPTY_SLOT = bytes(UUID_BYTES)
+# Trailer of a saved map that carries its sorted index: magic, then the slot count (int64)
+SORTED_MAGIC = b"CIDSORT1"
+SORTED_TRAILER_BYTES = 16
+
+
+def uuids_to_array(chunk_ids: Iterable) -> np.ndarray:
+    """Packs UUIDs (str or uuid.UUID) into an (n, 16) uint8 array."""
+    packed = b"".join(uuid.UUID(str(c)).bytes for c in chunk_ids)
+    return np.frombuffer(packed, dtype=np.uint8).reshape(-1, UUID_BYTES)
+
+
+def _as_void(arr: np.ndarray) -> np.ndarray:
+    return np.ascontiguousarray(arr).view(f"V{UUID_BYTES}").ravel()
+
+
+class ChunkIdMap:
+    """Fixed-width map from FAISS vector id to chunk UUID.
+
+    Slot ``i`` holds the 16 raw UUID bytes of the chunk stored under FAISS id ``i``.
+    The persisted part is a flat ``.ids`` file opened with ``np.memmap`` (zero-copy,
+    paged in on demand); ids appended since the last save live in an in-memory tail
+    until the next compaction writes a new file.
+
+    The file also carries the base's slots in sorted order with their ids, so
+    reverse lookups (`find`) binary-search a few pages instead of scanning every
+    slot. Files saved without it get the sorted index built in memory on first use.
+    """
+
+    def __init__(self, base: Optional[np.ndarray] = None, tail: Optional[np.ndarray] = None, base_sorted: Optional[tuple] = None):
+        self.base = base if base is not None else np.empty((0, UUID_BYTES), dtype=np.uint8)
+        self._tail = np.empty((0, UUID_BYTES), dtype=np.uint8) if tail is None else np.array(tail, dtype=np.uint8)
+        self._tail_len = len(self._tail)
+        self._base_sorted = base_sorted  # (order, sorted slots) of the base
+
+    @classmethod
+    def load(cls, path: str) -> "ChunkIdMap":
+        size = os.path.getsize(path)
+        if size == 0:
+            return cls()
+        count = None
+        if size >= SORTED_TRAILER_BYTES:
+            with open(path, "rb") as f:
+                f.seek(size - SORTED_TRAILER_BYTES)
+                trailer = f.read(SORTED_TRAILER_BYTES)
+            if trailer[:8] == SORTED_MAGIC:
+                count = int(np.frombuffer(trailer[8:], dtype="<i8")[0])
+                if size != count * (2 * UUID_BYTES + 8) + SORTED_TRAILER_BYTES:
+                    raise ValueError(f"Chunk id map {path} has an inconsistent sorted index ({size} bytes for {count} ids)")
+        if count is None:
+            # Saved before the sorted index existed: slots only
+            if size % UUID_BYTES:
+                raise ValueError(f"Chunk id map {path} has a truncated entry ({size} bytes)")
+            return cls(base=np.memmap(path, dtype=np.uint8, mode="r", shape=(size // UUID_BYTES, UUID_BYTES)))
+        if count == 0:
+            return cls()
+        base = np.memmap(path, dtype=np.uint8, mode="r", shape=(count, UUID_BYTES))
+        sorted_slots = np.memmap(path, dtype=f"V{UUID_BYTES}", mode="r", offset=count * UUID_BYTES, shape=(count,))
+        order = np.memmap(path, dtype="<i8", mode="r", offset=2 * count * UUID_BYTES, shape=(count,))
+        return cls(base=base, base_sorted=(order, sorted_slots))
+
+    @classmethod
+    def from_legacy_dict(cls, id_to_chunk: dict) -> "ChunkIdMap":
+        """Converts the old pickled {faiss_id: chunk_id} dict."""
+        id_map = cls()
+        for faiss_id, chunk_id in sorted(id_to_chunk.items()):
+            id_map.assign(int(faiss_id), uuids_to_array([chunk_id]))
+        return id_map
+
+    @classmethod
+    def from_chunk_ids(cls, chunk_ids: Sequence) -> "ChunkIdMap":
+        return cls(tail=uuids_to_array(chunk_ids))
+
+    def __len__(self) -> int:
+        return len(self.base) + self._tail_len
+
+    @property
+    def nbytes(self) -> int:
+        """Heap bytes held by the map; the memory-mapped base is file-backed and not counted."""
+        sorted_bytes = 0
+        if self._base_sorted is not None and not isinstance(self._base_sorted[0], np.memmap):
+            sorted_bytes = sum(arr.nbytes for arr in self._base_sorted)
+        return self._tail.nbytes + sorted_bytes
+
+    def assign(self, start_id: int, uuid_rows: np.ndarray):
+        """Stores consecutive entries starting at `start_id`.
+
+        Slots covered by the persisted base are left alone: the base is written
+        together with the index, so replayed WAL records never disagree with it.
+        """
+        base_len = len(self.base)
+        skip = max(0, base_len - start_id)
+        if skip >= len(uuid_rows):
+            return
+        uuid_rows = uuid_rows[skip:]
+        lo = start_id + skip - base_len
+        hi = lo + len(uuid_rows)
+        if hi > len(self._tail):
+            grown = np.zeros((max(hi, 2 * len(self._tail), 1024), UUID_BYTES), dtype=np.uint8)
+            grown[:self._tail_len] = self._tail[:self._tail_len]
+            self._tail = grown
+        self._tail[lo:hi] = uuid_rows
+        self._tail_len = max(self._tail_len, hi)
+
+    def append(self, chunk_ids: Sequence) -> int:
+        """Appends chunk ids after the last slot and returns the first assigned id."""
+        start_id = len(self)
+        self.assign(start_id, uuids_to_array(chunk_ids))
+        return start_id
+
+    def rows(self, ids: np.ndarray) -> np.ndarray:
+        """Vectorized gather of raw UUID rows; out-of-range ids come back as empty slots."""
+        ids = np.asarray(ids, dtype=np.int64)
+        out = np.zeros((len(ids), UUID_BYTES), dtype=np.uint8)
+        base_len = len(self.base)
+        in_base = (ids >= 0) & (ids < base_len)
+        out[in_base] = self.base[ids[in_base]]
+        in_tail = (ids >= base_len) & (ids < len(self))
+        out[in_tail] = self._tail[ids[in_tail] - base_len]
+        return out
+
+    def lookup(self, ids: np.ndarray) -> List[Optional[str]]:
+        """Resolves FAISS ids to chunk UUID strings (None for unassigned ids)."""
+        return [None if row == EMPTY_SLOT else str(uuid.UUID(bytes=row)) for row in map(bytes, self.rows(ids))]
+
+    def to_array(self) -> np.ndarray:
+        """Returns a contiguous (len, 16) copy of every slot."""
+        return np.concatenate([np.asarray(self.base), self._tail[:self._tail_len]])
+
+    def contains(self, chunk_ids: Sequence) -> np.ndarray:
+        """Boolean mask of which `chunk_ids` are present in the map."""
+        if not len(chunk_ids):
+            return np.zeros(0, dtype=bool)
+        return np.isin(_as_void(uuids_to_array(chunk_ids)), _as_void(self.to_array()))
+
+    def find(self, chunk_ids: Sequence) -> np.ndarray:
+        """Reverse lookup: FAISS ids whose slot holds one of `chunk_ids`.
+
+        The base is binary-searched through its sorted index; only the unsaved
+        tail is scanned.
+        """
+        if not len(chunk_ids) or not len(self):
+            return np.zeros(0, dtype=np.int64)
+        targets = _as_void(uuids_to_array(chunk_ids))
+        in_base = np.zeros(0, dtype=np.int64)
+        if len(self.base):
+            if self._base_sorted is None:
+                slots = _as_void(np.asarray(self.base))
+                order = np.argsort(slots)
+                self._base_sorted = (order, slots[order])
+            order, sorted_slots = self._base_sorted
+            lo = np.searchsorted(sorted_slots, targets, side="left")
+            hi = np.searchsorted(sorted_slots, targets, side="right")
+            if (hi > lo).any():
+                in_base = np.concatenate([np.asarray(order[l:h]) for l, h in zip(lo, hi) if h > l])
+        in_tail = np.flatnonzero(np.isin(_as_void(self._tail[:self._tail_len]), targets)) + len(self.base)
+        return np.concatenate([in_base, in_tail]).astype(np.int64)
+
+    def sorted_index(self) -> "tuple":
+        """(order, sorted slots) for repeated `locate` calls against an unchanging map."""
+        slots = _as_void(self.to_array())
+        order = np.argsort(slots)
+        return order, slots[order]
+
+    def locate(self, chunk_ids: Sequence, sorted_index: Optional[tuple] = None) -> np.ndarray:
+        """FAISS id holding each of `chunk_ids`, aligned with the input (-1 if absent)."""
+        if not len(chunk_ids) or not len(self):
+            return np.full(len(chunk_ids), -1, dtype=np.int64)
+        order, sorted_slots = sorted_index or self.sorted_index()
+        targets = _as_void(uuids_to_array(chunk_ids))
+        pos = np.minimum(np.searchsorted(sorted_slots, targets), len(sorted_slots) - 1)
+        return np.where(sorted_slots[pos] == targets, order[pos], -1).astype(np.int64)
+
+    def save(self, path: str):
+        """Writes every slot, then the sorted index and its trailer, to `path` atomically."""
+        tmp_path = path + ".tmp"
+        slots = self.to_array()
+        order = np.argsort(_as_void(slots), kind="stable").astype("<i8")
+        with open(tmp_path, "wb") as f:
+            f.write(slots.tobytes())
+            f.write(slots[order].tobytes())
+            f.write(order.tobytes())
+            f.write(SORTED_MAGIC + np.array([len(slots)], dtype="<i8").tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def rebase(self, path: str):
+        """Re-maps a freshly written base file, keeping entries appended after it in the tail."""
+        loaded = ChunkIdMap.load(path)
+        tail = self.to_array()[len(loaded.base):]
+        self.base = loaded.base
+        self._base_sorted = loaded._base_sorted
+        self._tail = tail
+        self._tail_len = len(tail)
@@ -0,0 +1,268 @@
+"""
+Chunking strategies, selected per knowledge base by `chunking_strategy`.
+
+Every chunker is an async generator that consumes a stream of text segments
+(PDF pages, DOCX paragraphs, or a whole text file) and yields chunks as soon
+as they are complete, so a document never has to be held as one string:
+
+- fixed_size: windows of `chunk_size` words, advancing `chunk_size - chunk_overlap` words
+- recursive:  paragraphs, split further into sentences and then words only when they
+              exceed `chunk_size` words, packed greedily with up to `chunk_overlap`
+              words of trailing context repeated in the next chunk; sentences longer
+              than `chunk_size` are cut into overlapping windows like fixed_size
+- token:      windows of `chunk_size` tokens of the embedding model's tokenizer
+              (tiktoken when installed, otherwise an approximate word/punctuation split)
+
+Throughput benchmark:
+
+    python -m app.services.chunking [--mb 20] [--chunk-size 1000] [--chunk-overlap 200] [files ...]
+"""
+import re
+import logging
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STRATEGY = "recursive"
+
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+Chunker = Callable[..., AsyncIterator[str]]
+CHUNKERS: Dict[str, Chunker] = {}
+
+
+def register_chunker(name: str):
+    def register(func: Chunker) -> Chunker:
+        CHUNKERS[name] = func
+        return func
+    return register
+
+
+def get_chunker(strategy: Optional[str]) -> Chunker:
+    """Returns the chunker for a KB's `chunking_strategy`; raises ValueError for unknown names."""
+    name = (strategy or DEFAULT_STRATEGY).lower()
+    if name not in CHUNKERS:
+        raise ValueError(f"Unsupported chunking_strategy '{strategy}'. Choose one of: {', '.join(sorted(CHUNKERS))}")
+    return CHUNKERS[name]
+
+
+def chunk_stream(segments: AsyncIterator[str], strategy: Optional[str], size: int = 1000, overlap: int = 200, model: Optional[str] = None) -> AsyncIterator[str]:
+    """Chunks a stream of text segments with the named strategy.
+
+    Strategies are validated when a KB is created or updated; a value stored before
+    that (when the field was free-form) falls back to the default instead of failing.
+    """
+    size = max(1, size or 1000)
+    overlap = min(max(0, overlap or 0), size - 1)
+    try:
+        chunker = get_chunker(strategy)
+    except ValueError:
+        logger.warning(f"Unknown chunking_strategy '{strategy}', using '{DEFAULT_STRATEGY}'")
+        chunker = CHUNKERS[DEFAULT_STRATEGY]
+    return chunker(segments, size=size, overlap=overlap, model=model)
+
+
+async def _windows(units: AsyncIterator[List], size: int, overlap: int, join: Callable[[List], str]) -> AsyncIterator[str]:
+    """Windows of `size` units every `size - overlap` units over a stream of unit lists."""
+    step = max(1, size - overlap)
+    window: List = []
+    async for batch in units:
+        window.extend(batch)
+        while len(window) >= size:
+            yield join(window[:size])
+            del window[:step]
+    # The tail: windows that run past the end of the text
+    while window:
+        yield join(window[:size])
+        if len(window) <= step:
+            break
+        del window[:step]
+
+
+@register_chunker("fixed_size")
+async def fixed_size_chunks(segments: AsyncIterator[str], size: int = 1000, overlap: int = 200, model: Optional[str] = None) -> AsyncIterator[str]:
+    async def words():
+        async for segment in segments:
+            yield segment.split()
+
+    async for chunk in _windows(words(), size, overlap, " ".join):
+        yield chunk
+
+
+def _split_oversized(paragraph: str, size: int, overlap: int = 0) -> Iterable[List[str]]:
+    """Yields the word lists of a paragraph's sentences, cutting sentences longer than `size`
+    words into windows of `size` words that repeat `overlap` words of the previous one."""
+    step = max(1, size - overlap)
+    for sentence in SENTENCE_END.split(paragraph):
+        words = sentence.split()
+        for i in range(0, len(words), step):
+            yield words[i:i + size]
+            if i + size >= len(words):
+                break
+
+
+@register_chunker("recursive")
+async def recursive_chunks(segments: AsyncIterator[str], size: int = 1000, overlap: int = 200, model: Optional[str] = None) -> AsyncIterator[str]:
+    # Pieces are (separator, text, word count); a chunk is a run of pieces joined by their separators
+    pieces: List[tuple] = []
+    words_in_chunk = 0
+    has_new_text = False
+
+    def pieces_of(paragraph: str):
+        word_count = len(paragraph.split())
+        if word_count == 0:
+            return
+        if word_count <= size:
+            yield "\n\n", paragraph.strip(), word_count
+            return
+        # Windows fill a chunk each and carry their own overlap
+        for words in _split_oversized(paragraph, size, overlap):
+            if words:
+                yield " ", " ".join(words), len(words)
+
+    def render() -> str:
+        return pieces[0][1] + "".join(sep + piece for sep, piece, _ in pieces[1:])
+
+    def carry_overlap():
+        # Keep the trailing pieces that fit in the overlap as the start of the next chunk
+        kept, kept_words = [], 0
+        for piece in reversed(pieces):
+            if kept_words + piece[2] > overlap:
+                break
+            kept.insert(0, piece)
+            kept_words += piece[2]
+        return kept, kept_words
+
+    async def paragraphs():
+        # Text of the unfinished paragraph, as segments joined once it ends; only each new
+        # segment (plus the whitespace it continues) is searched for paragraph breaks, so
+        # text without blank lines is not re-split on every segment
+        pending: List[str] = []
+        async for segment in segments:
+            if pending:
+                last = pending[-1].rstrip()
+                text = pending[-1][len(last):] + "\n" + segment
+                pending[-1] = last
+            else:
+                text = segment
+            parts = PARAGRAPH_BREAK.split(text)
+            if len(parts) == 1:
+                pending.append(text)
+                continue
+            yield "".join(pending) + parts[0]
+            for part in parts[1:-1]:
+                yield part
+            pending = [parts[-1]]
+        if pending:
+            yield "".join(pending)
+
+    async for paragraph in paragraphs():
+        for piece in pieces_of(paragraph):
+            if pieces and words_in_chunk + piece[2] > size:
+                yield render()
+                pieces, words_in_chunk = carry_overlap()
+                has_new_text = False
+                # The carried context must leave room for the new piece
+                while pieces and words_in_chunk + piece[2] > size:
+                    words_in_chunk -= pieces.pop(0)[2]
+            pieces.append(piece)
+            words_in_chunk += piece[2]
+            has_new_text = True
+    if has_new_text:
+        yield render()
+
+
+class _ApproximateTokenizer:
+    """Word/punctuation split used when tiktoken is not installed; close to BPE counts for English."""
+    PIECE = re.compile(r"\s*(?:\w+|[^\w\s])")
+
+    def encode(self, text: str) -> List[str]:
+        return self.PIECE.findall(text)
+
+    def decode(self, tokens: List[str]) -> str:
+        return "".join(tokens).strip()
+
+
+_tokenizers: Dict[str, object] = {}
+
+
+def get_tokenizer(model: Optional[str]):
+    """The embedding model's tokenizer: tiktoken's encoding for `model` (cl100k_base if the
+    model is unknown to tiktoken), or an approximate tokenizer when tiktoken is missing."""
+    key = model or ""
+    if key not in _tokenizers:
+        try:
+            import tiktoken
+            try:
+                _tokenizers[key] = tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding("cl100k_base")
+            except KeyError:
+                _tokenizers[key] = tiktoken.get_encoding("cl100k_base")
+        except ImportError:
+            logger.warning("tiktoken is not installed; token chunking uses approximate token counts.")
+            _tokenizers[key] = _ApproximateTokenizer()
+    return _tokenizers[key]
+
+
+@register_chunker("token")
+async def token_chunks(segments: AsyncIterator[str], size: int = 1000, overlap: int = 200, model: Optional[str] = None) -> AsyncIterator[str]:
+    tokenizer = get_tokenizer(model)
+
+    async def tokens():
+        first = True
+        async for segment in segments:
+            yield tokenizer.encode(segment if first else "\n" + segment)
+            first = False
+
+    async for chunk in _windows(tokens(), size, overlap, tokenizer.decode):
+        yield chunk
+
+
+if __name__ == "__main__":
+    import argparse
+    import asyncio
+    import random
+    import time
+
+    parser = argparse.ArgumentParser(description="Measure chunking throughput per strategy.")
+    parser.add_argument("files", nargs="*", help="Text files to chunk (defaults to a synthetic corpus)")
+    parser.add_argument("--mb", type=float, default=20, help="Size of the synthetic corpus in MB")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=200)
+    parser.add_argument("--model", default="text-embedding-ada-002", help="Tokenizer model for the token strategy")
+    parser.add_argument("--strategies", nargs="*", default=None)
+    args = parser.parse_args()
+
+    if args.files:
+        corpus = [open(path, encoding="utf-8", errors="ignore").read() for path in args.files]
+    else:
+        rng = random.Random(0)
+        vocab = ["retrieval", "index", "vector", "the", "a", "of", "document", "query", "model", "embedding",
+                 "latency", "throughput", "and", "is", "to", "chunk", "context", "answer", "search", "token"]
+        pages, total = [], 0
+        while total < args.mb * 1024 * 1024:
+            paragraphs = []
+            for _ in range(rng.randint(3, 8)):
+                sentences = [" ".join(rng.choices(vocab, k=rng.randint(5, 30))).capitalize() + "." for _ in range(rng.randint(2, 8))]
+                paragraphs.append(" ".join(sentences))
+            page = "\n\n".join(paragraphs)
+            pages.append(page)
+            total += len(page)
+        corpus = pages
+    corpus_mb = sum(len(page) for page in corpus) / (1024 * 1024)
+
+    async def segments():
+        for page in corpus:
+            yield page
+
+    async def run(strategy: str):
+        start = time.perf_counter()
+        count = 0
+        async for _ in chunk_stream(segments(), strategy, args.chunk_size, args.chunk_overlap, args.model):
+            count += 1
+        return count, time.perf_counter() - start
+
+    print(f"Corpus: {corpus_mb:.1f} MB in {len(corpus)} segments, chunk_size={args.chunk_size}, chunk_overlap={args.chunk_overlap}")
+    for strategy in args.strategies or sorted(CHUNKERS):
+        count, elapsed = asyncio.run(run(strategy))
+        print(f"{strategy:>10}: {count:8d} chunks in {elapsed:6.2f}s  {corpus_mb / elapsed:7.1f} MB/s  {count / elapsed:9.0f} chunks/s")
@@ -0,0 +1,123 @@
+import os
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence
+from app.services.chunking import get_tokenizer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "3000"))
+# Share of the completion model's context window the retrieved context may use at most
+MODEL_WINDOW_FRACTION = float(os.getenv("CONTEXT_MODEL_WINDOW_FRACTION", "0.5"))
+# A chunk is cut to fit the remaining budget only if at least this many tokens are left
+MIN_PARTIAL_CHUNK_TOKENS = int(os.getenv("CONTEXT_MIN_PARTIAL_CHUNK_TOKENS", "64"))
+CONTEXT_SEPARATOR = "\n---\n"
+
+# Context windows of common completion models, matched by name prefix (longest first)
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-3.5-turbo": 16385,
+    "gpt-4o": 128000,
+    "gpt-4-turbo": 128000,
+    "gpt-4.1": 1000000,
+    "gpt-4": 8192,
+    "claude": 200000,
+    "command-r": 128000,
+    "command": 4096,
+    "gemini": 1000000,
+    "llama2": 4096,
+    "llama3": 8192,
+    "mistral": 32768,
+}
+
+
+def model_context_window(model: Optional[str]) -> Optional[int]:
+    name = (model or "").lower()
+    for prefix in sorted(MODEL_CONTEXT_WINDOWS, key=len, reverse=True):
+        if name.startswith(prefix):
+            return MODEL_CONTEXT_WINDOWS[prefix]
+    return None
+
+
+def context_budget(kb, model: Optional[str]) -> int:
+    """Token budget for retrieved context: the KB's `context_max_tokens` (or CONTEXT_MAX_TOKENS),
+    capped at CONTEXT_MODEL_WINDOW_FRACTION of the completion model's context window."""
+    budget = getattr(kb, "context_max_tokens", None) or DEFAULT_CONTEXT_MAX_TOKENS
+    window = model_context_window(model)
+    if window:
+        budget = min(budget, int(window * MODEL_WINDOW_FRACTION))
+    return budget
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    return len(get_tokenizer(model).encode(text)) if text else 0
+
+
+def _overlap(previous: List[str], following: List[str]) -> int:
+    """Length of the longest suffix of `previous` that is also a prefix of `following`."""
+    for size in range(min(len(previous), len(following)), 0, -1):
+        if previous[-size:] == following[:size]:
+            return size
+    return 0
+
+
+@dataclass
+class BuiltContext:
+    text: str
+    chunks: List = field(default_factory=list)  # Chunks that made it into the context, in relevance order
+    tokens: int = 0
+    retrieved_tokens: int = 0  # Tokens of all retrieved chunks joined without dedupe or budget
+
+    @property
+    def tokens_saved(self) -> int:
+        return max(0, self.retrieved_tokens - self.tokens)
+
+
+def build_context(chunks: Sequence, budget: int, model: Optional[str] = None) -> BuiltContext:
+    """Assembles prompt context from `chunks` (DocumentChunk-like, most relevant first).
+
+    Text that neighbouring chunks of the same document share because of
+    `chunk_overlap` is included once, chunks with identical text are skipped,
+    and chunks are added in relevance order until the token budget is spent;
+    the first chunk that does not fit is cut to the remaining budget when
+    enough of it is left to be useful.
+    """
+    tokenizer = get_tokenizer(model)
+    separator_tokens = len(tokenizer.encode(CONTEXT_SEPARATOR))
+    words_of: Dict[tuple, List[str]] = {}
+    seen_texts = set()
+    parts: List[str] = []
+    used = []
+    tokens = 0
+
+    for chunk in chunks:
+        if chunk.text in seen_texts:
+            continue
+        seen_texts.add(chunk.text)
+        words = chunk.text.split()
+        start, end = 0, len(words)
+        previous = words_of.get((chunk.document_id, chunk.chunk_index - 1))
+        if previous is not None:
+            start = _overlap(previous, words)
+        following = words_of.get((chunk.document_id, chunk.chunk_index + 1))
+        if following is not None:
+            end = max(start, len(words) - _overlap(words, following))
+        words_of[(chunk.document_id, chunk.chunk_index)] = words
+        if start >= end:
+            continue
+        text = chunk.text if (start, end) == (0, len(words)) else " ".join(words[start:end])
+
+        cost = len(tokenizer.encode(text)) + (separator_tokens if parts else 0)
+        remaining = budget - tokens
+        if cost > remaining:
+            room = remaining - (separator_tokens if parts else 0)
+            if room >= MIN_PARTIAL_CHUNK_TOKENS:
+                parts.append(tokenizer.decode(tokenizer.encode(text)[:room]))
+                used.append(chunk)
+                tokens += room + (separator_tokens if len(parts) > 1 else 0)
+            break
+        parts.append(text)
+        used.append(chunk)
+        tokens += cost
+
+    retrieved_tokens = count_tokens(CONTEXT_SEPARATOR.join(chunk.text for chunk in chunks), model)
+    return BuiltContext(text=CONTEXT_SEPARATOR.join(parts), chunks=used, tokens=tokens, retrieved_tokens=retrieved_tokens)
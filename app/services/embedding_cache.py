@@ -0,0 +1,120 @@
+import os
+import json
+import sqlite3
+import hashlib
+import asyncio
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence
+from app.services.vector_codec import encode_vector, decode_vector
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(text: str) -> str:
+    """sha256 of the chunk text, the cache key alongside provider and model."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Embedding cache keyed by (provider, model, sha256(text)).
+
+    Lookups go to a local SQLite file first, then to `rag_embedding` rows that
+    carry a matching `content_hash` (hits from the database are copied into the
+    local file). The local file stores float32 vectors.
+    """
+
+    def __init__(self, path: Optional[str] = None, enabled: Optional[bool] = None):
+        self.path = path or os.getenv("EMBEDDING_CACHE_PATH", "./data/embedding_cache.sqlite3")
+        self.enabled = enabled if enabled is not None else os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._stats = {"lookups": 0, "local_hits": 0, "db_hits": 0, "misses": 0, "stored": 0}
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embedding_cache ("
+                "provider TEXT NOT NULL, model TEXT NOT NULL, content_hash TEXT NOT NULL, vector BLOB NOT NULL, "
+                "PRIMARY KEY (provider, model, content_hash))"
+            )
+            self._conn = conn
+        return self._conn
+
+    def _get_local(self, provider: str, model: str, hashes: Sequence[str]) -> Dict[str, List[float]]:
+        found = {}
+        with self._lock:
+            conn = self._connection()
+            # Stay under SQLite's bound-parameter limit
+            for i in range(0, len(hashes), 500):
+                part = hashes[i:i + 500]
+                rows = conn.execute(
+                    f"SELECT content_hash, vector FROM embedding_cache WHERE provider = ? AND model = ? "
+                    f"AND content_hash IN ({','.join('?' * len(part))})",
+                    [provider, model, *part]
+                ).fetchall()
+                found.update((h, decode_vector(blob, "float32").tolist()) for h, blob in rows)
+        return found
+
+    def _put_local(self, provider: str, model: str, vectors: Dict[str, List[float]]):
+        rows = [(provider, model, h, encode_vector(v, "float32")[0]) for h, v in vectors.items()]
+        with self._lock:
+            conn = self._connection()
+            conn.executemany("INSERT OR REPLACE INTO embedding_cache VALUES (?, ?, ?, ?)", rows)
+            conn.commit()
+
+    async def _get_db(self, db, provider: str, model: str, hashes: Sequence[str]) -> Dict[str, List[float]]:
+        from sqlalchemy.future import select
+        from app.models import Embedding
+        found = {}
+        for i in range(0, len(hashes), 1000):
+            rows = (await db.execute(
+                select(Embedding.content_hash, Embedding.vector_blob, Embedding.vector_dtype, Embedding.vector_scale, Embedding.vector)
+                .where(Embedding.provider == provider, Embedding.model == model, Embedding.content_hash.in_(hashes[i:i + 1000]))
+            )).all()
+            for h, blob, dtype, scale, vector_json in rows:
+                if h in found:
+                    continue
+                found[h] = decode_vector(blob, dtype, scale).tolist() if blob is not None else json.loads(vector_json)
+        return found
+
+    async def get_many(self, db, provider: str, model: str, hashes: Iterable[str]) -> Dict[str, List[float]]:
+        """Returns cached vectors for whichever of `hashes` are known."""
+        hashes = list(dict.fromkeys(hashes))
+        if not self.enabled or not hashes:
+            return {}
+        self._stats["lookups"] += len(hashes)
+        found = await asyncio.to_thread(self._get_local, provider, model, hashes)
+        self._stats["local_hits"] += len(found)
+        missing = [h for h in hashes if h not in found]
+        if missing and db is not None:
+            from_db = await self._get_db(db, provider, model, missing)
+            if from_db:
+                await asyncio.to_thread(self._put_local, provider, model, from_db)
+                found.update(from_db)
+                self._stats["db_hits"] += len(from_db)
+        self._stats["misses"] += len(hashes) - len(found)
+        return found
+
+    async def put_many(self, provider: str, model: str, vectors: Dict[str, List[float]]):
+        if not self.enabled or not vectors:
+            return
+        try:
+            await asyncio.to_thread(self._put_local, provider, model, vectors)
+            self._stats["stored"] += len(vectors)
+        except Exception as e:
+            # The cache is an optimization; never fail an ingest because of it
+            logger.warning(f"Failed to write {len(vectors)} embeddings to cache {self.path}: {e}")
+
+    def stats(self) -> Dict[str, float]:
+        stats = dict(self._stats)
+        hits = stats["local_hits"] + stats["db_hits"]
+        stats["hit_rate"] = round(hits / stats["lookups"], 4) if stats["lookups"] else 0.0
+        stats["enabled"] = self.enabled
+        return stats
+
+
+embedding_cache = EmbeddingCache()
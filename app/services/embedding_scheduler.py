@@ -0,0 +1,144 @@
+import os
+import time
+import random
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English text)."""
+    return len(text) // 4 + 1
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """True for rate-limit (429) and transient server (5xx) errors from any provider SDK."""
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    name = type(error).__name__
+    return "RateLimit" in name or "Timeout" in name
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Reads a Retry-After header off the provider error, if it carries one."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class EmbeddingScheduler:
+    """Splits embedding inputs into provider-sized batches and runs them concurrently.
+
+    Batches are capped by item count and an estimated token budget. At most
+    `max_concurrency` embedding requests are in flight per process (shared by
+    every ingest). Rate-limit and transient errors are retried with jittered
+    exponential backoff. Results come back in input order.
+    """
+
+    def __init__(
+        self,
+        max_batch_items: Optional[int] = None,
+        max_batch_tokens: Optional[int] = None,
+        max_concurrency: Optional[int] = None,
+        max_retries: Optional[int] = None,
+        backoff_base: Optional[float] = None,
+    ):
+        self.max_batch_items = max_batch_items or int(os.getenv("EMBED_BATCH_MAX_ITEMS", "256"))
+        self.max_batch_tokens = max_batch_tokens or int(os.getenv("EMBED_BATCH_MAX_TOKENS", "100000"))
+        self.max_concurrency = max_concurrency or int(os.getenv("EMBED_MAX_CONCURRENCY", "4"))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("EMBED_MAX_RETRIES", "5"))
+        self.backoff_base = backoff_base or float(os.getenv("EMBED_BACKOFF_BASE_SECONDS", "1.0"))
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._stats = {
+            "requests": 0,
+            "texts": 0,
+            "estimated_tokens": 0,
+            "retries": 0,
+            "rate_limited": 0,
+            "failures": 0,
+            "request_seconds": 0.0,
+        }
+        self._started_at = time.time()
+
+    def split(self, texts: List[str]) -> List[range]:
+        """Partitions input positions into consecutive batches within the item and token budgets."""
+        batches = []
+        start, tokens = 0, 0
+        for i, text in enumerate(texts):
+            text_tokens = estimate_tokens(text)
+            if i > start and (i - start >= self.max_batch_items or tokens + text_tokens > self.max_batch_tokens):
+                batches.append(range(start, i))
+                start, tokens = i, 0
+            tokens += text_tokens
+        if start < len(texts):
+            batches.append(range(start, len(texts)))
+        return batches
+
+    async def embed(self, client, texts: List[str]) -> List[List[float]]:
+        """Embeds `texts` with `client.embed_texts`, batched and in parallel, preserving order."""
+        if not texts:
+            return []
+        batches = self.split(texts)
+        tasks = [asyncio.ensure_future(self._embed_batch(client, [texts[i] for i in batch])) for batch in batches]
+        try:
+            results = await asyncio.gather(*tasks)
+        except Exception:
+            # One batch failed for good; don't keep spending quota on the rest of the document
+            for task in tasks:
+                task.cancel()
+            raise
+        vectors = [vector for batch_vectors in results for vector in batch_vectors]
+        if len(vectors) != len(texts):
+            raise ValueError(f"Embedding provider returned {len(vectors)} vectors for {len(texts)} inputs")
+        return vectors
+
+    async def _embed_batch(self, client, texts: List[str]) -> List[List[float]]:
+        attempt = 0
+        while True:
+            async with self._semaphore:
+                start_time = time.time()
+                try:
+                    vectors = await client.embed_texts(texts)
+                    self._record(texts, time.time() - start_time)
+                    return vectors
+                except Exception as e:
+                    self._stats["request_seconds"] += time.time() - start_time
+                    if not is_retryable_error(e) or attempt >= self.max_retries:
+                        self._stats["failures"] += 1
+                        raise
+                    if getattr(e, "status_code", None) == 429 or "RateLimit" in type(e).__name__:
+                        self._stats["rate_limited"] += 1
+                    error = e
+            # Back off outside the semaphore so other batches can use the slot
+            delay = retry_after_seconds(error) or self.backoff_base * (2 ** attempt) * (0.5 + random.random())
+            attempt += 1
+            self._stats["retries"] += 1
+            logger.warning(f"Embedding batch of {len(texts)} failed ({type(error).__name__}); retry {attempt}/{self.max_retries} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    def _record(self, texts: List[str], seconds: float):
+        self._stats["requests"] += 1
+        self._stats["texts"] += len(texts)
+        self._stats["estimated_tokens"] += sum(estimate_tokens(t) for t in texts)
+        self._stats["request_seconds"] += seconds
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters since process start, plus throughput over time spent in requests."""
+        stats = dict(self._stats)
+        busy = stats["request_seconds"]
+        stats["request_seconds"] = round(busy, 3)
+        stats["texts_per_request_second"] = round(stats["texts"] / busy, 1) if busy else 0.0
+        stats["uptime_seconds"] = round(time.time() - self._started_at, 1)
+        stats["max_concurrency"] = self.max_concurrency
+        stats["max_batch_items"] = self.max_batch_items
+        stats["max_batch_tokens"] = self.max_batch_tokens
+        return stats
+
+
+# Process-wide scheduler so concurrent ingests share one concurrency budget
+embedding_scheduler = EmbeddingScheduler()
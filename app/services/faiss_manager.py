@@ -1,11 +1,153 @@
 import numpy as np
 import faiss
 import os
+import glob
 import logging
-from typing import List, Tuple
+import struct
+import threading
+import time
+import zlib
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process index lock, run a single writer process
+    fcntl = None
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+from app.services.chunk_id_map import ChunkIdMap, uuids_to_array, UUID_BYTES
 
 logger = logging.getLogger(__name__)
 
+WAL_SUFFIX = ".wal"
+LOCK_SUFFIX = ".lock"
+# op (uint8), vector count (uint32), first vector id (int64), crc32 of payload (uint32)
+WAL_HEADER = struct.Struct("<BIqI")
+WAL_OP_ADD = 1
+WAL_OP_DELETE = 2
+# Tombstone file: count of tombstones not yet purged from the index (int64), then the packed bitmap
+TOMBSTONE_HEADER = struct.Struct("<q")
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+DEFAULT_INDEX_CONFIG = {
+    "type": "flat",
+    "nlist": 256,       # IVF: number of coarse clusters
+    "pq_m": 16,         # IVF-PQ: number of sub-quantizers (must divide dim)
+    "hnsw_m": 32,       # HNSW: graph degree
+    "nprobe": 16,       # IVF: clusters visited per query
+    "ef_search": 64,    # HNSW: candidate list size per query
+}
+
+# Filtered searches: a selective filter scales nprobe / efSearch up by 1 / selectivity (HNSW up to
+# FILTER_MAX_EF_SEARCH); searches that still return fewer than top_k matches retry with both doubled
+FILTER_MAX_EF_SEARCH = int(os.getenv("FILTER_MAX_EF_SEARCH", "4096"))
+FILTER_SEARCH_MAX_RETRIES = int(os.getenv("FILTER_SEARCH_MAX_RETRIES", "3"))
+
+
+def index_config_from_kb(kb) -> Dict[str, Any]:
+    """Builds an index config dict from a KnowledgeBase row, falling back to defaults."""
+    return normalize_index_config({
+        "type": getattr(kb, "index_type", None),
+        "nlist": getattr(kb, "index_nlist", None),
+        "pq_m": getattr(kb, "index_pq_m", None),
+        "hnsw_m": getattr(kb, "index_hnsw_m", None),
+        "nprobe": getattr(kb, "index_nprobe", None),
+        "ef_search": getattr(kb, "index_ef_search", None),
+    })
+
+
+def normalize_index_config(config: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    merged = dict(DEFAULT_INDEX_CONFIG)
+    merged.update({k: v for k, v in (config or {}).items() if v is not None})
+    if merged["type"] not in INDEX_TYPES:
+        raise ValueError(f"Unsupported index type '{merged['type']}'. Expected one of {', '.join(INDEX_TYPES)}.")
+    return merged
+
+
+def inner_index(index):
+    """Unwraps an IndexIDMap2 to the index doing the actual search."""
+    if isinstance(index, faiss.IndexIDMap):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def index_type_of(index) -> str:
+    """Returns the config name of a (downcast, possibly id-mapped) FAISS index instance."""
+    index = inner_index(index)
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVFFlat):
+        return "ivf_flat"
+    if isinstance(index, faiss.IndexHNSWFlat):
+        return "hnsw"
+    return "flat"
+
+
+def min_train_size(config: Dict[str, Any]) -> int:
+    """Vectors needed before a trainable index type can replace the flat staging index."""
+    # FAISS wants ~39 training points per centroid; each PQ codebook has 256 centroids
+    if config["type"] == "ivf_flat":
+        return 39 * config["nlist"]
+    if config["type"] == "ivf_pq":
+        return 39 * max(config["nlist"], 256)
+    return 0
+
+
+def create_index(dim: int, config: Dict[str, Any], training_vectors: Optional[np.ndarray] = None):
+    """Creates an empty index of the configured type that accepts `add_with_ids`.
+
+    Flat and HNSW indexes are wrapped in `IndexIDMap2`; IVF indexes store
+    external ids natively. Trainable types (IVF) are trained on
+    `training_vectors` when enough are given; otherwise a flat index is returned
+    as a staging index until the KB has grown large enough to train on.
+    """
+    kind = config["type"]
+    if kind == "hnsw":
+        return faiss.IndexIDMap2(faiss.IndexHNSWFlat(dim, config["hnsw_m"]))
+    if kind == "flat" or training_vectors is None or len(training_vectors) < min_train_size(config):
+        return faiss.IndexIDMap2(faiss.IndexFlatL2(dim))
+
+    quantizer = faiss.IndexFlatL2(dim)
+    if kind == "ivf_flat":
+        index = faiss.IndexIVFFlat(quantizer, dim, config["nlist"])
+    else:
+        # Fall back to the largest sub-quantizer count that divides dim
+        pq_m = next(m for m in range(min(config["pq_m"], dim), 0, -1) if dim % m == 0)
+        index = faiss.IndexIVFPQ(quantizer, dim, config["nlist"], pq_m, 8)
+    logger.info(f"Training {kind} index on {len(training_vectors)} vectors (nlist={config['nlist']})")
+    index.train(training_vectors)
+    return index
+
+
+def reconstruct_with_ids(index) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns (vectors, ids) for every entry of a flat or HNSW index.
+
+    Indexes loaded from before ids were stable (not id-mapped) report their
+    sequential positions as ids.
+    """
+    inner = inner_index(index)
+    if inner.ntotal == 0:
+        return np.empty((0, inner.d), dtype=np.float32), np.empty(0, dtype=np.int64)
+    vectors = inner.reconstruct_n(0, inner.ntotal)
+    if isinstance(index, faiss.IndexIDMap):
+        return vectors, faiss.vector_to_array(index.id_map).astype(np.int64)
+    return vectors, np.arange(inner.ntotal, dtype=np.int64)
+
+
+def ensure_id_mapped(index, config: Dict[str, Any]):
+    """Converts an index saved before stable ids into one that supports `add_with_ids`/`remove_ids`.
+
+    Sequential positions become the ids, so the existing id map stays valid.
+    IVF indexes already carry their ids and are returned unchanged.
+    """
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIVF)):
+        return index
+    vectors, ids = reconstruct_with_ids(index)
+    migrated = create_index(index.d, dict(config, type=index_type_of(index)))
+    if len(ids):
+        migrated.add_with_ids(vectors, ids)
+    logger.info(f"Wrapped legacy {index_type_of(index)} index ({len(ids)} vectors) in IndexIDMap2")
+    return migrated
+
 # Centralized function to get the full index path
 def get_index_path(kb_id: str):
     """Constructs the full path for the FAISS index file based on KB ID."""
@@ -23,87 +165,773 @@ def get_index_path(kb_id: str):
     return os.path.join(base_path, f"{kb_id}.faiss")
 
 
+def get_index_files(kb_id: str) -> List[str]:
+    """Lists every on-disk file belonging to a KB's index (base, id map, tombstones, WAL segments)."""
+    index_path = get_index_path(kb_id)
+    return sorted(glob.glob(glob.escape(index_path) + "*"))
+
+
+@contextmanager
+def file_lock(path: str):
+    """Exclusive cross-process `flock` on `path` (created if missing); a no-op without fcntl."""
+    if fcntl is None:
+        yield
+        return
+    with open(path, "a+b") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class ReadWriteLock:
+    """Writer-preferring reader/writer lock.
+
+    Any number of readers may hold the lock at once; a writer waits for active
+    readers to drain and blocks new readers while it is waiting.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
 class FAISSManager:
-    """Handles FAISS index creation, persistence, and similarity search."""
+    """Handles FAISS index creation, persistence, and similarity search.
+
+    Two persistence modes are supported (``FAISS_PERSISTENCE_MODE``):
+
+    * ``wal`` (default): each add or delete is appended to a write-ahead log next
+      to the index (``<index>.wal``) instead of rewriting the whole index. Once the
+      log grows past ``FAISS_WAL_COMPACT_BYTES`` it is sealed into a segment and a
+      background thread folds it into the base index. Loading replays sealed
+      segments and the active log on top of the base, so a crash at any point
+      rebuilds the same state.
+    * ``snapshot``: the full index and chunk map are rewritten on every change.
+
+    The index type comes from the KB's index config (see `create_index`). IVF
+    types start on a flat staging index and are trained and swapped in once the
+    KB holds `min_train_size` vectors.
+
+    Every vector gets a stable 64-bit id that is never reused. Deleting chunks
+    sets bits in a tombstone bitmap that searches exclude through an
+    `IDSelector`; compaction (or `FAISS_TOMBSTONE_PURGE_RATIO` of the index being
+    tombstoned) physically removes them from the index.
+
+    Several worker processes may share a KB's files. Every change takes an
+    exclusive `flock` on ``<index>.lock`` and first catches up on records other
+    processes appended to the WAL, so ids are allocated from the latest state
+    and WAL records never collide. The file lock is always taken before
+    `lock`. Without `fcntl` (Windows) only one process may write to an index.
+    """
 
     # Removed default value and os.getenv logic for index_path
-    def __init__(self, dim: int, index_path: str):
+    def __init__(self, dim: int, index_path: str, persistence_mode: Optional[str] = None, index_config: Optional[Dict[str, Any]] = None):
         """Initializes the FAISS manager.
 
         Args:
             dim: The dimensionality of the vectors.
             index_path: The full path to the FAISS index file.
+            persistence_mode: 'wal' or 'snapshot'; defaults to FAISS_PERSISTENCE_MODE.
+            index_config: Index type and tuning parameters; defaults to a flat index.
         """
         self.dim = dim
+        self.index_config = normalize_index_config(index_config)
         self.index_path = index_path
-        # Use a thread-safe index suitable for concurrent reads/writes if needed, e.g., IndexIDMap
-        # self.index = faiss.IndexIDMap(faiss.IndexFlatL2(dim))
-        self.index = faiss.IndexFlatL2(dim) # Using basic IndexFlatL2 for now
-        self.id_to_chunk = {}  # Maps FAISS vector id (usually sequential int) to original chunk_id (UUID)
-        self.next_vector_id = 0 # Keep track of next available ID for IndexFlatL2
+        self.wal_path = index_path + WAL_SUFFIX
+        self.lock_path = index_path + LOCK_SUFFIX
+        self.ids_path = index_path + ".ids"
+        self.tombstones_path = index_path + ".tomb"
+        self.legacy_chunk_map_path = index_path + ".chunks.npy"
+        self.persistence_mode = persistence_mode or os.getenv("FAISS_PERSISTENCE_MODE", "wal")
+        self.wal_compact_bytes = int(os.getenv("FAISS_WAL_COMPACT_BYTES", str(64 * 1024 * 1024)))
+        self.purge_ratio = float(os.getenv("FAISS_TOMBSTONE_PURGE_RATIO", "0.1"))
+        self.lock = ReadWriteLock()
+        # Serializes WAL rotation/compaction; appends are already serialized by the write lock
+        self._compaction_lock = threading.Lock()
+        # Guards writes of the base files; the generation lets compaction detect a newer base
+        self._base_lock = threading.Lock()
+        self._base_generation = 0
+        # File stats of the index and WAL as last loaded or written by this process
+        self.disk_signature: Optional[Tuple] = None
+        self._wal_offset = 0  # Bytes of the active WAL applied to the in-memory index
+        # Changes made while a rebuild is in progress, replayed into the rebuilt index on swap
+        self._rebuild_log: Optional[List[Tuple[int, Optional[np.ndarray], List[str]]]] = None
+        self.index = create_index(dim, self.index_config)
+        self.id_map = ChunkIdMap()  # Maps FAISS vector id to original chunk_id (UUID)
+        self.next_vector_id = 0 # Next stable id to hand out; ids are never reused
+        self.tombstones = np.zeros(0, dtype=np.uint8)  # Packed bitmap of deleted vector ids (little bit order)
+        self.unpurged_tombstones = 0  # Tombstoned ids whose vectors may still be in the index
+        self.load_failed = False  # Set when the on-disk index was unreadable and had to be reset
 
         # Load existing index and chunk map if they exist
-        self.load_index()
+        with self.file_lock():
+            self.load_index()
 
-    def add_embeddings(self, embeddings: List[np.ndarray], chunk_ids: List[str]):
+    def add_embeddings(self, embeddings: List[np.ndarray], chunk_ids: List[str]) -> np.ndarray:
+        """Adds vectors for `chunk_ids` and returns the stable ids assigned to them."""
         arr = np.vstack(embeddings).astype(np.float32)
-        start_id = self.index.ntotal
-        self.index.add(arr)
-        for i, chunk_id in enumerate(chunk_ids):
-            self.id_to_chunk[start_id + i] = chunk_id
-        self.save_index()
-
-    def search(self, query_emb: np.ndarray, top_k: int = 3) -> List[Tuple[str, float]]:
-        D, I = self.index.search(query_emb.reshape(1, -1).astype(np.float32), top_k)
-        results = []
-        for idx, dist in zip(I[0], D[0]):
-            if idx == -1:
-                continue
-            chunk_id = self.id_to_chunk.get(idx)
+        with self.file_lock(), self.lock.write():
+            # Other processes may have appended ids since we last looked
+            self._catch_up_locked()
+            start_id = self.next_vector_id
+            ids = np.arange(start_id, start_id + len(arr), dtype=np.int64)
+            self.index.add_with_ids(arr, ids)
+            self.id_map.assign(start_id, uuids_to_array(chunk_ids))
+            self.next_vector_id = start_id + len(arr)
+            if self._rebuild_log is not None:
+                self._rebuild_log.append((WAL_OP_ADD, arr, list(chunk_ids)))
+            upgraded = self._maybe_train_locked()
+            if upgraded:
+                # The trained index replaces the staging one; persist it as a new base.
+                # Vector ids are unchanged, so older WAL records replay harmlessly.
+                self.save_index()
+            elif self.persistence_mode == "wal":
+                self._append_wal(WAL_OP_ADD, start_id, uuids_to_array(chunk_ids).tobytes() + arr.tobytes())
+            else:
+                self.save_index()
+        self._maybe_compact()
+        return ids
+
+    def delete_chunks(self, chunk_ids: List[str]) -> int:
+        """Tombstones every vector stored for `chunk_ids`; returns how many were deleted.
+
+        Tombstoned vectors are excluded from searches immediately and physically
+        removed by the next purge.
+        """
+        if not chunk_ids:
+            return 0
+        with self.file_lock(), self.lock.write():
+            self._catch_up_locked()
+            ids = self.id_map.find(chunk_ids)
+            ids = ids[~self.is_tombstoned(ids)]
+            if self._rebuild_log is not None:
+                self._rebuild_log.append((WAL_OP_DELETE, None, list(chunk_ids)))
+            if not len(ids):
+                return 0
+            self._set_tombstones(ids)
+            if self.persistence_mode == "wal":
+                self._append_wal(WAL_OP_DELETE, 0, ids.astype("<i8").tobytes())
+            else:
+                self.save_index()
+        self._maybe_compact()
+        return len(ids)
+
+    def is_tombstoned(self, ids: np.ndarray) -> np.ndarray:
+        """Vectorized check of which vector ids have been deleted."""
+        ids = np.asarray(ids, dtype=np.int64)
+        byte_idx = ids >> 3
+        in_range = (ids >= 0) & (byte_idx < len(self.tombstones))
+        out = np.zeros(len(ids), dtype=bool)
+        out[in_range] = (self.tombstones[byte_idx[in_range]] >> (ids[in_range] & 7).astype(np.uint8)) & 1 == 1
+        return out
+
+    def configure(self, index_config: Dict[str, Any]):
+        """Applies a (possibly changed) index config, training the target type if it is now possible.
+
+        Query-time parameters take effect immediately. Changing between two
+        non-staging index types requires `rebuild`.
+        """
+        index_config = normalize_index_config(index_config)
+        if index_config == self.index_config:
+            return
+        with self.file_lock(), self.lock.write():
+            self.index_config = index_config
+            self._catch_up_locked()
+            if self._maybe_train_locked():
+                self.save_index()
+
+    def search(self, query_emb: np.ndarray, top_k: int = 3, nprobe: Optional[int] = None, ef_search: Optional[int] = None, id_filter: Optional[np.ndarray] = None) -> List[Tuple[str, float]]:
+        """Returns (chunk_id, distance) pairs for the nearest live vectors.
+
+        `nprobe` (IVF) and `ef_search` (HNSW) override the KB's configured
+        query-time parameters for this call only. `id_filter` is a packed bitmap
+        of the vector ids that may be returned (see app.services.metadata_index).
+        """
+        return self.search_batch(query_emb.reshape(1, -1), top_k, nprobe=nprobe, ef_search=ef_search, id_filter=id_filter)[0]
+
+    def search_batch(self, query_embs: np.ndarray, top_k: int = 3, nprobe: Optional[int] = None, ef_search: Optional[int] = None, id_filter: Optional[np.ndarray] = None) -> List[List[Tuple[str, float]]]:
+        """`search` for a matrix of query vectors (one per row) in a single index call.
+
+        With `id_filter`, the filter is applied inside the index search, and nprobe /
+        efSearch grow with the filter's selectivity so that top_k matches are still found.
+        """
+        query_embs = np.ascontiguousarray(query_embs, dtype=np.float32).reshape(-1, self.dim)
+        with self.lock.read():
+            allowed = None
+            if id_filter is not None:
+                allowed = self._live_filter(id_filter)
+                allowed_count = int(np.unpackbits(allowed).sum())
+                if allowed_count == 0:
+                    return [[] for _ in range(len(query_embs))]
+                nprobe, ef_search = self._filtered_params(nprobe, ef_search, top_k, allowed_count / max(1, self.index.ntotal))
+            for attempt in range(FILTER_SEARCH_MAX_RETRIES + 1):
+                D, I = self.index.search(query_embs, top_k, params=self._search_params(nprobe, ef_search, allowed))
+                if allowed is None or int((I != -1).sum(axis=1).min()) >= min(top_k, allowed_count):
+                    break
+                grown = self._filtered_params(nprobe, ef_search, top_k, 0.5)
+                if grown == (nprobe, ef_search):
+                    break
+                nprobe, ef_search = grown
+            valid = I != -1
+            chunk_ids = self.id_map.lookup(I[valid])
+        results: List[List[Tuple[str, float]]] = [[] for _ in range(len(query_embs))]
+        for row, chunk_id, dist in zip(np.nonzero(valid)[0], chunk_ids, D[valid]):
             if chunk_id:
-                results.append((chunk_id, float(dist)))
+                results[row].append((chunk_id, float(dist)))
         return results
 
-    def save_index(self):
-        """Saves the FAISS index and the chunk ID map to disk."""
+    def vector_ids(self, chunk_ids: List[str]) -> np.ndarray:
+        """Live vector ids stored for `chunk_ids`."""
+        with self.lock.read():
+            ids = self.id_map.find(chunk_ids)
+            return ids[~self.is_tombstoned(ids)]
+
+    def chunk_ids_for(self, ids: np.ndarray) -> List[Optional[str]]:
+        """Chunk ids of vector ids, None for unknown or deleted ones."""
+        ids = np.asarray(ids, dtype=np.int64)
+        with self.lock.read():
+            dead = self.is_tombstoned(ids)
+            return [None if is_dead else chunk_id for chunk_id, is_dead in zip(self.id_map.lookup(ids), dead)]
+
+    def purge_tombstones(self):
+        """Physically removes tombstoned vectors from the index and saves a new base."""
+        with self.file_lock(), self.lock.write():
+            self._catch_up_locked()
+            if self.unpurged_tombstones:
+                self._purge_locked()
+                self.save_index()
+
+    def save_index(self, drop_wal: bool = False):
+        """Saves the FAISS index, chunk ID map and tombstones to disk.
+
+        With `drop_wal`, WAL segments are deleted before the base is replaced; used
+        when the new base renumbers vectors and old records must never replay onto it.
+        The caller holds `file_lock`.
+        """
         try:
             logger.info(f"Saving FAISS index to {self.index_path}")
-            faiss.write_index(self.index, self.index_path)
-            # Save the chunk map
-            chunk_map_path = self.index_path + ".chunks.npy"
-            np.save(chunk_map_path, self.id_to_chunk)
+            with self._base_lock:
+                if drop_wal:
+                    self._remove_wal_files()
+                    self._wal_offset = 0
+                self._write_base(faiss.serialize_index(self.index), self.id_map, self.tombstones.copy(), self.unpurged_tombstones)
+                self._base_generation += 1
+            self.disk_signature = self.read_disk_signature()
             logger.info(f"FAISS index and chunk map saved successfully.")
         except Exception as e:
             logger.error(f"Error saving FAISS index or chunk map to {self.index_path}: {e}", exc_info=True)
 
     def load_index(self):
-        """Loads the FAISS index and chunk ID map from disk if they exist."""
+        """Loads the FAISS index, chunk ID map and tombstones from disk, then replays any WAL segments."""
+        signature = self.read_disk_signature()
         if os.path.exists(self.index_path):
             try:
                 logger.info(f"Loading FAISS index from {self.index_path}")
-                self.index = faiss.read_index(self.index_path)
-                self.next_vector_id = self.index.ntotal # Update next ID based on loaded index size
-                # Load the chunk map
-                chunk_map_path = self.index_path + ".chunks.npy"
-                if os.path.exists(chunk_map_path):
-                    self.id_to_chunk = np.load(chunk_map_path, allow_pickle=True).item()
-                    logger.info(f"Loaded chunk map with {len(self.id_to_chunk)} entries.")
+                self.index = ensure_id_mapped(faiss.read_index(self.index_path), self.index_config)
+                # Load the chunk map (memory-mapped), migrating the legacy pickled dict if needed
+                if os.path.exists(self.ids_path):
+                    self.id_map = ChunkIdMap.load(self.ids_path)
+                    logger.info(f"Loaded chunk map with {len(self.id_map)} entries.")
+                elif os.path.exists(self.legacy_chunk_map_path):
+                    legacy = np.load(self.legacy_chunk_map_path, allow_pickle=True).item()
+                    self.id_map = ChunkIdMap.from_legacy_dict(legacy)
+                    self.id_map.save(self.ids_path)
+                    os.remove(self.legacy_chunk_map_path)
+                    self.id_map = ChunkIdMap.load(self.ids_path)
+                    logger.info(f"Migrated legacy chunk map with {len(legacy)} entries to {self.ids_path}")
                 else:
-                    logger.warning(f"Chunk map file not found: {chunk_map_path}. Initializing empty map.")
-                    self.id_to_chunk = {}
+                    logger.warning(f"Chunk map file not found: {self.ids_path}. Initializing empty map.")
+                    self.id_map = ChunkIdMap()
+                self.tombstones, self.unpurged_tombstones = self._load_tombstones()
+                # Ids are never reused, so the id map length is the next free id
+                self.next_vector_id = max(len(self.id_map), self.index.ntotal)
+                self.load_failed = False
                 logger.info(f"FAISS index loaded successfully. Index size: {self.index.ntotal}")
             except Exception as e:
-                logger.error(f"Error loading FAISS index or chunk map from {self.index_path}: {e}. Reinitializing index.", exc_info=True)
+                logger.error(
+                    f"Error loading FAISS index or chunk map from {self.index_path}: {e}. Reinitializing index; "
+                    f"rebuild it from the database with `python -m app.db.rebuild_index`.", exc_info=True
+                )
                 # Reinitialize if loading fails
                 self.reset()
+                self.load_failed = True
         else:
             logger.info(f"FAISS index file not found: {self.index_path}. Initializing new index.")
             # Initialize new index if file doesn't exist
             self.reset()
+        self._replay_wal()
+        self.disk_signature = signature
+        if self._maybe_train_locked():
+            self.save_index()
 
     def reset(self):
         """Resets the index and chunk map to an empty state."""
         logger.warning(f"Resetting FAISS index for path: {self.index_path}")
-        self.index = faiss.IndexFlatL2(self.dim)
-        self.id_to_chunk = {}
+        self.index = create_index(self.dim, self.index_config)
+        self.id_map = ChunkIdMap()
         self.next_vector_id = 0
+        self.tombstones = np.zeros(0, dtype=np.uint8)
+        self.unpurged_tombstones = 0
+        self.disk_signature = None
+        self._wal_offset = 0
+
+    def compact(self):
+        """Purges tombstones and folds sealed WAL segments and the active log into the base files.
+
+        The index is serialized under the read lock (searches continue, adds wait),
+        the active log is sealed at the same point, and the new base is written
+        outside the read lock before the covered segments are deleted. The file
+        lock is held throughout, so other processes neither append to the log
+        being sealed nor write a base of their own meanwhile.
+        """
+        if not self._compaction_lock.acquire(blocking=False):
+            return
+        try:
+            with self.file_lock():
+                self._compact_file_locked()
+        except Exception as e:
+            logger.error(f"Error compacting FAISS WAL for {self.index_path}: {e}", exc_info=True)
+        finally:
+            self._compaction_lock.release()
+
+    def _compact_file_locked(self):
+        with self.lock.write():
+            self._catch_up_locked()
+            if self.unpurged_tombstones:
+                self._purge_locked()
+        with self.lock.read():
+            index_bytes = faiss.serialize_index(self.index)
+            id_map = ChunkIdMap(tail=self.id_map.to_array())
+            tombstones = self.tombstones.copy()
+            # Deletes that slipped in after the purge are still in the serialized index
+            unpurged = self.unpurged_tombstones
+            generation = self._base_generation
+            if os.path.exists(self.wal_path):
+                os.replace(self.wal_path, f"{self.wal_path}.{time.time_ns()}")
+            self._wal_offset = 0
+            sealed = self._sealed_segments()
+            self.disk_signature = self.read_disk_signature()
+        with self._base_lock:
+            if generation != self._base_generation:
+                # A full save happened meanwhile; it already covers the sealed segments
+                logger.info(f"Skipping stale compaction of {self.index_path}")
+            else:
+                logger.info(f"Compacting {len(sealed)} WAL segment(s) into {self.index_path}")
+                self._write_base(index_bytes, id_map, tombstones, unpurged)
+                self._base_generation += 1
+            for path in sealed:
+                if os.path.exists(path):
+                    os.remove(path)
+        with self.lock.write():
+            # Swap the heap copy of the ids for the freshly written memory-mapped file
+            self.id_map.rebase(self.ids_path)
+            self.disk_signature = self.read_disk_signature()
+
+    def begin_rebuild(self):
+        """Starts recording adds and deletes so they can be carried over into a rebuilt index."""
+        with self.lock.write():
+            self._rebuild_log = []
+
+    def abort_rebuild(self):
+        with self.lock.write():
+            self._rebuild_log = None
+
+    def finish_rebuild(self, index, id_map: ChunkIdMap, index_config: Dict[str, Any]):
+        """Atomically swaps in an index built off to the side by `begin_rebuild`'s caller.
+
+        `index` must hold ids 0..len(id_map)-1. Searches keep hitting the old index
+        until this point. Adds that arrived during the rebuild and are not already
+        in `id_map` are re-applied, as are deletes, including those other
+        processes appended to the WAL.
+        """
+        with self.file_lock(), self.lock.write():
+            self._catch_up_locked()
+            self.tombstones = np.zeros(0, dtype=np.uint8)
+            self.unpurged_tombstones = 0
+            for op, arr, chunk_ids in self._rebuild_log or []:
+                if op == WAL_OP_ADD:
+                    missing = np.flatnonzero(~id_map.contains(chunk_ids))
+                    if len(missing):
+                        start_id = len(id_map)
+                        index.add_with_ids(arr[missing], np.arange(start_id, start_id + len(missing), dtype=np.int64))
+                        id_map.assign(start_id, uuids_to_array([chunk_ids[i] for i in missing]))
+                else:
+                    self._set_tombstones(id_map.find(chunk_ids))
+            self._rebuild_log = None
+            self.index = index
+            self.id_map = id_map
+            self.index_config = normalize_index_config(index_config)
+            self.next_vector_id = len(id_map)
+            self.load_failed = False
+            # Drop the old WAL before replacing the base so it can never replay onto the new ids
+            self.save_index(drop_wal=True)
+        logger.info(f"Rebuilt FAISS index {self.index_path} as {index_type_of(index)} with {index.ntotal} vectors")
+
+    def _maybe_train_locked(self) -> bool:
+        """Replaces a flat staging index with the trained target type once enough vectors exist."""
+        target = self.index_config["type"]
+        if target not in ("ivf_flat", "ivf_pq") or index_type_of(self.index) != "flat":
+            return False
+        if self.index.ntotal < min_train_size(self.index_config):
+            return False
+        vectors, ids = reconstruct_with_ids(self.index)
+        live = ~self.is_tombstoned(ids)
+        trained = create_index(self.dim, self.index_config, training_vectors=vectors[live])
+        trained.add_with_ids(vectors[live], ids[live])
+        self.index = trained
+        self.unpurged_tombstones = 0
+        return True
+
+    def _purge_locked(self):
+        """Removes tombstoned vectors from the index. Caller holds the write lock."""
+        byte_count = len(self.tombstones)
+        dead = np.flatnonzero(np.unpackbits(self.tombstones, bitorder="little")[:byte_count * 8]).astype(np.int64)
+        if index_type_of(self.index) == "hnsw":
+            # HNSW graphs do not support removal; rebuild the graph from the live vectors
+            vectors, ids = reconstruct_with_ids(self.index)
+            live = ~self.is_tombstoned(ids)
+            purged = create_index(self.dim, dict(self.index_config, type="hnsw"))
+            purged.add_with_ids(vectors[live], ids[live])
+            self.index = purged
+        elif len(dead):
+            self.index.remove_ids(dead)
+        logger.info(f"Purged {self.unpurged_tombstones} tombstoned vectors from {self.index_path}")
+        self.unpurged_tombstones = 0
+
+    def _set_tombstones(self, ids: np.ndarray):
+        ids = np.asarray(ids, dtype=np.int64)
+        if not len(ids):
+            return
+        needed = int(ids.max() >> 3) + 1
+        if needed > len(self.tombstones):
+            grown = np.zeros(max(needed, 2 * len(self.tombstones)), dtype=np.uint8)
+            grown[:len(self.tombstones)] = self.tombstones
+            self.tombstones = grown
+        new = ids[~self.is_tombstoned(ids)]
+        np.bitwise_or.at(self.tombstones, new >> 3, np.left_shift(1, new & 7).astype(np.uint8))
+        self.unpurged_tombstones += len(new)
+
+    def _load_tombstones(self) -> Tuple[np.ndarray, int]:
+        if not os.path.exists(self.tombstones_path):
+            return np.zeros(0, dtype=np.uint8), 0
+        with open(self.tombstones_path, "rb") as f:
+            data = f.read()
+        (unpurged,) = TOMBSTONE_HEADER.unpack_from(data)
+        return np.frombuffer(data, dtype=np.uint8, offset=TOMBSTONE_HEADER.size).copy(), unpurged
+
+    def _maybe_compact(self):
+        wal_full = self.persistence_mode == "wal" and self._wal_size() >= self.wal_compact_bytes
+        too_many_tombstones = self.unpurged_tombstones >= max(1, self.purge_ratio * self.index.ntotal)
+        if wal_full or too_many_tombstones:
+            self.compact_in_background()
+
+    def _live_filter(self, id_filter: np.ndarray) -> np.ndarray:
+        """The filter bitmap without tombstoned ids, so one selector applies both."""
+        allowed = np.array(id_filter, dtype=np.uint8, copy=True)
+        common = min(len(allowed), len(self.tombstones))
+        allowed[:common] &= ~self.tombstones[:common]
+        return allowed
+
+    def _filtered_params(self, nprobe: Optional[int], ef_search: Optional[int], top_k: int, selectivity: float) -> Tuple[Optional[int], Optional[int]]:
+        """nprobe / efSearch scaled by 1 / selectivity: a filter matching 10% of the vectors leaves
+        about a tenth of each probed cluster or candidate list, so ten times as many are visited."""
+        kind = index_type_of(self.index)
+        scale = 1.0 / max(selectivity, 1e-9)
+        if kind in ("ivf_flat", "ivf_pq"):
+            nlist = faiss.extract_index_ivf(self.index).nlist
+            nprobe = min(nlist, int(np.ceil((nprobe or self.index_config["nprobe"]) * scale)))
+        elif kind == "hnsw":
+            ef_search = min(max(FILTER_MAX_EF_SEARCH, top_k), int(np.ceil(max(ef_search or self.index_config["ef_search"], top_k) * scale)))
+        return nprobe, ef_search
+
+    def _search_params(self, nprobe: Optional[int], ef_search: Optional[int], allowed: Optional[np.ndarray] = None):
+        # Exclude tombstoned ids inside the index search so they never take top_k slots;
+        # an `allowed` bitmap (from `_live_filter`) already excludes them
+        sel = None
+        if allowed is not None:
+            sel = faiss.IDSelectorBitmap(len(allowed), faiss.swig_ptr(allowed))
+        elif self.unpurged_tombstones:
+            sel = faiss.IDSelectorNot(faiss.IDSelectorBitmap(len(self.tombstones), faiss.swig_ptr(self.tombstones)))
+        kind = index_type_of(self.index)
+        if kind in ("ivf_flat", "ivf_pq"):
+            params = faiss.SearchParametersIVF(nprobe=int(nprobe or self.index_config["nprobe"]))
+        elif kind == "hnsw":
+            params = faiss.SearchParametersHNSW(efSearch=int(ef_search or self.index_config["ef_search"]))
+        elif sel is not None:
+            params = faiss.SearchParameters()
+        else:
+            return None
+        if sel is not None:
+            params.sel = sel
+            # Keep the selector (and the bitmap it points into) alive for the call
+            params._selector_ref = (sel, allowed)
+        return params
+
+    def _remove_wal_files(self):
+        for path in self._sealed_segments() + [self.wal_path]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def compact_in_background(self):
+        threading.Thread(target=self.compact, name=f"faiss-compact-{os.path.basename(self.index_path)}", daemon=True).start()
+
+    def _write_base(self, index_bytes: np.ndarray, id_map: ChunkIdMap, tombstones: np.ndarray, unpurged: int):
+        # Write to temp files and rename so a crash never leaves a half-written base
+        tmp_index = self.index_path + ".tmp"
+        with open(tmp_index, "wb") as f:
+            f.write(index_bytes.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        tmp_tombstones = self.tombstones_path + ".tmp"
+        with open(tmp_tombstones, "wb") as f:
+            f.write(TOMBSTONE_HEADER.pack(unpurged) + tombstones.tobytes())
+        os.replace(tmp_index, self.index_path)
+        id_map.save(self.ids_path)
+        os.replace(tmp_tombstones, self.tombstones_path)
+
+    def _append_wal(self, op: int, start_id: int, payload: bytes):
+        count = len(payload) // self._wal_entry_size(op)
+        header = WAL_HEADER.pack(op, count, start_id, zlib.crc32(payload))
+        with open(self.wal_path, "ab") as f:
+            f.write(header + payload)
+            f.flush()
+            os.fsync(f.fileno())
+            self._wal_offset = f.tell()
+        self.disk_signature = self.read_disk_signature()
+
+    def _wal_entry_size(self, op: int) -> int:
+        return UUID_BYTES + self.dim * 4 if op == WAL_OP_ADD else 8
+
+    def _replay_wal(self, tail_offset: Optional[int] = None):
+        """Applies sealed segments then the active log on top of the loaded base.
+
+        Add records whose ids are already in the base (start_id < next_vector_id)
+        only refresh the chunk map, and re-applying a delete is a no-op, which makes
+        replay idempotent if a crash hit mid-compaction. A torn record at the tail
+        of the active log is truncated away; callers hold `file_lock`, so it is
+        never a record another process is still writing. With `tail_offset`, only
+        the active log from that offset on is applied (see `_catch_up_locked`).
+        """
+        replayed = 0
+        paths = [self.wal_path] if tail_offset is not None else self._sealed_segments() + [self.wal_path]
+        self._wal_offset = 0
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            with open(path, "rb") as f:
+                data = f.read()
+            offset = tail_offset if tail_offset is not None else 0
+            while offset + WAL_HEADER.size <= len(data):
+                op, count, start_id, crc = WAL_HEADER.unpack_from(data, offset)
+                if op not in (WAL_OP_ADD, WAL_OP_DELETE):
+                    break
+                payload_len = count * self._wal_entry_size(op)
+                payload = data[offset + WAL_HEADER.size: offset + WAL_HEADER.size + payload_len]
+                if len(payload) != payload_len or zlib.crc32(payload) != crc:
+                    break
+                if op == WAL_OP_DELETE:
+                    ids = np.frombuffer(payload, dtype="<i8")
+                    if self._rebuild_log is not None:
+                        # Deletes by another process while this one rebuilds
+                        self._rebuild_log.append((WAL_OP_DELETE, None, [c for c in self.id_map.lookup(ids) if c]))
+                    self._set_tombstones(ids)
+                else:
+                    self.id_map.assign(start_id, np.frombuffer(payload, dtype=np.uint8, count=count * UUID_BYTES).reshape(count, UUID_BYTES))
+                    if start_id >= self.next_vector_id:
+                        vectors = np.frombuffer(payload, dtype=np.float32, offset=count * UUID_BYTES).reshape(count, self.dim)
+                        self.index.add_with_ids(vectors, np.arange(start_id, start_id + count, dtype=np.int64))
+                        self.next_vector_id = start_id + count
+                        replayed += count
+                        if self._rebuild_log is not None:
+                            self._rebuild_log.append((WAL_OP_ADD, vectors, self.id_map.lookup(np.arange(start_id, start_id + count, dtype=np.int64))))
+                offset += WAL_HEADER.size + payload_len
+            if path == self.wal_path:
+                self._wal_offset = offset
+            if offset < len(data):
+                logger.warning(f"Discarding {len(data) - offset} trailing bytes of corrupt or torn WAL data in {path}")
+                if path == self.wal_path:
+                    with open(path, "r+b") as f:
+                        f.truncate(offset)
+        if replayed:
+            logger.info(f"Replayed {replayed} vectors from WAL for {self.index_path}")
+
+    def _sealed_segments(self) -> List[str]:
+        return sorted(glob.glob(glob.escape(self.wal_path) + ".*"), key=lambda p: int(p.rsplit(".", 1)[1]))
+
+    def _wal_size(self) -> int:
+        try:
+            return os.path.getsize(self.wal_path)
+        except FileNotFoundError:
+            return 0
+
+    def read_disk_signature(self) -> Optional[Tuple]:
+        """Returns (mtime_ns, size, inode) of the index file and active WAL, or None if neither exists."""
+        stats = []
+        for path in (self.index_path, self.wal_path):
+            try:
+                st = os.stat(path)
+                stats.append((st.st_mtime_ns, st.st_size, st.st_ino))
+            except FileNotFoundError:
+                stats.append(None)
+        return None if stats == [None, None] else tuple(stats)
+
+    def is_stale(self) -> bool:
+        """True if the index or WAL on disk changed since this manager loaded or wrote it."""
+        return self.read_disk_signature() != self.disk_signature
+
+    def reload_if_stale(self) -> bool:
+        """Picks up changes another process made to the index or WAL on disk."""
+        if not self.is_stale():
+            return False
+        with self.file_lock(), self.lock.write():
+            return self._catch_up_locked()
+
+    def file_lock(self):
+        """Exclusive cross-process lock on this index's files; take it before `lock`."""
+        return file_lock(self.lock_path)
+
+    def _catch_up_locked(self) -> bool:
+        """Applies changes other processes wrote since this manager last read or wrote the files.
+
+        Records appended to the same active WAL are replayed from where this
+        process stopped; a new base or a rotated WAL means a full reload.
+        Caller holds `file_lock` and the write lock.
+        """
+        signature = self.read_disk_signature()
+        if signature == self.disk_signature:
+            return False
+        known = self.disk_signature
+        if known is not None and signature is not None and signature[0] == known[0] and signature[1] is not None \
+                and (known[1] is None and self._wal_offset == 0 or known[1] is not None and signature[1][2] == known[1][2]) \
+                and signature[1][1] >= self._wal_offset:
+            self._replay_wal(tail_offset=self._wal_offset)
+            self.disk_signature = self.read_disk_signature()
+        else:
+            logger.info(f"FAISS index {self.index_path} changed on disk, reloading.")
+            self.load_index()
+        return True
+
+    def memory_bytes(self) -> int:
+        """Rough resident size of the index and chunk map, used for registry eviction."""
+        # Flat vectors plus the heap part of the id map and the tombstone bitmap
+        return self.index.ntotal * self.dim * 4 + self.id_map.nbytes + self.tombstones.nbytes
+
+
+class FAISSIndexRegistry:
+    """Process-wide, LRU-bounded cache of loaded FAISS indexes keyed by KB id.
+
+    Every request for a KB shares the same resident `FAISSManager`, so the index is
+    read from disk once per process instead of once per request. Entries are evicted
+    least-recently-used first once either `max_indexes` or `max_bytes` is exceeded
+    (0 disables a bound), and reloaded when the file on disk is rewritten elsewhere.
+    """
+
+    def __init__(self, max_indexes: Optional[int] = None, max_bytes: Optional[int] = None):
+        self.max_indexes = max_indexes if max_indexes is not None else int(os.getenv("FAISS_REGISTRY_MAX_INDEXES", "32"))
+        self.max_bytes = max_bytes if max_bytes is not None else int(os.getenv("FAISS_REGISTRY_MAX_BYTES", "0"))
+        self._entries: "OrderedDict[str, FAISSManager]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Per-KB locks so a slow load of one index does not block lookups of others
+        self._load_locks: Dict[str, threading.Lock] = {}
+
+    def get(self, kb_id: str, dim: int, index_config: Optional[Dict[str, Any]] = None) -> FAISSManager:
+        """Returns the resident manager for `kb_id`, loading it on first use."""
+        manager = self._lookup(kb_id, dim)
+        if manager is not None:
+            manager.reload_if_stale()
+            if index_config is not None:
+                manager.configure(index_config)
+            return manager
+
+        with self._lock:
+            load_lock = self._load_locks.setdefault(kb_id, threading.Lock())
+        with load_lock:
+            # Another thread may have finished loading while we waited
+            manager = self._lookup(kb_id, dim)
+            if manager is not None:
+                return manager
+            manager = FAISSManager(dim=dim, index_path=get_index_path(kb_id), index_config=index_config)
+            with self._lock:
+                self._entries[kb_id] = manager
+                self._entries.move_to_end(kb_id)
+                self._evict_locked(keep=kb_id)
+        return manager
+
+    def evict(self, kb_id: str):
+        """Drops a KB's index from memory, e.g. after the KB is deleted."""
+        with self._lock:
+            self._entries.pop(kb_id, None)
+            self._load_locks.pop(kb_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._load_locks.clear()
+
+    def _lookup(self, kb_id: str, dim: int) -> Optional[FAISSManager]:
+        with self._lock:
+            manager = self._entries.get(kb_id)
+            if manager is None:
+                return None
+            if manager.dim != dim:
+                logger.warning(f"Dimension changed for KB {kb_id} ({manager.dim} -> {dim}), dropping cached index.")
+                del self._entries[kb_id]
+                return None
+            self._entries.move_to_end(kb_id)
+            return manager
+
+    def _evict_locked(self, keep: str):
+        def over_budget():
+            if self.max_indexes and len(self._entries) > self.max_indexes:
+                return True
+            if self.max_bytes and sum(m.memory_bytes() for m in self._entries.values()) > self.max_bytes:
+                return True
+            return False
+
+        while len(self._entries) > 1 and over_budget():
+            oldest = next(iter(self._entries))
+            if oldest == keep:
+                break
+            self._entries.pop(oldest)
+            logger.info(f"Evicted FAISS index for KB {oldest} from registry.")
+
+
+index_registry = FAISSIndexRegistry()
+
+
+def get_faiss_manager(kb_id: str, dim: int, index_config: Optional[Dict[str, Any]] = None) -> FAISSManager:
+    """Returns the shared FAISS manager for a knowledge base."""
+    return index_registry.get(kb_id, dim, index_config)
@@ -0,0 +1,187 @@
+import numpy as np
+import os
+import time
+import asyncio
+import logging
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from sqlalchemy.future import select
+from app.models import Document as DocModel, DocumentChunk, Embedding
+from app.services.faiss_manager import create_index, min_train_size
+from app.services.chunk_id_map import ChunkIdMap
+from app.services.vector_codec import decode_rows
+from app.services.bm25_index import Delta, tokenize
+from app.services.metadata_index import MetadataIndex
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = int(os.getenv("INDEX_REBUILD_BATCH_SIZE", "2048"))
+# Trainable indexes are trained on up to this many times their minimum training set
+TRAIN_SAMPLE_FACTOR = 4
+
+
+class IndexBuildProgress:
+    """Running counters for a streaming index build."""
+
+    def __init__(self, kb_id: str):
+        self.kb_id = kb_id
+        self.start_time = time.time()
+        self.rows = 0
+        self.batches = 0
+
+    @property
+    def elapsed(self) -> float:
+        return time.time() - self.start_time
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows / self.elapsed if self.elapsed > 0 else 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "knowledge_base_id": self.kb_id,
+            "vectors": self.rows,
+            "batches": self.batches,
+            "seconds": round(self.elapsed, 3),
+            "vectors_per_sec": round(self.rows_per_sec, 1)
+        }
+
+
+async def build_index_from_db(
+    db,
+    kb,
+    dim: int,
+    index_config: Dict[str, Any],
+    batch_size: Optional[int] = None,
+    on_progress: Optional[Callable[[IndexBuildProgress], None]] = None,
+) -> Tuple[Any, ChunkIdMap, IndexBuildProgress]:
+    """Builds a fresh FAISS index for `kb` by streaming its embeddings from the database.
+
+    Rows are read through a server-side cursor in `batch_size` partitions, so
+    memory is bounded by one batch plus the training sample of trainable index
+    types. Vector ids are assigned sequentially from 0 in stream order.
+
+    Args:
+        db: AsyncSession to stream from.
+        kb: The KnowledgeBase row whose embeddings are loaded.
+        dim: Embedding dimensionality.
+        index_config: Normalized index config (see `normalize_index_config`).
+        batch_size: Rows per fetch; defaults to INDEX_REBUILD_BATCH_SIZE.
+        on_progress: Called after every batch with the running progress.
+
+    Returns:
+        (index, id_map, progress) ready to be passed to `FAISSManager.finish_rebuild`.
+    """
+    batch_size = batch_size or DEFAULT_BATCH_SIZE
+    embedding_model_name = kb.embedding_model or "text-embedding-ada-002"
+    progress = IndexBuildProgress(str(kb.id))
+    train_sample_size = min_train_size(index_config) * TRAIN_SAMPLE_FACTOR
+
+    index = None if train_sample_size else create_index(dim, index_config)
+    id_map = ChunkIdMap()
+    # Batches held back until the training sample is complete
+    pending: List[Tuple[np.ndarray, List]] = []
+    pending_rows = 0
+
+    def add_batch(vectors: np.ndarray, chunk_ids: List):
+        start_id = len(id_map)
+        index.add_with_ids(vectors, np.arange(start_id, start_id + len(vectors), dtype=np.int64))
+        id_map.append(chunk_ids)
+
+    def train_and_flush():
+        nonlocal index
+        sample = np.concatenate([vectors for vectors, _ in pending]) if pending else np.empty((0, dim), dtype=np.float32)
+        index = create_index(dim, index_config, training_vectors=sample)
+        for vectors, chunk_ids in pending:
+            add_batch(vectors, chunk_ids)
+        pending.clear()
+
+    result = await db.stream(
+        select(Embedding.chunk_id, Embedding.vector_blob, Embedding.vector_dtype, Embedding.vector_scale, Embedding.vector)
+        .join(DocumentChunk, Embedding.chunk_id == DocumentChunk.id)
+        .join(DocModel, DocumentChunk.document_id == DocModel.id)
+        .where(DocModel.knowledge_base_id == kb.id, Embedding.model == embedding_model_name)
+        .order_by(DocumentChunk.document_id, DocumentChunk.chunk_index)
+        .execution_options(yield_per=batch_size)
+    )
+    async for rows in result.partitions(batch_size):
+        chunk_ids = [row[0] for row in rows]
+        vectors = await asyncio.to_thread(decode_rows, (row[1:] for row in rows), dim)
+        if index is None:
+            pending.append((vectors, chunk_ids))
+            pending_rows += len(vectors)
+            if pending_rows >= train_sample_size:
+                await asyncio.to_thread(train_and_flush)
+        else:
+            await asyncio.to_thread(add_batch, vectors, chunk_ids)
+        progress.rows += len(rows)
+        progress.batches += 1
+        logger.info(f"Index rebuild for KB {kb.id}: {progress.rows} vectors loaded ({progress.rows_per_sec:.0f} vectors/s)")
+        if on_progress:
+            on_progress(progress)
+
+    if index is None:
+        # Fewer rows than the full training sample: train on what there is (or stage on flat)
+        await asyncio.to_thread(train_and_flush)
+    return index, id_map, progress
+
+
+async def build_lexical_index_from_db(db, kb, id_map: ChunkIdMap, batch_size: Optional[int] = None) -> Tuple[Delta, int]:
+    """Tokenizes every chunk of `kb` that has a vector in `id_map` into a BM25 delta keyed by
+    those vector ids; pass the result to `BM25Index.replace`. Returns (delta, documents)."""
+    batch_size = batch_size or DEFAULT_BATCH_SIZE
+    sorted_ids = await asyncio.to_thread(id_map.sorted_index)
+    delta = Delta()
+
+    def add_batch(rows):
+        vector_ids = id_map.locate([row[0] for row in rows], sorted_ids)
+        added = 0
+        for vector_id, (_, text) in zip(vector_ids, rows):
+            if vector_id >= 0:
+                delta.add(int(vector_id), dict(Counter(tokenize(text))))
+                added += 1
+        return added
+
+    documents = 0
+    result = await db.stream(
+        select(DocumentChunk.id, DocumentChunk.text)
+        .join(DocModel, DocumentChunk.document_id == DocModel.id)
+        .where(DocModel.knowledge_base_id == kb.id)
+        .execution_options(yield_per=batch_size)
+    )
+    async for rows in result.partitions(batch_size):
+        documents += await asyncio.to_thread(add_batch, rows)
+    return delta, documents
+
+
+async def build_metadata_index_from_db(db, kb, id_map: ChunkIdMap, batch_size: Optional[int] = None) -> MetadataIndex:
+    """Builds the metadata index (per-tag and per-document vector ids) of `kb` against `id_map`."""
+    batch_size = batch_size or DEFAULT_BATCH_SIZE
+    start = time.time()
+    sorted_ids = await asyncio.to_thread(id_map.sorted_index)
+    documents = {
+        str(doc_id): (title, created_at, tags)
+        for doc_id, title, created_at, tags in (await db.execute(
+            select(DocModel.id, DocModel.title, DocModel.created_at, DocModel.tags).where(DocModel.knowledge_base_id == kb.id)
+        )).all()
+    }
+    index = MetadataIndex()
+
+    def add_batch(rows):
+        vector_ids = id_map.locate([row[0] for row in rows], sorted_ids)
+        doc_ids = np.array([str(row[1]) for row in rows])
+        found = vector_ids >= 0
+        for doc_id in np.unique(doc_ids[found]):
+            title, created_at, tags = documents.get(doc_id, (None, None, None))
+            index.add_document(doc_id, title, created_at, tags, vector_ids[found & (doc_ids == doc_id)])
+
+    result = await db.stream(
+        select(DocumentChunk.id, DocumentChunk.document_id)
+        .join(DocModel, DocumentChunk.document_id == DocModel.id)
+        .where(DocModel.knowledge_base_id == kb.id)
+        .execution_options(yield_per=batch_size)
+    )
+    async for rows in result.partitions(batch_size):
+        await asyncio.to_thread(add_batch, rows)
+    logger.info(f"Built metadata index for KB {kb.id}: {len(index.documents)} documents, {len(index.tag_bitmaps)} tags in {time.time() - start:.2f}s")
+    return index
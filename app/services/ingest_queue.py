@@ -0,0 +1,211 @@
+import os
+import json
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Sequence, Tuple
+import time
+from sqlalchemy import update, func
+from sqlalchemy.future import select
+from app.models import IngestJob, Document as DocModel, KnowledgeBase as KBModel
+from app.services.metadata_index import normalize_tags
+
+logger = logging.getLogger(__name__)
+
+
+class IngestQueue:
+    """Durable ingestion queue backed by the rag_ingest_job table.
+
+    Uploads are stored on the job row and a `queued` document row is created
+    for each file, so callers get ids back immediately. Worker tasks claim jobs
+    with SELECT ... FOR UPDATE SKIP LOCKED, so workers in several processes can
+    share the table; their appends to a KB's index files are serialized across
+    processes by `FAISSManager.file_lock` (`kb_write_lock` only orders writers
+    within one process).
+
+    A running job holds a lease: its worker renews `heartbeat_at` every third
+    of INGEST_JOB_STALE_SECONDS. Idle workers periodically re-queue jobs whose
+    lease lapsed, e.g. because their process died, and fail them after
+    INGEST_JOB_MAX_ATTEMPTS.
+    """
+
+    def __init__(self):
+        self.workers = int(os.getenv("INGEST_WORKERS", "2"))
+        self.poll_interval = float(os.getenv("INGEST_POLL_INTERVAL_SECONDS", "2"))
+        self.stale_seconds = float(os.getenv("INGEST_JOB_STALE_SECONDS", "300"))
+        self.max_attempts = int(os.getenv("INGEST_JOB_MAX_ATTEMPTS", "3"))
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._next_sweep = 0.0  # Monotonic time of the next stale-job sweep in this process
+
+    async def enqueue(self, db, kb: KBModel, files: Sequence[Tuple[Optional[str], bytes]], tags: Optional[List[str]] = None) -> List[IngestJob]:
+        """Creates a queued document (with `tags`) and an ingest job per (filename, content) pair."""
+        jobs = []
+        tags = normalize_tags(tags) or None
+        for filename, content in files:
+            doc = DocModel(knowledge_base_id=kb.id, title=filename or "Untitled", status="queued", tags=tags)
+            db.add(doc)
+            await db.flush()
+            job = IngestJob(knowledge_base_id=kb.id, document_id=doc.id, filename=filename, content=content, status="queued", attempts=0)
+            db.add(job)
+            jobs.append(job)
+        await db.commit()
+        for job in jobs:
+            await db.refresh(job)
+        logger.info(f"Queued {len(jobs)} files for ingestion into KB {kb.id}")
+        self.notify()
+        return jobs
+
+    def notify(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def start(self):
+        if self._tasks or self.workers <= 0:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        logger.info(f"Started {self.workers} ingest workers")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self, worker_no: int):
+        from app.db.database import AsyncSessionLocal
+        while True:
+            try:
+                async with AsyncSessionLocal() as db:
+                    job_id = await self._claim(db)
+                if job_id is None:
+                    await self._maybe_requeue_stale()
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                await self._run(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ingest worker {worker_no} error: {e}")
+                await asyncio.sleep(self.poll_interval)
+
+    async def _claim(self, db) -> Optional[str]:
+        job = (await db.execute(
+            select(IngestJob)
+            .where(IngestJob.status == "queued")
+            .order_by(IngestJob.created_at)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        )).scalars().first()
+        if job is None:
+            await db.rollback()
+            return None
+        job.status = "processing"
+        job.attempts = (job.attempts or 0) + 1
+        job.started_at = job.heartbeat_at = datetime.now(timezone.utc)
+        await db.commit()
+        return job.id
+
+    async def _run(self, job_id):
+        heartbeat = asyncio.create_task(self._heartbeat(job_id))
+        try:
+            await self._run_job(job_id)
+        finally:
+            heartbeat.cancel()
+
+    async def _run_job(self, job_id):
+        from app.db.database import AsyncSessionLocal
+        from app.services.rag import get_rag_service
+        async with AsyncSessionLocal() as db:
+            job = await db.get(IngestJob, job_id)
+            if job is None:
+                return
+            try:
+                kb = await db.get(KBModel, job.knowledge_base_id)
+                if kb is None:
+                    raise Exception("Knowledge base not found")
+                document = await db.get(DocModel, job.document_id) if job.document_id else None
+                result = await get_rag_service(db).ingest_document(kb, job.content, filename=job.filename, document=document)
+            except asyncio.CancelledError:
+                # Shutting down: hand the job back so another worker picks it up
+                await self._finish(job_id, "queued", error="Interrupted by shutdown")
+                raise
+            except Exception as e:
+                logger.error(f"Ingest job {job_id} ({job.filename}) failed: {e}")
+                await db.rollback()
+                await self._finish(job_id, "failed", error=str(e))
+                return
+        await self._finish(job_id, "completed", result=result)
+
+    async def _finish(self, job_id, status: str, error: str = None, result: dict = None):
+        from app.db.database import AsyncSessionLocal
+        async with AsyncSessionLocal() as db:
+            job = await db.get(IngestJob, job_id)
+            if job is None:
+                # The knowledge base was deleted while the job ran
+                return
+            job.status = status
+            job.error = error
+            if status != "queued":
+                job.finished_at = datetime.now(timezone.utc)
+                job.content = None
+            if result is not None:
+                job.result = json.dumps(result)
+            if status == "failed" and job.document_id:
+                doc = await db.get(DocModel, job.document_id)
+                if doc is not None and doc.status != "failed":
+                    doc.status = "failed"
+                    doc.status_reason = error
+            await db.commit()
+
+    async def _heartbeat(self, job_id):
+        """Renews the lease of a running job until cancelled."""
+        from app.db.database import AsyncSessionLocal
+        while True:
+            await asyncio.sleep(self.stale_seconds / 3)
+            try:
+                async with AsyncSessionLocal() as db:
+                    await db.execute(
+                        update(IngestJob).where(IngestJob.id == job_id, IngestJob.status == "processing")
+                        .values(heartbeat_at=datetime.now(timezone.utc)).execution_options(synchronize_session=False)
+                    )
+                    await db.commit()
+            except Exception as e:
+                logger.warning(f"Failed to renew the lease of ingest job {job_id}: {e}")
+
+    async def _maybe_requeue_stale(self):
+        # Idle workers of one process share a sweep every third of the lease
+        now = time.monotonic()
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + self.stale_seconds / 3
+        try:
+            await self._requeue_stale()
+        except Exception as e:
+            logger.warning(f"Failed to re-queue stale ingest jobs: {e}")
+
+    async def _requeue_stale(self):
+        from app.db.database import AsyncSessionLocal
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.stale_seconds)
+        stale = (IngestJob.status == "processing", func.coalesce(IngestJob.heartbeat_at, IngestJob.started_at) < cutoff)
+        async with AsyncSessionLocal() as db:
+            requeued = (await db.execute(
+                update(IngestJob).where(*stale, IngestJob.attempts < self.max_attempts)
+                .values(status="queued").execution_options(synchronize_session=False)
+            )).rowcount
+            failed = (await db.execute(
+                update(IngestJob).where(*stale)
+                .values(status="failed", error="Worker stopped while processing; retry limit reached", content=None)
+                .execution_options(synchronize_session=False)
+            )).rowcount
+            await db.commit()
+        if requeued or failed:
+            logger.info(f"Re-queued {requeued} stale ingest jobs ({failed} exceeded the retry limit)")
+
+
+ingest_queue = IngestQueue()
@@ -0,0 +1,169 @@
+import os
+import time
+import logging
+import threading
+import numpy as np
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+FILTER_FIELDS = ("document_ids", "tags", "created_after", "created_before", "title_contains")
+
+
+def has_filters(filters) -> bool:
+    return filters is not None and any(getattr(filters, name, None) for name in FILTER_FIELDS)
+
+
+def normalize_tags(tags: Optional[Iterable[str]]) -> List[str]:
+    """Lower-cased, stripped, de-duplicated tags in their original order."""
+    return list(dict.fromkeys(tag.strip().lower() for tag in (tags or []) if tag and tag.strip()))
+
+
+def _timestamp(value: Optional[datetime]) -> Optional[float]:
+    return value.timestamp() if value is not None else None
+
+
+def bitmap_from_ids(ids: np.ndarray, size: int) -> np.ndarray:
+    """Packed bitmap (little bit order, as FAISS IDSelectorBitmap reads it) with the bits of `ids` set."""
+    bitmap = np.zeros((size + 7) // 8, dtype=np.uint8)
+    ids = np.asarray(ids, dtype=np.int64)
+    ids = ids[(ids >= 0) & (ids < size)]
+    np.bitwise_or.at(bitmap, ids >> 3, np.left_shift(1, ids & 7).astype(np.uint8))
+    return bitmap
+
+
+def bitmap_count(bitmap: np.ndarray) -> int:
+    return int(np.unpackbits(bitmap).sum())
+
+
+def bitmap_contains(bitmap: np.ndarray, ids: np.ndarray) -> np.ndarray:
+    """Vectorized membership test of vector ids in a packed bitmap."""
+    ids = np.asarray(ids, dtype=np.int64)
+    byte_idx = ids >> 3
+    in_range = (ids >= 0) & (byte_idx < len(bitmap))
+    out = np.zeros(len(ids), dtype=bool)
+    out[in_range] = (bitmap[byte_idx[in_range]] >> (ids[in_range] & 7).astype(np.uint8)) & 1 == 1
+    return out
+
+
+class MetadataIndex:
+    """Document metadata of one KB, keyed by FAISS vector id, for filtered searches.
+
+    Tags are precomputed as one bitmap of vector ids per tag; document-level
+    filters (ids, title, creation date) are evaluated over the document table
+    and turned into a bitmap from the matching documents' vector ids. `select`
+    ANDs the filters into a single bitmap for `KBFaissManager.search`.
+    """
+
+    def __init__(self):
+        self.size = 0  # One past the highest vector id seen
+        self.documents: Dict[str, dict] = {}
+        self.tag_bitmaps: Dict[str, np.ndarray] = {}
+        self.built_at = time.monotonic()
+
+    def add_document(self, doc_id, title: Optional[str], created_at: Optional[datetime], tags: Optional[Iterable[str]], vector_ids: np.ndarray):
+        """Records a document's vectors; called again for the same document, its ids are appended."""
+        vector_ids = np.asarray(vector_ids, dtype=np.int64)
+        doc_id = str(doc_id)
+        entry = self.documents.get(doc_id)
+        if entry is None:
+            entry = self.documents[doc_id] = {
+                "title": (title or "").lower(),
+                "created_at": _timestamp(created_at),
+                "tags": normalize_tags(tags),
+                "ids": vector_ids
+            }
+        else:
+            entry["ids"] = np.concatenate([entry["ids"], vector_ids])
+        if not len(vector_ids):
+            return
+        self.size = max(self.size, int(vector_ids.max()) + 1)
+        for tag in entry["tags"]:
+            bitmap = self.tag_bitmaps.get(tag)
+            needed = (self.size + 7) // 8
+            if bitmap is None or len(bitmap) < needed:
+                grown = np.zeros(max(needed, 2 * len(bitmap) if bitmap is not None else needed), dtype=np.uint8)
+                if bitmap is not None:
+                    grown[:len(bitmap)] = bitmap
+                bitmap = self.tag_bitmaps[tag] = grown
+            np.bitwise_or.at(bitmap, vector_ids >> 3, np.left_shift(1, vector_ids & 7).astype(np.uint8))
+
+    def remove_document(self, doc_id):
+        # Tag bits of the document stay set; its vectors are tombstoned, so searches skip them anyway
+        self.documents.pop(str(doc_id), None)
+
+    def select(self, filters) -> Optional[np.ndarray]:
+        """Bitmap of vector ids matching `filters` (document_ids, tags, created_after,
+        created_before, title_contains; all given ones must hold), or None without filters."""
+        nbytes = (self.size + 7) // 8
+        mask = None
+        tags = normalize_tags(getattr(filters, "tags", None))
+        if tags:
+            mask = np.zeros(nbytes, dtype=np.uint8)
+            for tag in tags:
+                bitmap = self.tag_bitmaps.get(tag)
+                if bitmap is not None:
+                    common = min(len(bitmap), nbytes)
+                    mask[:common] |= bitmap[:common]
+
+        document_ids = getattr(filters, "document_ids", None)
+        created_after = _timestamp(getattr(filters, "created_after", None))
+        created_before = _timestamp(getattr(filters, "created_before", None))
+        title_contains = (getattr(filters, "title_contains", None) or "").lower()
+        if document_ids or created_after is not None or created_before is not None or title_contains:
+            wanted = {str(doc_id) for doc_id in document_ids} if document_ids else None
+            ids = [
+                entry["ids"] for doc_id, entry in self.documents.items()
+                if (wanted is None or doc_id in wanted)
+                and (created_after is None or (entry["created_at"] is not None and entry["created_at"] >= created_after))
+                and (created_before is None or (entry["created_at"] is not None and entry["created_at"] < created_before))
+                and (not title_contains or title_contains in entry["title"])
+            ]
+            documents_mask = bitmap_from_ids(np.concatenate(ids) if ids else np.zeros(0, dtype=np.int64), self.size)
+            mask = documents_mask if mask is None else mask & documents_mask
+        return mask
+
+
+class MetadataIndexRegistry:
+    """Process-wide cache of metadata indexes keyed by KB id.
+
+    Ingestion and deletes in this process update cached indexes in place;
+    entries older than METADATA_INDEX_TTL_SECONDS are rebuilt so changes made
+    by other processes show up eventually.
+    """
+
+    def __init__(self, ttl: Optional[float] = None):
+        self.ttl = ttl if ttl is not None else float(os.getenv("METADATA_INDEX_TTL_SECONDS", "300"))
+        self._entries: Dict[str, MetadataIndex] = {}
+        self._lock = threading.Lock()
+
+    def cached(self, kb_id) -> Optional[MetadataIndex]:
+        with self._lock:
+            index = self._entries.get(str(kb_id))
+            if index is not None and self.ttl and time.monotonic() - index.built_at > self.ttl:
+                del self._entries[str(kb_id)]
+                return None
+            return index
+
+    def put(self, kb_id, index: MetadataIndex):
+        with self._lock:
+            self._entries[str(kb_id)] = index
+
+    def add_document(self, kb_id, doc, vector_ids: np.ndarray):
+        index = self.cached(kb_id)
+        if index is not None:
+            index.add_document(doc.id, doc.title, doc.created_at, doc.tags, vector_ids)
+
+    def remove_document(self, kb_id, doc_id):
+        index = self.cached(kb_id)
+        if index is not None:
+            index.remove_document(doc_id)
+
+    def invalidate(self, kb_id):
+        with self._lock:
+            self._entries.pop(str(kb_id), None)
+
+
+metadata_registry = MetadataIndexRegistry()
@@ -1,13 +1,26 @@
 import os
-from typing import Optional, Dict, Any
+import json
+import hashlib
+import logging
+import threading
+from typing import Optional, Dict, Any, Tuple
+
+logger = logging.getLogger(__name__)
 
 class ProviderManager:
     """
     Loads and manages LLM/embedding provider configuration from environment variables.
     Supports dynamic instantiation of any provider (OpenAI, Azure, Ollama, Cohere, Anthropic, etc.).
+
+    Client instances are pooled per (provider, embedding model, completion model,
+    credentials) and reused across requests. Each instance holds its own credentials,
+    so providers never share SDK-global state. `reload()` re-reads the configuration
+    and drops clients whose configuration changed.
     """
     def __init__(self):
         self.providers = {}
+        self._clients: Dict[Tuple, Any] = {}
+        self._clients_lock = threading.Lock()
         self.provider_registry = {
             "openai": self._instantiate_openai,
             "azure": self._instantiate_azure,
@@ -18,6 +31,7 @@ class ProviderManager:
         self.load_providers()
 
     def load_providers(self):
+        self.providers = {}
         # OpenAI
         openai_key = os.getenv("OPENAI_API_KEY")
         if openai_key:
@@ -65,9 +79,11 @@ class ProviderManager:
     def get_available_providers(self):
         return list(self.providers.keys())
 
-    def get_provider_client(self, name: str):
+    def get_provider_client(self, name: str, embedding_model: Optional[str] = None, completion_model: Optional[str] = None):
         """
-        Dynamically instantiate and return the provider client for the given provider name.
+        Return the pooled provider client for the given provider name, creating it on first use.
+        `embedding_model` / `completion_model` override the configured defaults (e.g. a KB's
+        embedding model); each combination gets its own long-lived client.
         Raises a descriptive error if the provider is not configured in the environment.
         """
         if name not in self.provider_registry:
@@ -78,7 +94,46 @@ class ProviderManager:
                 f"Provider '{name}' is not configured in your environment variables. "
                 f"Please set the required environment variables for this provider (see .env.example)."
             )
-        return self.provider_registry[name](config)
+        config = dict(config)
+        if embedding_model:
+            config["embedding_model"] = embedding_model
+        if completion_model:
+            config["completion_model"] = completion_model
+        key = (name, config.get("embedding_model"), config.get("completion_model"), self._fingerprint(self.providers[name]))
+        client = self._clients.get(key)
+        if client is None:
+            with self._clients_lock:
+                client = self._clients.get(key)
+                if client is None:
+                    client = self._clients[key] = self.provider_registry[name](config)
+                    logger.info(f"Created {name} client (embedding={key[1]}, completion={key[2]})")
+        return client
+
+    def reload(self) -> Dict[str, Any]:
+        """
+        Re-reads provider configuration from the environment (and .env) and drops pooled
+        clients whose provider configuration changed or was removed. In-flight requests
+        keep using the client they already hold.
+        """
+        from dotenv import load_dotenv
+        from pathlib import Path
+        load_dotenv(Path(__file__).resolve().parent.parent.parent / ".env", override=True)
+        self.load_providers()
+        current = {name: self._fingerprint(config) for name, config in self.providers.items()}
+        with self._clients_lock:
+            stale = [key for key in self._clients if current.get(key[0]) != key[3]]
+            for key in stale:
+                del self._clients[key]
+        logger.info(f"Reloaded provider configuration: {sorted(current)}; dropped {len(stale)} pooled client(s)")
+        return {"providers": sorted(current), "clients_dropped": len(stale), "clients_pooled": len(self._clients)}
+
+    def pooled_clients(self) -> list:
+        return [{"provider": key[0], "embedding_model": key[1], "completion_model": key[2]} for key in list(self._clients)]
+
+    @staticmethod
+    def _fingerprint(config: Dict[str, Any]) -> str:
+        # Hash rather than keep raw credentials in pool keys
+        return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode("utf-8")).hexdigest()
 
     def _instantiate_openai(self, config: Dict[str, Any]):
         from app.core.providers.openai_provider import OpenAIProviderClient
@@ -101,7 +156,7 @@ class ProviderManager:
         from app.core.providers.ollama_provider import OllamaProviderClient
         return OllamaProviderClient(
             host=config["host"],
-            model=config.get("model", "llama2")
+            model=config.get("completion_model") or config.get("model", "llama2")
         )
 
     def _instantiate_cohere(self, config: Dict[str, Any]):
@@ -118,3 +173,7 @@ class ProviderManager:
             api_key=config["api_key"],
             completion_model=config.get("completion_model", "claude-3-opus-20240229")
         )
+
+
+# Process-wide manager so pooled clients are shared by every request
+provider_manager = ProviderManager()
@@ -0,0 +1,143 @@
+import os
+import re
+import time
+import hashlib
+import logging
+import numpy as np
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """Small in-process LRU cache whose entries expire `ttl` seconds after being set."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+def normalize_query(query: str) -> str:
+    """Case- and whitespace-insensitive form of a query, so trivial variants share an entry."""
+    return re.sub(r"\s+", " ", query).strip().lower()
+
+
+class QueryEmbeddingCache:
+    """Caches query embeddings keyed by provider, model and normalized query text.
+
+    Entries live in a per-process LRU with TTL. When QUERY_EMBEDDING_CACHE_REDIS_URL
+    is set (and the optional `redis` package is installed), entries are also
+    shared through Redis so every worker benefits from the others' misses.
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv("QUERY_EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+        self.ttl = float(os.getenv("QUERY_EMBEDDING_CACHE_TTL_SECONDS", "3600"))
+        self.local = TTLCache(int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "10000")), self.ttl)
+        self.redis = None
+        redis_url = os.getenv("QUERY_EMBEDDING_CACHE_REDIS_URL")
+        if redis_url:
+            try:
+                import redis.asyncio as redis_asyncio
+                self.redis = redis_asyncio.from_url(redis_url)
+            except ImportError:
+                logger.warning("QUERY_EMBEDDING_CACHE_REDIS_URL is set but the 'redis' package is not installed; using the in-process cache only.")
+        self._stats = {"hits": 0, "shared_hits": 0, "misses": 0, "errors": 0}
+
+    def key(self, provider: str, model: str, query: str) -> str:
+        digest = hashlib.sha256(normalize_query(query).encode("utf-8")).hexdigest()
+        return f"rag:qemb:{provider}:{model}:{digest}"
+
+    def cached(self, provider: str, model: str, query: str) -> Optional[List[float]]:
+        """The embedding of `query` from the in-process cache, or None without awaiting anything."""
+        if not self.enabled:
+            return None
+        vector = self.local.get(self.key(provider, model, query))
+        if vector is not None:
+            self._stats["hits"] += 1
+        return vector
+
+    async def get_or_embed(self, embed_client, provider: str, model: str, query: str) -> List[float]:
+        """Returns the embedding of `query`, calling `embed_client.embed_texts` only on a miss."""
+        return (await self.get_or_embed_many(embed_client, provider, model, [query]))[0]
+
+    async def get_or_embed_many(self, embed_client, provider: str, model: str, queries: List[str]) -> List[List[float]]:
+        """Returns the embeddings of `queries` in order; all misses are embedded in one `embed_texts` call."""
+        if not self.enabled:
+            return await embed_client.embed_texts(list(queries)) if queries else []
+        keys = [self.key(provider, model, query) for query in queries]
+        found: Dict[str, List[float]] = {}
+        for key in keys:
+            vector = self.local.get(key)
+            if vector is not None:
+                found[key] = vector
+                self._stats["hits"] += 1
+
+        missing = list(dict.fromkeys(key for key in keys if key not in found))
+        if missing and self.redis is not None:
+            try:
+                for key, blob in zip(missing, await self.redis.mget(missing)):
+                    if blob is not None:
+                        found[key] = np.frombuffer(blob, dtype="<f4").tolist()
+                        self.local.set(key, found[key])
+                        self._stats["shared_hits"] += 1
+                missing = [key for key in missing if key not in found]
+            except Exception as e:
+                self._stats["errors"] += 1
+                logger.warning(f"Query embedding cache lookup in Redis failed: {e}")
+
+        if missing:
+            # Near-duplicate queries share a key, so each distinct query is embedded once
+            text_of = {key: query for key, query in zip(keys, queries)}
+            self._stats["misses"] += len(missing)
+            vectors = await embed_client.embed_texts([text_of[key] for key in missing])
+            for key, vector in zip(missing, vectors):
+                found[key] = vector
+                self.local.set(key, vector)
+            if self.redis is not None:
+                try:
+                    async with self.redis.pipeline(transaction=False) as pipe:
+                        for key in missing:
+                            pipe.set(key, np.asarray(found[key], dtype="<f4").tobytes(), ex=int(self.ttl))
+                        await pipe.execute()
+                except Exception as e:
+                    self._stats["errors"] += 1
+                    logger.warning(f"Query embedding cache write to Redis failed: {e}")
+        return [found[key] for key in keys]
+
+    def stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        lookups = stats["hits"] + stats["shared_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["hits"] + stats["shared_hits"]) / lookups, 4) if lookups else 0.0
+        stats["entries"] = len(self.local)
+        stats["shared_backend"] = "redis" if self.redis is not None else None
+        stats["enabled"] = self.enabled
+        return stats
+
+
+query_embedding_cache = QueryEmbeddingCache()
@@ -1,158 +1,420 @@
 import uuid
-from typing import Any, List
+from typing import Any, List, Optional, Tuple
 from app.models import KnowledgeBase as KBModel, Document as DocModel, DocumentChunk, Embedding
 from app.models.query_log import QueryLog
-from app.services.provider_manager import ProviderManager
-from app.services.faiss_manager import FAISSManager, get_index_path
+from app.services.provider_manager import provider_manager
+from app.services.faiss_manager import get_faiss_manager, index_config_from_kb
+from app.services.embedding_scheduler import embedding_scheduler
+from app.services.embedding_cache import embedding_cache, content_hash
+from app.services.query_embedding_cache import query_embedding_cache
+from app.services.semantic_cache import semantic_cache
+from app.services.vector_codec import encode_vector, decode_vector, default_storage_dtype
+from app.services.text_extraction import iter_document_text
+from app.services.chunking import chunk_stream
+from app.services.context_builder import build_context, context_budget
+from app.services.bm25_index import bm25_registry, reciprocal_rank_fusion
+from app.services.metadata_index import metadata_registry, normalize_tags, has_filters, bitmap_contains, bitmap_count
 import numpy as np
 import json
 import os
-import io
-from PyPDF2 import PdfReader
-from docx import Document as DocxDocument
 import time
+import asyncio
+import logging
 
 # Provider and vector search abstraction
-provider_manager = ProviderManager()
 faiss_dim = int(os.getenv("EMBEDDING_DIM", "1536"))  # Default for OpenAI ada-002
+insert_batch_size = int(os.getenv("INGEST_INSERT_BATCH_SIZE", "1000"))  # Rows per multi-row INSERT during ingestion
+# Hybrid retrieval: share of the fused ranking given to BM25 (0 = vector only) unless the KB sets lexical_weight
+hybrid_lexical_weight = float(os.getenv("HYBRID_LEXICAL_WEIGHT", "0.3"))
+# Each retriever returns top_k * this many candidates for fusion
+hybrid_candidate_multiplier = int(os.getenv("HYBRID_CANDIDATE_MULTIPLIER", "4"))
+
+logger = logging.getLogger(__name__)
+
+# Federated queries: how long each KB may take to produce candidates before it is left out
+federated_kb_timeout_seconds = float(os.getenv("FEDERATED_KB_TIMEOUT_SECONDS", "2"))
+
+_kb_write_locks = {}
+
+
+def kb_write_lock(kb_id) -> asyncio.Lock:
+    """Serializes index and chunk writes per KB within this process, so concurrent ingests
+    of one KB can extract and embed in parallel but append to its index one at a time.
+    Writers in other processes are serialized by `FAISSManager.file_lock`."""
+    key = str(kb_id)
+    lock = _kb_write_locks.get(key)
+    if lock is None:
+        lock = _kb_write_locks[key] = asyncio.Lock()
+    return lock
+
+
+def build_prompt(context: str, query: str) -> str:
+    return (
+        f"Use the following context exclusively to answer the question. If the context does not contain the answer, say so.\n\n"
+        f"Context:\n{context or 'No context provided.'}\n\n"
+        f"Question: {query}\n\n"
+        "Answer:"
+    )
+
 
 class RAGService:
     def __init__(self, db):
         self.db = db
+        # An AsyncSession must not be used by concurrent tasks; ingest_documents' stages share it
+        self._db_lock = asyncio.Lock()
+
+    async def ingest_document(self, kb: KBModel, content: bytes, filename: str = None, document: DocModel = None, tags: List[str] = None) -> dict:
+        """
+        Extracts, chunks, embeds and indexes one file. `document` is the row created when the
+        file was queued for ingestion; without it a new document row is created with `tags`.
+        """
+        if document is not None:
+            new_doc = document
+            new_doc.status = "processing"
+        else:
+            new_doc = DocModel(
+                knowledge_base_id=kb.id,
+                title=filename or "Untitled",
+                status="processing",
+                tags=normalize_tags(tags) or None
+            )
+            self.db.add(new_doc)
+        await self.db.commit()
+        await self.db.refresh(new_doc)
 
-    def extract_text_from_pdf(self, pdf_bytes):
         try:
-            reader = PdfReader(io.BytesIO(pdf_bytes))
-            text = ""
-            for page in reader.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n"
-            return text
+            chunks, new_doc.source = await self._extract_chunks(kb, content, filename)
         except Exception as e:
-            return ""
+            new_doc.status = "failed"
+            new_doc.status_reason = f"Extraction failed: {str(e)}"
+            await self.db.commit()
+            raise Exception(new_doc.status_reason)
 
-    def extract_text_from_docx(self, docx_bytes):
         try:
-            doc = DocxDocument(io.BytesIO(docx_bytes))
-            text = "\n".join([para.text for para in doc.paragraphs])
-            return text
+            ai_provider_name, embedding_model_name, embed_client = self._embedding_client(kb)
         except Exception as e:
-            return ""
-
-    async def ingest_document(self, kb: KBModel, content: bytes, filename: str = None) -> dict:
-        # Determine file type and extract text accordingly
-        text = ""
-        if filename:
-            fname = filename.lower()
-            if fname.endswith('.pdf'):
-                text = self.extract_text_from_pdf(content)
-            elif fname.endswith('.docx'):
-                text = self.extract_text_from_docx(content)
-            else:
+            new_doc.status = "failed"
+            new_doc.status_reason = str(e)
+            await self.db.commit()
+            raise
+
+        try:
+            vectors, cache_hits = await self._embed_with_cache(embed_client, ai_provider_name, embedding_model_name, chunks)
+        except Exception as e:
+            new_doc.status = "failed"
+            new_doc.status_reason = f"Embedding failed: {str(e)}"
+            await self.db.commit()
+            raise Exception(new_doc.status_reason)
+
+        async with kb_write_lock(kb.id):
+            chunk_ids, rows_per_sec = await self._write_chunks(new_doc, chunks, vectors, ai_provider_name, embedding_model_name)
+            # Chunk rows are committed before their vectors are indexed, so the index never
+            # holds vectors of chunks that a failed commit left out of the database
+            await self.db.commit()
+
+            if vectors:
                 try:
-                    text = content.decode(errors="ignore")
-                except Exception:
-                    text = ""
-        else:
-            try:
-                text = content.decode(errors="ignore")
-            except Exception:
-                text = ""
+                    # Index appends may train an IVF index or write a new base; keep them off the event loop
+                    kb_faiss_manager = await asyncio.to_thread(get_faiss_manager, str(kb.id), faiss_dim, index_config_from_kb(kb))
+                    vector_ids = await asyncio.to_thread(kb_faiss_manager.add_embeddings, [np.array(vector, dtype=np.float32) for vector in vectors], chunk_ids)
+                    await asyncio.to_thread(lambda: bm25_registry.get(kb.id).add(vector_ids, chunks))
+                except Exception as e:
+                    await self._discard_unindexed(kb, [new_doc], chunk_ids, f"Indexing failed: {str(e)}")
+                    raise Exception(new_doc.status_reason)
+                metadata_registry.add_document(kb.id, new_doc, vector_ids)
 
-        new_doc = DocModel(
-            knowledge_base_id=kb.id,
-            title=filename or "Untitled",
-            source=text, 
-            status="processing"
-        )
-        self.db.add(new_doc)
+            new_doc.status = "ready"
+            await self.db.commit()
+            await self.db.refresh(new_doc)
+            semantic_cache.invalidate(str(kb.id))
+
+            # Re-ingesting a title replaces the previous version once the new one is searchable
+            replaced = await self._replace_older_versions(kb, new_doc)
+        return {
+            "document_id": str(new_doc.id),
+            "chunks": len(chunk_ids),
+            "status": new_doc.status,
+            "rows_per_sec": round(rows_per_sec, 1),
+            "embedding_cache_hits": cache_hits,
+            "replaced_documents": replaced
+        }
+
+    async def ingest_documents(self, kb: KBModel, files: List[Tuple[Optional[str], bytes]], concurrency: int = 4, tags: List[str] = None) -> List[dict]:
+        """
+        Ingests several files in one pipelined pass and returns a result per file, in order.
+
+        Files move independently through extraction and embedding (each stage allows
+        `concurrency` files at a time) and are written to the database one at a time, each
+        in its own savepoint so a failing file does not undo the others. Vectors of every
+        successful file go into the KB index with a single append at the end.
+        """
+        concurrency = max(1, concurrency)
+        tags = normalize_tags(tags) or None
+        docs = [DocModel(knowledge_base_id=kb.id, title=filename or "Untitled", status="processing", tags=tags) for filename, _ in files]
+        self.db.add_all(docs)
         await self.db.commit()
-        await self.db.refresh(new_doc)
+        for doc in docs:
+            await self.db.refresh(doc)
+
+        try:
+            ai_provider_name, embedding_model_name, embed_client = self._embedding_client(kb)
+        except Exception as e:
+            for doc in docs:
+                doc.status = "failed"
+                doc.status_reason = str(e)
+            await self.db.commit()
+            raise
 
-        # Use chunking parameters from the KB object
-        def simple_chunk(text, size=1000, overlap=200): 
-            words = text.split() 
-            chunks = []
-            i = 0
-            while i < len(words):
-                chunk = words[i:i+size]
-                chunks.append(' '.join(chunk))
-                i += size - overlap
-            return chunks
+        pipeline_start = time.time()
+        extract_slots = asyncio.Semaphore(concurrency)
+        embed_slots = asyncio.Semaphore(concurrency)
 
-        chunks = [c for c in simple_chunk(text, size=kb.chunk_size, overlap=kb.chunk_overlap) if c.strip()]
+        async def process(doc: DocModel, filename: Optional[str], content: bytes) -> dict:
+            stage = "Extraction"
+            try:
+                async with extract_slots:
+                    chunks, source = await self._extract_chunks(kb, content, filename)
+                stage = "Embedding"
+                async with embed_slots:
+                    vectors, cache_hits = await self._embed_with_cache(embed_client, ai_provider_name, embedding_model_name, chunks)
+                stage = "Database write"
+                async with self._db_lock:
+                    async with self.db.begin_nested():
+                        doc.source = source
+                        chunk_ids, rows_per_sec = await self._write_chunks(doc, chunks, vectors, ai_provider_name, embedding_model_name)
+                return {"chunk_ids": chunk_ids, "chunks": chunks, "vectors": vectors, "rows_per_sec": rows_per_sec, "embedding_cache_hits": cache_hits}
+            except Exception as e:
+                logger.error(f"Ingesting {filename} into KB {kb.id} failed: {e}")
+                return {"error": f"{stage} failed: {str(e)}"}
 
-        ai_provider_name = kb.ai_provider or "openai" 
-        embedding_model_name = kb.embedding_model or "text-embedding-ada-002" 
+        outcomes = await asyncio.gather(*(
+            process(doc, filename, content) for doc, (filename, content) in zip(docs, files)
+        ))
 
-        provider_conf = provider_manager.get_provider_config(ai_provider_name)
-        if not provider_conf:
-            new_doc.status = "failed"
-            new_doc.status_reason = f"AI provider '{ai_provider_name}' not found or not enabled"
+        async with kb_write_lock(kb.id):
+            # Commit the chunk rows first; vectors are only indexed once their chunks exist
             await self.db.commit()
-            raise Exception(new_doc.status_reason)
+            chunk_ids = [chunk_id for outcome in outcomes if "error" not in outcome for chunk_id in outcome["chunk_ids"]]
+            vectors = [vector for outcome in outcomes if "error" not in outcome for vector in outcome["vectors"]]
+            if vectors:
+                try:
+                    kb_faiss_manager = await asyncio.to_thread(get_faiss_manager, str(kb.id), faiss_dim, index_config_from_kb(kb))
+                    vector_ids = await asyncio.to_thread(kb_faiss_manager.add_embeddings, np.asarray(vectors, dtype=np.float32), chunk_ids)
+                    texts = [text for outcome in outcomes if "error" not in outcome for text in outcome["chunks"]]
+                    await asyncio.to_thread(lambda: bm25_registry.get(kb.id).add(vector_ids, texts))
+                except Exception as e:
+                    error = f"Indexing failed: {str(e)}"
+                    await self._discard_unindexed(kb, [doc for doc, outcome in zip(docs, outcomes) if "error" not in outcome], chunk_ids, error)
+                    outcomes = [outcome if "error" in outcome else {"error": error} for outcome in outcomes]
+                    vectors = []
+            if vectors:
+                offset = 0
+                for doc, outcome in zip(docs, outcomes):
+                    if "error" not in outcome:
+                        metadata_registry.add_document(kb.id, doc, vector_ids[offset:offset + len(outcome["chunk_ids"])])
+                        offset += len(outcome["chunk_ids"])
 
-        if ai_provider_name == "openai":
-            from app.core.providers.openai_provider import OpenAIProviderClient
-            embed_client = OpenAIProviderClient(
-                api_key=provider_conf["api_key"],
-                embedding_model=embedding_model_name
-            )
-        else:
-             new_doc.status = "failed"
-             new_doc.status_reason = f"AI provider '{ai_provider_name}' not implemented yet for embedding."
-             await self.db.commit()
-             raise NotImplementedError(new_doc.status_reason)
+            for doc, outcome in zip(docs, outcomes):
+                if "error" in outcome:
+                    doc.status = "failed"
+                    doc.status_reason = outcome["error"]
+                else:
+                    doc.status = "ready"
+            await self.db.commit()
+            semantic_cache.invalidate(str(kb.id))
 
+            # Files later in the batch are newer versions, not older ones
+            results = []
+            for position, (doc, (filename, _), outcome) in enumerate(zip(docs, files, outcomes)):
+                result = {"document_id": str(doc.id), "filename": filename, "status": doc.status}
+                if "error" in outcome:
+                    result["error"] = outcome["error"]
+                else:
+                    result.update({
+                        "chunks": len(outcome["chunk_ids"]),
+                        "rows_per_sec": round(outcome["rows_per_sec"], 1),
+                        "embedding_cache_hits": outcome["embedding_cache_hits"],
+                        "replaced_documents": await self._replace_older_versions(kb, doc, keep_ids=[d.id for d in docs[position + 1:]])
+                    })
+                results.append(result)
+        elapsed = time.time() - pipeline_start
+        logger.info(f"Ingested {len(files)} files into KB {kb.id} ({len(chunk_ids)} chunks, concurrency {concurrency}) in {elapsed:.2f}s")
+        return results
+
+    async def _discard_unindexed(self, kb: KBModel, docs: List[DocModel], chunk_ids: List, error: str):
+        """
+        Undoes committed chunks whose index append failed: tombstones any of their vectors
+        that did get in, deletes their rows (so a rebuild does not index them either) and
+        marks the documents failed with `error`.
+        """
+        from sqlalchemy import delete
+        from sqlalchemy.future import select
+        logger.error(f"Indexing chunks of {len(docs)} documents into KB {kb.id} failed: {error}")
         try:
-            vectors = await embed_client.embed_texts(chunks)
+            kb_faiss_manager = await asyncio.to_thread(get_faiss_manager, str(kb.id), faiss_dim, index_config_from_kb(kb))
+            await asyncio.to_thread(kb_faiss_manager.delete_chunks, [str(c) for c in chunk_ids])
         except Exception as e:
-            new_doc.status = "failed"
-            new_doc.status_reason = f"Embedding failed: {str(e)}"
-            await self.db.commit()
-            raise Exception(new_doc.status_reason)
+            logger.error(f"Failed to tombstone unindexed chunks in KB {kb.id}: {e}")
+        doc_ids = [doc.id for doc in docs]
+        chunk_rows = select(DocumentChunk.id).where(DocumentChunk.document_id.in_(doc_ids))
+        await self.db.execute(delete(Embedding).where(Embedding.chunk_id.in_(chunk_rows)))
+        await self.db.execute(delete(DocumentChunk).where(DocumentChunk.document_id.in_(doc_ids)))
+        for doc in docs:
+            doc.status = "failed"
+            doc.status_reason = error
+        await self.db.commit()
+
+    async def _extract_chunks(self, kb: KBModel, content: bytes, filename: Optional[str]) -> Tuple[List[str], str]:
+        """Returns the non-empty chunks of a file and its full extracted text."""
+        # Extraction runs in a process pool and streams page by page into the
+        # chunker; the segments are only joined once, for the document source
+        segments = []
 
+        async def collected_segments():
+            async for segment in iter_document_text(content, filename):
+                segments.append(segment)
+                yield segment
 
-        chunk_objs = []
-        chunk_ids = []
-        np_vectors = []
-        for idx, (chunk_text, vector) in enumerate(zip(chunks, vectors)):
-            chunk_obj = DocumentChunk(
-                document_id=new_doc.id,
-                chunk_index=idx,
-                text=chunk_text
+        chunks = [
+            c async for c in chunk_stream(
+                collected_segments(), kb.chunking_strategy, size=kb.chunk_size, overlap=kb.chunk_overlap, model=kb.embedding_model
             )
-            self.db.add(chunk_obj)
-            await self.db.flush()  
-            emb_obj = Embedding(
-                chunk_id=chunk_obj.id,
-                provider=ai_provider_name, 
-                model=embedding_model_name, 
-                version=None, 
-                vector=json.dumps(vector)
+            if c.strip()
+        ]
+        return chunks, "\n".join(segments)
+
+    def _embedding_client(self, kb: KBModel):
+        """Returns (provider name, embedding model, pooled client) for the KB's provider."""
+        ai_provider_name = kb.ai_provider or "openai"
+        embedding_model_name = kb.embedding_model or "text-embedding-ada-002"
+        if not provider_manager.get_provider_config(ai_provider_name):
+            raise Exception(f"AI provider '{ai_provider_name}' not found or not enabled")
+        try:
+            embed_client = provider_manager.get_provider_client(ai_provider_name, embedding_model=embedding_model_name)
+        except ValueError as e:
+            raise NotImplementedError(str(e))
+        return ai_provider_name, embedding_model_name, embed_client
+
+    async def _write_chunks(self, doc: DocModel, chunks: List[str], vectors: List[List[float]], provider: str, model: str) -> Tuple[List[str], float]:
+        """Inserts the chunk and embedding rows of a document; returns (chunk ids, rows per second)."""
+        # Ids are generated client-side so chunks and embeddings can be written with
+        # multi-row INSERTs instead of one flush per chunk
+        insert_start = time.time()
+        chunk_uuids = [uuid.uuid4() for _ in chunks]
+        chunk_rows = [
+            {"id": chunk_id, "document_id": doc.id, "chunk_index": idx, "text": chunk_text}
+            for idx, (chunk_id, chunk_text) in enumerate(zip(chunk_uuids, chunks))
+        ]
+        storage_dtype = default_storage_dtype()
+        embedding_rows = []
+        for chunk_id, chunk_text, vector in zip(chunk_uuids, chunks, vectors):
+            blob, dtype, scale = encode_vector(vector, storage_dtype)
+            embedding_rows.append({
+                "id": uuid.uuid4(),
+                "chunk_id": chunk_id,
+                "provider": provider,
+                "model": model,
+                "version": None,
+                "vector_blob": blob,
+                "vector_dtype": dtype,
+                "vector_scale": scale,
+                "content_hash": content_hash(chunk_text)
+            })
+        await self._bulk_insert(DocumentChunk, chunk_rows)
+        await self._bulk_insert(Embedding, embedding_rows)
+        insert_seconds = time.time() - insert_start
+        rows_written = len(chunk_rows) + len(embedding_rows)
+        rows_per_sec = rows_written / insert_seconds if insert_seconds > 0 else float(rows_written)
+        logger.info(f"Inserted {rows_written} chunk/embedding rows for document {doc.id} in {insert_seconds:.3f}s ({rows_per_sec:.0f} rows/s)")
+        return [str(chunk_id) for chunk_id in chunk_uuids], rows_per_sec
+
+    async def _embed_with_cache(self, embed_client, provider: str, model: str, texts: List[str]):
+        """
+        Embeds `texts`, reusing cached vectors for chunk text already embedded with the same
+        provider and model. Returns (vectors, cache_hits).
+        """
+        hashes = [content_hash(text) for text in texts]
+        try:
+            async with self._db_lock:
+                cached = await embedding_cache.get_many(self.db, provider, model, hashes)
+        except Exception as e:
+            logger.warning(f"Embedding cache lookup failed, embedding all {len(texts)} chunks: {e}")
+            cached = {}
+        # Duplicate chunks within the document are embedded once
+        to_embed = {}
+        for text, h in zip(texts, hashes):
+            if h not in cached and h not in to_embed:
+                to_embed[h] = text
+        if to_embed:
+            fresh = await embedding_scheduler.embed(embed_client, list(to_embed.values()))
+            fresh = dict(zip(to_embed.keys(), fresh))
+            await embedding_cache.put_many(provider, model, fresh)
+            cached.update(fresh)
+        hits = len(texts) - len(to_embed)
+        if hits:
+            logger.info(f"Embedding cache: reused {hits} of {len(texts)} chunk embeddings")
+        return [cached[h] for h in hashes], hits
+
+    async def _bulk_insert(self, model, rows: List[dict]):
+        """Writes rows with multi-row INSERT statements, `insert_batch_size` rows per statement."""
+        from sqlalchemy import insert
+        for i in range(0, len(rows), insert_batch_size):
+            await self.db.execute(insert(model), rows[i:i + insert_batch_size])
+
+    async def _replace_older_versions(self, kb: KBModel, new_doc: DocModel, keep_ids=()) -> List[str]:
+        from sqlalchemy.future import select
+        older_ids = (await self.db.execute(
+            select(DocModel.id).where(
+                DocModel.knowledge_base_id == kb.id,
+                DocModel.title == new_doc.title,
+                DocModel.id.notin_([new_doc.id, *keep_ids]),
+                # Leave files still waiting in the ingest queue alone
+                DocModel.status.notin_(("queued", "processing"))
             )
-            self.db.add(emb_obj)
-            chunk_objs.append(chunk_obj)
-            chunk_ids.append(str(chunk_obj.id))
-            np_vectors.append(np.array(vector, dtype=np.float32))
-
-        if np_vectors:
-            current_faiss_dim = faiss_dim 
-            kb_index_path = get_index_path(str(kb.id)) 
-            kb_faiss_manager = FAISSManager(dim=current_faiss_dim, index_path=kb_index_path)
-            kb_faiss_manager.add_embeddings(np_vectors, chunk_ids)
-
-        new_doc.status = "ready"
+        )).scalars().all()
+        for doc_id in older_ids:
+            await self._delete_document(kb, doc_id)
+        return [str(doc_id) for doc_id in older_ids]
+
+    async def delete_document(self, kb: KBModel, doc_id) -> dict:
+        """
+        Deletes a document with its chunks and embeddings, then tombstones its vectors
+        in the KB's FAISS index so they stop showing up in searches immediately.
+        """
+        async with kb_write_lock(kb.id):
+            return await self._delete_document(kb, doc_id)
+
+    async def _delete_document(self, kb: KBModel, doc_id) -> dict:
+        from sqlalchemy import delete
+        from sqlalchemy.future import select
+        chunk_ids = (await self.db.execute(
+            select(DocumentChunk.id).where(DocumentChunk.document_id == doc_id)
+        )).scalars().all()
+        if chunk_ids:
+            await self.db.execute(delete(Embedding).where(Embedding.chunk_id.in_(chunk_ids)))
+            await self.db.execute(delete(DocumentChunk).where(DocumentChunk.document_id == doc_id))
+        await self.db.execute(delete(DocModel).where(DocModel.id == doc_id))
         await self.db.commit()
-        await self.db.refresh(new_doc)
-        return {
-            "document_id": str(new_doc.id),
-            "chunks": len(chunk_objs),
-            "status": new_doc.status
-        }
 
-    async def query(self, kb: KBModel, query: str, top_k: int = 3) -> Any:
+        removed = 0
+        if chunk_ids:
+            kb_faiss_manager = await asyncio.to_thread(get_faiss_manager, str(kb.id), faiss_dim, index_config_from_kb(kb))
+            vector_ids = await asyncio.to_thread(kb_faiss_manager.vector_ids, [str(c) for c in chunk_ids])
+            removed = await asyncio.to_thread(kb_faiss_manager.delete_chunks, [str(c) for c in chunk_ids])
+            await asyncio.to_thread(lambda: bm25_registry.get(kb.id).delete(vector_ids))
+        metadata_registry.remove_document(kb.id, doc_id)
+        semantic_cache.invalidate(str(kb.id))
+        logger.info(f"Deleted document {doc_id}: {len(chunk_ids)} chunks, {removed} vectors tombstoned")
+        return {"document_id": str(doc_id), "chunks": len(chunk_ids), "vectors_removed": removed}
+
+    async def _retrieve(self, kb: KBModel, query: str, top_k: int, filters=None) -> dict:
+        """
+        Embeds the query, searches the KB index and loads the matching chunks.
+
+        With a lexical weight above 0 the vector and BM25 indexes each return
+        top_k * HYBRID_CANDIDATE_MULTIPLIER candidates, which are fused with
+        weighted reciprocal rank fusion before keeping the top_k.
+        """
         start_time = time.time()
 
         ai_provider_name = kb.ai_provider or "openai"
@@ -161,61 +423,505 @@ class RAGService:
         if not provider_conf:
             raise Exception(f"AI provider '{ai_provider_name}' not found or not enabled")
 
-        if ai_provider_name == "openai":
-            from app.core.providers.openai_provider import OpenAIProviderClient
-            embed_client = OpenAIProviderClient(
-                api_key=provider_conf["api_key"],
-                embedding_model=embedding_model_name
-            )
-            completion_model_name = provider_conf.get("completion_model", "gpt-3.5-turbo")
-        else:
-             raise NotImplementedError(f"AI provider '{ai_provider_name}' not implemented yet for query.")
+        # One pooled client serves both the query embedding and the completion
+        embed_client = provider_manager.get_provider_client(ai_provider_name, embedding_model=embedding_model_name)
+        completion_model_name = provider_conf.get("completion_model") or provider_conf.get("model")
 
-        query_vector = await embed_client.embed_texts([query])
+        query_vector = await query_embedding_cache.get_or_embed(embed_client, ai_provider_name, embedding_model_name, query)
 
-        current_faiss_dim = faiss_dim
-        kb_index_path = get_index_path(str(kb.id))
-        kb_faiss_manager = FAISSManager(dim=current_faiss_dim, index_path=kb_index_path)
+        kb_faiss_manager = await asyncio.to_thread(get_faiss_manager, str(kb.id), faiss_dim, index_config_from_kb(kb))
+        if kb_faiss_manager.load_failed:
+            logger.warning(f"Index for KB {kb.id} failed to load and is empty until rebuilt (POST /api/v1/knowledge_bases/{kb.id}/index/rebuild)")
 
-        results = kb_faiss_manager.search(np.array(query_vector[0]), top_k=top_k)
+        lexical_weight, lexical_index = await asyncio.to_thread(self._lexical_index, kb)
+        candidates = top_k * max(1, hybrid_candidate_multiplier) if lexical_index else top_k
+        id_filter = await self._id_filter(kb, kb_faiss_manager, filters)
+        # Index searches (and their reader/writer lock) run off the event loop, so a long
+        # compaction or purge of one KB does not stall the whole worker
+        dense = await asyncio.to_thread(kb_faiss_manager.search, np.array(query_vector), top_k=candidates, id_filter=id_filter)
+        distances = dict(dense)
+        results = await self._fuse(kb_faiss_manager, lexical_index, lexical_weight, query, dense, top_k, id_filter)
 
-        context = ""
         db_chunks = []
         if results:
             chunk_ids = [r[0] for r in results]
             from sqlalchemy.future import select
-            db_chunks = (await self.db.execute(select(DocumentChunk).where(DocumentChunk.id.in_(chunk_ids)))).scalars().all()
-            context = "\n---\n".join(chunk.text for chunk in db_chunks)
-
-        prompt = (
-             f"Use the following context exclusively to answer the question. If the context does not contain the answer, say so.\n\n"
-             f"Context:\n{context or 'No context provided.'}\n\n"
-             f"Question: {query}\n\n"
-             "Answer:"
-         )
-
-        completion_response = await embed_client.complete(prompt, model=completion_model_name)
-        answer = completion_response["content"]
-        usage = completion_response["usage"]
-        actual_completion_model = completion_response["model"]
+            by_id = {
+                str(chunk.id): chunk
+                for chunk in (await self.db.execute(select(DocumentChunk).where(DocumentChunk.id.in_(chunk_ids)))).scalars().all()
+            }
+            # Most relevant first, so the token budget keeps the best chunks
+            db_chunks = [by_id[chunk_id] for chunk_id in chunk_ids if chunk_id in by_id]
+        built = build_context(db_chunks, context_budget(kb, completion_model_name), completion_model_name)
+        context = built.text
+
+        retrieved_chunk_ids = [r[0] for r in results]
+        cached = None
+        if kb.semantic_cache_enabled:
+            cached = semantic_cache.lookup(kb, query_vector, retrieved_chunk_ids)
+
+        citations = [
+            {"chunk_id": str(chunk.id), "document_id": str(chunk.document_id), "chunk_index": chunk.chunk_index, "distance": distances.get(str(chunk.id))}
+            for chunk in built.chunks
+        ]
+        prompt = build_prompt(context, query)
+        return {
+            "start_time": start_time,
+            "embed_client": embed_client,
+            "completion_model": completion_model_name,
+            "query_vector": query_vector,
+            "retrieved_chunk_ids": retrieved_chunk_ids,
+            "context": context,
+            "context_tokens": built.tokens,
+            "context_tokens_saved": built.tokens_saved,
+            "citations": citations,
+            "prompt": prompt,
+            "cached": cached
+        }
+
+    def _lexical_index(self, kb: KBModel):
+        """(weight, BM25 index) for hybrid retrieval; the index is None when lexical search is off or empty."""
+        lexical_weight = kb.lexical_weight if kb.lexical_weight is not None else hybrid_lexical_weight
+        if lexical_weight <= 0:
+            return 0.0, None
+        lexical_index = bm25_registry.get(kb.id)
+        if lexical_index.suspended or lexical_index.doc_count == 0:
+            return 0.0, None
+        return lexical_weight, lexical_index
+
+    async def _id_filter(self, kb: KBModel, kb_faiss_manager, filters) -> Optional[np.ndarray]:
+        """Bitmap of the vector ids matching metadata `filters`, or None without filters.
+
+        The KB's metadata index is built on first use, under the KB write lock so
+        ingestion cannot move vector ids while it is read, and kept up to date by
+        ingestion and deletes afterwards.
+        """
+        if not has_filters(filters):
+            return None
+        index = metadata_registry.cached(kb.id)
+        if index is None:
+            from app.services.index_builder import build_metadata_index_from_db
+            async with kb_write_lock(kb.id):
+                index = metadata_registry.cached(kb.id)
+                if index is None:
+                    index = await build_metadata_index_from_db(self.db, kb, kb_faiss_manager.id_map)
+                    metadata_registry.put(kb.id, index)
+        return index.select(filters)
+
+    async def _fuse(self, kb_faiss_manager, lexical_index, lexical_weight: float, query: str, dense: List[Tuple[str, float]], top_k: int, id_filter: Optional[np.ndarray] = None) -> List[Tuple[str, float]]:
+        """
+        Ranks dense hits together with the BM25 hits for `query` by weighted reciprocal rank
+        fusion and returns the top_k (chunk_id, score) pairs. Without a lexical index the
+        dense order is kept; scores are rank-based either way, higher is better.
+
+        BM25 hits outside `id_filter` are dropped; BM25 over-fetches by 1 / selectivity of the
+        filter so that enough matching hits remain.
+        """
+        if lexical_index is None:
+            return reciprocal_rank_fusion([[chunk_id for chunk_id, _ in dense]], [1.0])[:top_k]
+        count = max(top_k, len(dense))
+        if id_filter is not None:
+            selectivity = min(1.0, bitmap_count(id_filter) / max(1, lexical_index.doc_count))
+            count = int(min(max(count, lexical_index.doc_count), np.ceil(count / max(selectivity, 1e-9))))
+        hits = await asyncio.to_thread(lexical_index.search, query, count)
+        vector_ids = np.array([doc_id for doc_id, _ in hits], dtype=np.int64)
+        if id_filter is not None:
+            vector_ids = vector_ids[bitmap_contains(id_filter, vector_ids)]
+        lexical_chunk_ids = [c for c in await asyncio.to_thread(kb_faiss_manager.chunk_ids_for, vector_ids) if c is not None]
+        return reciprocal_rank_fusion(
+            [[chunk_id for chunk_id, _ in dense], lexical_chunk_ids], [1 - lexical_weight, lexical_weight]
+        )[:top_k]
+
+    async def _load_hits(self, chunk_ids: List[str]) -> dict:
+        """Chunk id -> (chunk, document title) for `chunk_ids`, loaded with one query."""
+        if not chunk_ids:
+            return {}
+        from sqlalchemy.future import select
+        rows = (await self.db.execute(
+            select(DocumentChunk, DocModel.title)
+            .join(DocModel, DocumentChunk.document_id == DocModel.id)
+            .where(DocumentChunk.id.in_(list(chunk_ids)))
+        )).all()
+        return {str(chunk.id): (chunk, title) for chunk, title in rows}
+
+    @staticmethod
+    def _hits(results: List[Tuple[str, float]], loaded: dict, distances: dict) -> List[dict]:
+        return [
+            {
+                "chunk_id": chunk_id,
+                "document_id": str(loaded[chunk_id][0].document_id),
+                "title": loaded[chunk_id][1],
+                "chunk_index": loaded[chunk_id][0].chunk_index,
+                "text": loaded[chunk_id][0].text,
+                "score": score,
+                "distance": distances.get(chunk_id)
+            }
+            for chunk_id, score in results if chunk_id in loaded
+        ]
+
+    async def search(self, kb: KBModel, query: str, limit: int = 10, offset: int = 0, latency_budget_ms: Optional[float] = None, filters=None) -> dict:
+        """
+        Retrieval only: ranked chunks for `query` with document metadata, without a completion
+        or a query log. Results are paged with `offset`/`limit`.
+
+        With a latency budget, steps that would overrun it are dropped instead of delaying the
+        response (`degraded` is then set): if loading the BM25 index is late the search is
+        vector-only, if the query embedding or the vector search is late the results are
+        BM25-only, and if BM25 is late they are vector-only. When loading the vector index or
+        the metadata filter overruns it, or neither retriever fits, asyncio.TimeoutError is
+        raised. Loading the returned page's chunks is one query and is not budgeted.
+        """
+        start_time = time.time()
+        deadline = start_time + latency_budget_ms / 1000 if latency_budget_ms else None
+
+        async def within_budget(awaitable):
+            if deadline is None:
+                return await awaitable
+            left = deadline - time.time()
+            if left <= 0:
+                # wait_for(timeout=0) would still start the step; an exhausted budget skips it
+                awaitable.close()
+                raise asyncio.TimeoutError()
+            return await asyncio.wait_for(awaitable, timeout=left)
 
-        end_time = time.time()
-        latency_ms = (end_time - start_time) * 1000
+        wanted = offset + limit + 1  # One extra result tells whether there is a next page
+        degraded = False
+        kb_faiss_manager = await within_budget(asyncio.to_thread(get_faiss_manager, str(kb.id), faiss_dim, index_config_from_kb(kb)))
+        try:
+            lexical_weight, lexical_index = await within_budget(asyncio.to_thread(self._lexical_index, kb))
+        except asyncio.TimeoutError:
+            logger.warning(f"Loading the BM25 index of KB {kb.id} exceeded the latency budget; returning vector results only")
+            lexical_weight, lexical_index, degraded = 0.0, None, True
+        ai_provider_name, embedding_model_name, embed_client = self._embedding_client(kb)
+        id_filter = await within_budget(self._id_filter(kb, kb_faiss_manager, filters))
+
+        try:
+            # A cached embedding costs nothing, so it is used even once the budget is spent
+            query_vector = query_embedding_cache.cached(ai_provider_name, embedding_model_name, query)
+            if query_vector is None:
+                query_vector = await within_budget(
+                    query_embedding_cache.get_or_embed(embed_client, ai_provider_name, embedding_model_name, query)
+                )
+            candidates = wanted * max(1, hybrid_candidate_multiplier) if lexical_index else wanted
+            dense = await within_budget(
+                asyncio.to_thread(kb_faiss_manager.search, np.array(query_vector), top_k=candidates, id_filter=id_filter)
+            )
+        except asyncio.TimeoutError:
+            if lexical_index is None:
+                raise
+            # Lexical-only: the dense ranking is empty and carries no weight
+            logger.warning(f"Vector retrieval for KB {kb.id} exceeded the latency budget; returning BM25 results only")
+            results = await self._fuse(kb_faiss_manager, lexical_index, 1.0, query, [], wanted, id_filter)
+            dense, degraded = [], True
+        else:
+            try:
+                # Without BM25 fusion only reorders the dense hits, so it is not budgeted
+                fused = self._fuse(kb_faiss_manager, lexical_index, lexical_weight, query, dense, wanted, id_filter)
+                results = await (within_budget(fused) if lexical_index is not None else fused)
+            except asyncio.TimeoutError:
+                logger.warning(f"BM25 search for KB {kb.id} exceeded the latency budget; returning vector results only")
+                results = await self._fuse(kb_faiss_manager, None, 0.0, query, dense, wanted)
+                degraded = True
+
+        page = results[offset:offset + limit]
+        hits = self._hits(page, await self._load_hits([chunk_id for chunk_id, _ in page]), dict(dense))
+        return {
+            "query": query,
+            "hits": hits,
+            "offset": offset,
+            "limit": limit,
+            "next_offset": offset + limit if len(results) > offset + limit else None,
+            "degraded": degraded,
+            "latency_ms": round((time.time() - start_time) * 1000, 1)
+        }
+
+    async def search_batch(self, kb: KBModel, queries: List[str], top_k: int = 5, filters=None) -> List[dict]:
+        """
+        Retrieval only (no completion) for many queries at once: the queries are embedded
+        in one provider call (cache misses only), searched with one matrix index search,
+        and their chunks loaded with one query. Returns the hits of each query, in order.
+        """
+        if not queries:
+            return []
+        ai_provider_name, embedding_model_name, embed_client = self._embedding_client(kb)
+        query_vectors = await query_embedding_cache.get_or_embed_many(embed_client, ai_provider_name, embedding_model_name, queries)
 
-        log_entry = QueryLog(
+        kb_faiss_manager = await asyncio.to_thread(get_faiss_manager, str(kb.id), faiss_dim, index_config_from_kb(kb))
+        lexical_weight, lexical_index = await asyncio.to_thread(self._lexical_index, kb)
+        candidates = top_k * max(1, hybrid_candidate_multiplier) if lexical_index else top_k
+        id_filter = await self._id_filter(kb, kb_faiss_manager, filters)
+        dense_per_query = await asyncio.to_thread(
+            kb_faiss_manager.search_batch, np.asarray(query_vectors, dtype=np.float32), top_k=candidates, id_filter=id_filter
+        )
+        results_per_query = await asyncio.gather(*(
+            self._fuse(kb_faiss_manager, lexical_index, lexical_weight, query, dense, top_k, id_filter)
+            for query, dense in zip(queries, dense_per_query)
+        ))
+
+        loaded = await self._load_hits(list({chunk_id for results in results_per_query for chunk_id, _ in results}))
+        return [
+            {"query": query, "hits": self._hits(results, loaded, dict(dense))}
+            for query, dense, results in zip(queries, dense_per_query, results_per_query)
+        ]
+
+    def _query_log(self, kb: KBModel, query: str, retrieval: dict, answer: str, usage: dict, completion_model: str) -> QueryLog:
+        return QueryLog(
             knowledge_base_id=kb.id,
             query_text=query,
-            retrieved_context=context,
+            retrieved_context=retrieval["context"],
             response_text=answer,
-            completion_model=actual_completion_model,
+            completion_model=completion_model,
             prompt_tokens=usage.get("prompt_tokens"),
             completion_tokens=usage.get("completion_tokens"),
             total_tokens=usage.get("total_tokens"),
-            latency_ms=latency_ms
+            latency_ms=(time.time() - retrieval["start_time"]) * 1000,
+            cache_hit=bool(retrieval["cached"]),
+            context_tokens=retrieval["context_tokens"],
+            context_tokens_saved=retrieval["context_tokens_saved"]
         )
+
+    async def query(self, kb: KBModel, query: str, top_k: int = 3, filters=None) -> Any:
+        retrieval = await self._retrieve(kb, query, top_k, filters)
+        cached = retrieval["cached"]
+
+        if cached:
+            answer = cached["answer"]
+            usage = {}
+            actual_completion_model = cached["model"]
+        else:
+            completion_response = await retrieval["embed_client"].complete(retrieval["prompt"], model=retrieval["completion_model"])
+            answer = completion_response["content"]
+            usage = completion_response["usage"]
+            actual_completion_model = completion_response["model"]
+            if kb.semantic_cache_enabled:
+                semantic_cache.store(kb, retrieval["query_vector"], retrieval["retrieved_chunk_ids"], answer, retrieval["context"], actual_completion_model)
+
+        log_entry = self._query_log(kb, query, retrieval, answer, usage, actual_completion_model)
         self.db.add(log_entry)
+        await self.db.commit()
+
+        return {"answer": answer, "context": retrieval["context"], "log_id": log_entry.id, "cache_hit": bool(cached)}
+
+    async def query_stream(self, kb: KBModel, query: str, top_k: int = 3, filters=None):
+        """
+        Retrieves context, then returns an async generator of (event, data) pairs for
+        Server-Sent Events: 'context' (context and citations), 'token' events as the
+        provider emits them, and 'done' (log_id and usage) once the QueryLog is written.
 
-        return {"answer": answer, "context": context}
+        Retrieval runs before this returns, on the request's session. The generator
+        writes the log through its own session, since the request's session is closed
+        by the time a streaming response body is sent.
+        """
+        retrieval = await self._retrieve(kb, query, top_k, filters)
+        kb_id = kb.id
+
+        async def events():
+            cached = retrieval["cached"]
+            yield "context", {"context": retrieval["context"], "citations": retrieval["citations"], "cache_hit": bool(cached)}
+
+            if cached:
+                answer, usage, completion_model = cached["answer"], {}, cached["model"]
+                yield "token", {"content": answer}
+            else:
+                parts, usage, completion_model = [], {}, retrieval["completion_model"]
+                async for event in retrieval["embed_client"].stream_complete(retrieval["prompt"], model=retrieval["completion_model"]):
+                    if event["type"] == "token":
+                        parts.append(event["content"])
+                        yield "token", {"content": event["content"]}
+                    elif event["type"] == "done":
+                        usage, completion_model = event.get("usage") or {}, event.get("model") or completion_model
+                answer = "".join(parts).strip()
+                if kb.semantic_cache_enabled:
+                    semantic_cache.store(kb, retrieval["query_vector"], retrieval["retrieved_chunk_ids"], answer, retrieval["context"], completion_model)
+
+            from app.db.database import AsyncSessionLocal
+            async with AsyncSessionLocal() as log_db:
+                log_entry = self._query_log(kb, query, retrieval, answer, usage, completion_model)
+                log_entry.knowledge_base_id = kb_id
+                log_db.add(log_entry)
+                await log_db.commit()
+            yield "done", {"log_id": str(log_entry.id), "usage": usage, "model": completion_model, "cache_hit": bool(cached)}
+
+        return events()
+
+    async def query_federated(self, kbs: List[KBModel], query: str, top_k: int = 5, kb_timeout: Optional[float] = None) -> dict:
+        """
+        Answers `query` from several knowledge bases with one completion.
+
+        Each KB produces candidates concurrently (index search, fused with BM25 as in `query`)
+        and is left out if it takes longer than `kb_timeout` seconds (FEDERATED_KB_TIMEOUT_SECONDS).
+        Index distances are not comparable across index types (PQ and IVF distances are
+        approximate) or metrics, so candidates are rescored by exact cosine similarity between
+        the query and their stored embeddings, and the top_k across all KBs are merged with a
+        heap. The completion uses the first responding KB's provider, and the query is logged
+        against that KB.
+        """
+        import heapq
+        start_time = time.time()
+        kb_timeout = kb_timeout or federated_kb_timeout_seconds
+        status = {str(kb.id): {"knowledge_base_id": str(kb.id), "status": "ok"} for kb in kbs}
+
+        # One query embedding per (provider, model), shared by the KBs that use it
+        clients, embeddings = {}, {}
+        for kb in kbs:
+            try:
+                clients[str(kb.id)] = provider, model, client = self._embedding_client(kb)
+            except Exception as e:
+                status[str(kb.id)].update(status="error", error=str(e))
+                continue
+            if (provider, model) not in embeddings:
+                embeddings[(provider, model)] = asyncio.ensure_future(query_embedding_cache.get_or_embed(client, provider, model, query))
+
+        async def candidates(kb: KBModel) -> List[str]:
+            provider, model, _ = clients[str(kb.id)]
+            # Index and BM25 loads are blocking file reads; run them off the loop so the timeout holds
+            kb_faiss_manager = await asyncio.to_thread(get_faiss_manager, str(kb.id), faiss_dim, index_config_from_kb(kb))
+            lexical_weight, lexical_index = await asyncio.to_thread(self._lexical_index, kb)
+            # Shielded: one KB timing out must not cancel an embedding other KBs are waiting on
+            query_vector = await asyncio.shield(embeddings[(provider, model)])
+            count = top_k * max(1, hybrid_candidate_multiplier) if lexical_index else top_k
+            dense = await asyncio.to_thread(kb_faiss_manager.search, np.array(query_vector), count)
+            return [chunk_id for chunk_id, _ in await self._fuse(kb_faiss_manager, lexical_index, lexical_weight, query, dense, top_k)]
+
+        async def timed(kb: KBModel):
+            kb_start = time.time()
+            try:
+                return await asyncio.wait_for(candidates(kb), timeout=kb_timeout)
+            except asyncio.TimeoutError:
+                status[str(kb.id)]["status"] = "timeout"
+                logger.warning(f"KB {kb.id} exceeded the federated query timeout of {kb_timeout}s")
+            except Exception as e:
+                status[str(kb.id)].update(status="error", error=str(e))
+                logger.error(f"Federated query on KB {kb.id} failed: {e}")
+            finally:
+                status[str(kb.id)]["latency_ms"] = round((time.time() - kb_start) * 1000, 1)
+            return []
+
+        responding = [kb for kb in kbs if str(kb.id) in clients]
+        per_kb = dict(zip((str(kb.id) for kb in responding), await asyncio.gather(*(timed(kb) for kb in responding))))
+        for future in embeddings.values():
+            future.cancel()
+
+        # Exact cosine rescoring against the stored embeddings of every candidate
+        chunk_ids = [chunk_id for ids in per_kb.values() for chunk_id in ids]
+        stored = {}
+        if chunk_ids:
+            from sqlalchemy.future import select
+            rows = (await self.db.execute(
+                select(Embedding.chunk_id, Embedding.provider, Embedding.model, Embedding.vector_blob, Embedding.vector_dtype, Embedding.vector_scale, Embedding.vector)
+                .where(Embedding.chunk_id.in_(chunk_ids))
+            )).all()
+            for chunk_id, provider, model, blob, dtype, scale, vector_json in rows:
+                stored[(str(chunk_id), provider, model)] = (
+                    decode_vector(blob, dtype, scale) if blob is not None else np.asarray(json.loads(vector_json), dtype=np.float32)
+                )
+
+        def scored():
+            for kb in responding:
+                provider, model, _ = clients[str(kb.id)]
+                future = embeddings[(provider, model)]
+                if not future.done() or future.cancelled() or future.exception() is not None:
+                    continue
+                query_vector = np.asarray(future.result(), dtype=np.float32)
+                query_vector /= np.linalg.norm(query_vector) or 1.0
+                for chunk_id in per_kb[str(kb.id)]:
+                    vector = stored.get((chunk_id, provider, model))
+                    if vector is not None:
+                        yield float(np.dot(query_vector, vector) / (np.linalg.norm(vector) or 1.0)), chunk_id, kb
+
+        merged = heapq.nlargest(top_k, scored(), key=lambda item: item[0])
+        loaded = await self._load_hits([chunk_id for _, chunk_id, _ in merged])
+        merged = [item for item in merged if item[1] in loaded]
+        for _, _, kb in merged:
+            status[str(kb.id)]["hits"] = status[str(kb.id)].get("hits", 0) + 1
+
+        answering = next((kb for kb in kbs if str(kb.id) in per_kb and status[str(kb.id)]["status"] == "ok"), None)
+        if answering is None:
+            raise Exception("No knowledge base returned results within the timeout")
+        provider_name, _, client = clients[str(answering.id)]
+        provider_conf = provider_manager.get_provider_config(provider_name) or {}
+        completion_model_name = provider_conf.get("completion_model") or provider_conf.get("model")
+
+        built = build_context([loaded[chunk_id][0] for _, chunk_id, _ in merged], context_budget(answering, completion_model_name), completion_model_name)
+        used = {str(chunk.id) for chunk in built.chunks}
+        citations = [
+            {
+                "knowledge_base_id": str(kb.id),
+                "chunk_id": chunk_id,
+                "document_id": str(loaded[chunk_id][0].document_id),
+                "title": loaded[chunk_id][1],
+                "chunk_index": loaded[chunk_id][0].chunk_index,
+                "score": score
+            }
+            for score, chunk_id, kb in merged if chunk_id in used
+        ]
+
+        completion_response = await client.complete(build_prompt(built.text, query), model=completion_model_name)
+        usage = completion_response["usage"]
+        retrieval = {
+            "context": built.text, "start_time": start_time, "cached": None,
+            "context_tokens": built.tokens, "context_tokens_saved": built.tokens_saved
+        }
+        log_entry = self._query_log(answering, query, retrieval, completion_response["content"], usage, completion_response["model"])
+        self.db.add(log_entry)
+        await self.db.commit()
+        logger.info(f"Federated query over {len(kbs)} KBs merged {len(merged)} chunks in {(time.time() - start_time) * 1000:.0f} ms")
+
+        return {
+            "answer": completion_response["content"],
+            "context": built.text,
+            "citations": citations,
+            "knowledge_bases": list(status.values()),
+            "log_id": log_entry.id
+        }
+
+    async def rebuild_index(self, kb: KBModel, batch_size: int = None, on_progress=None) -> dict:
+        """
+        Rebuilds the KB's FAISS index from the stored embeddings using the KB's current
+        index configuration (type, nlist, ...). Embeddings are streamed in batches and
+        added off the event loop while searches keep using the old index; the result
+        is swapped in atomically.
+        """
+        from app.services.index_builder import build_index_from_db, build_lexical_index_from_db
+        index_config = index_config_from_kb(kb)
+        kb_faiss_manager = await asyncio.to_thread(get_faiss_manager, str(kb.id), faiss_dim)
+
+        await asyncio.to_thread(kb_faiss_manager.begin_rebuild)
+        try:
+            index, id_map, progress = await build_index_from_db(
+                self.db, kb, faiss_dim, index_config, batch_size=batch_size, on_progress=on_progress
+            )
+        except Exception:
+            await asyncio.to_thread(kb_faiss_manager.abort_rebuild)
+            raise
+
+        # The BM25 index is keyed by vector ids, which the rebuild reassigned; it is
+        # rebuilt against the final id map, with ingestion held off and lexical search
+        # paused until it matches again
+        lexical_index = await asyncio.to_thread(bm25_registry.get, kb.id)
+        async with kb_write_lock(kb.id):
+            lexical_index.suspended = True
+            try:
+                try:
+                    # Replays adds made meanwhile and saves the new base; off the event loop
+                    await asyncio.to_thread(kb_faiss_manager.finish_rebuild, index, id_map, index_config)
+                except Exception:
+                    await asyncio.to_thread(kb_faiss_manager.abort_rebuild)
+                    raise
+                semantic_cache.invalidate(str(kb.id))
+                metadata_registry.invalidate(kb.id)
+                delta, lexical_documents = await build_lexical_index_from_db(self.db, kb, kb_faiss_manager.id_map, batch_size)
+                await asyncio.to_thread(lexical_index.replace, delta)
+            finally:
+                lexical_index.suspended = False
+
+        logger.info(f"Rebuilt index for KB {kb.id}: {progress.rows} vectors in {progress.elapsed:.2f}s ({progress.rows_per_sec:.0f} vectors/s)")
+        return {
+            **progress.as_dict(),
+            "index_type": index_config["type"],
+            "vectors": kb_faiss_manager.index.ntotal,
+            "lexical_documents": lexical_documents
+        }
 
 def get_rag_service(db):
     return RAGService(db)
@@ -0,0 +1,114 @@
+import numpy as np
+import faiss
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIMILARITY_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_DEFAULT_THRESHOLD", "0.95"))
+
+
+class SemanticAnswerCache:
+    """Cached answers for one KB, looked up by query-embedding similarity.
+
+    Query vectors are L2-normalized and kept in an inner-product FAISS index, so
+    scores are cosine similarities. An entry is only reused when the new query
+    is within the threshold *and* retrieval returned the same chunk set it was
+    answered from, so answers never outlive the context they were built on.
+    """
+
+    def __init__(self, dim: int, max_entries: int):
+        self.dim = dim
+        self.max_entries = max_entries
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+        self.entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self.next_id = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector: Sequence[float]) -> np.ndarray:
+        arr = np.asarray(vector, dtype=np.float32).reshape(1, -1).copy()
+        faiss.normalize_L2(arr)
+        return arr
+
+    def lookup(self, query_vector: Sequence[float], chunk_ids: Sequence[str], threshold: float) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            if self.index.ntotal == 0:
+                return None
+            scores, ids = self.index.search(self._normalize(query_vector), min(4, self.index.ntotal))
+            wanted = frozenset(chunk_ids)
+            for score, entry_id in zip(scores[0], ids[0]):
+                if entry_id == -1 or score < threshold:
+                    break
+                entry = self.entries.get(int(entry_id))
+                if entry is not None and entry["chunk_ids"] == wanted:
+                    self.entries.move_to_end(int(entry_id))
+                    return dict(entry, similarity=float(score))
+        return None
+
+    def store(self, query_vector: Sequence[float], chunk_ids: Sequence[str], answer: str, context: str, model: Optional[str]):
+        with self.lock:
+            entry_id = self.next_id
+            self.next_id += 1
+            self.index.add_with_ids(self._normalize(query_vector), np.array([entry_id], dtype=np.int64))
+            self.entries[entry_id] = {
+                "chunk_ids": frozenset(chunk_ids),
+                "answer": answer,
+                "context": context,
+                "model": model,
+                "created_at": time.time(),
+            }
+            if len(self.entries) > self.max_entries:
+                # Drop the least recently used entries
+                evicted = [self.entries.popitem(last=False)[0] for _ in range(len(self.entries) - self.max_entries)]
+                self.index.remove_ids(np.array(evicted, dtype=np.int64))
+
+
+class SemanticCacheRegistry:
+    """Per-process map of KB id to its semantic answer cache."""
+
+    def __init__(self):
+        self.max_entries = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "1000"))
+        self._caches: Dict[str, SemanticAnswerCache] = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stored": 0, "invalidations": 0}
+
+    def get(self, kb_id: str, dim: int) -> SemanticAnswerCache:
+        with self._lock:
+            cache = self._caches.get(kb_id)
+            if cache is None or cache.dim != dim:
+                cache = self._caches[kb_id] = SemanticAnswerCache(dim, self.max_entries)
+            return cache
+
+    def lookup(self, kb, query_vector: Sequence[float], chunk_ids: Sequence[str]) -> Optional[Dict[str, Any]]:
+        threshold = kb.semantic_cache_threshold or DEFAULT_SIMILARITY_THRESHOLD
+        hit = self.get(str(kb.id), len(query_vector)).lookup(query_vector, chunk_ids, threshold)
+        self._stats["hits" if hit else "misses"] += 1
+        return hit
+
+    def store(self, kb, query_vector: Sequence[float], chunk_ids: Sequence[str], answer: str, context: str, model: Optional[str]):
+        self.get(str(kb.id), len(query_vector)).store(query_vector, chunk_ids, answer, context, model)
+        self._stats["stored"] += 1
+
+    def invalidate(self, kb_id: str):
+        """Drops every cached answer for a KB; called whenever its content changes."""
+        with self._lock:
+            if self._caches.pop(kb_id, None) is not None:
+                self._stats["invalidations"] += 1
+                logger.info(f"Invalidated semantic answer cache for KB {kb_id}")
+
+    def stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        with self._lock:
+            stats["knowledge_bases"] = len(self._caches)
+            stats["entries"] = sum(len(cache.entries) for cache in self._caches.values())
+        return stats
+
+
+semantic_cache = SemanticCacheRegistry()
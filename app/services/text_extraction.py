@@ -0,0 +1,116 @@
+import io
+import os
+import asyncio
+import logging
+import tempfile
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PAGES_PER_TASK = int(os.getenv("TEXT_EXTRACTION_PAGES_PER_TASK", "32"))
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def get_extraction_pool() -> ProcessPoolExecutor:
+    """Process-wide pool for CPU-bound text extraction, created on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            max_workers = int(os.getenv("TEXT_EXTRACTION_MAX_WORKERS", "0")) or min(4, os.cpu_count() or 1)
+            # Forking the server would copy its threads' locks (asyncio, httpx, FAISS/OpenMP) in
+            # whatever state they are in; forkserver/spawn children start from a clean interpreter
+            start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context(start_method))
+        return _pool
+
+
+def shutdown_extraction_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+# Worker functions; these run in the pool's child processes
+
+def _extract_pdf_pages(path: str, start: int, end: Optional[int]) -> Tuple[int, List[str]]:
+    """Returns the page count and the text of pages [start, end) of the PDF at `path`."""
+    # Each task opens its own reader, so no worker keeps a document alive after its task
+    from PyPDF2 import PdfReader
+    reader = PdfReader(path)
+    page_count = len(reader.pages)
+    pages = []
+    for page_no in range(start, min(end if end is not None else page_count, page_count)):
+        try:
+            pages.append(reader.pages[page_no].extract_text() or "")
+        except Exception as e:
+            logger.warning(f"Failed to extract text from PDF page {page_no}: {e}")
+            pages.append("")
+    return page_count, pages
+
+
+def _extract_docx_paragraphs(docx_bytes: bytes) -> List[str]:
+    from docx import Document as DocxDocument
+    return [para.text for para in DocxDocument(io.BytesIO(docx_bytes)).paragraphs]
+
+
+async def iter_pdf_pages(pdf_bytes: bytes, pages_per_task: int = None) -> AsyncIterator[str]:
+    """Yields PDF page text in order, extracting page ranges in parallel in the process pool.
+
+    The PDF is written to a temporary file once and tasks only receive its path
+    and a page range, so the bytes are not pickled to every task. The first
+    range also reports the page count; the remaining ranges are then
+    submitted together and yielded as each one (in order) completes.
+    """
+    pages_per_task = pages_per_task or PAGES_PER_TASK
+    loop = asyncio.get_running_loop()
+    pool = get_extraction_pool()
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+        f.write(pdf_bytes)
+        path = f.name
+    futures = []
+    try:
+        page_count, pages = await loop.run_in_executor(pool, _extract_pdf_pages, path, 0, pages_per_task)
+        futures = [
+            loop.run_in_executor(pool, _extract_pdf_pages, path, start, start + pages_per_task)
+            for start in range(pages_per_task, page_count, pages_per_task)
+        ]
+        for page in pages:
+            yield page
+        for future in futures:
+            _, pages = await future
+            for page in pages:
+                yield page
+    finally:
+        for future in futures:
+            future.cancel()
+        # Tasks already running keep their open file; the path is no longer needed
+        os.remove(path)
+
+
+async def iter_document_text(content: bytes, filename: Optional[str] = None) -> AsyncIterator[str]:
+    """Yields the text of an uploaded document in segments (PDF pages, DOCX paragraphs or the whole text).
+
+    Extraction failures are logged and produce no text, matching the previous
+    behaviour of the synchronous extractors.
+    """
+    fname = (filename or "").lower()
+    try:
+        if fname.endswith(".pdf"):
+            async for page in iter_pdf_pages(content):
+                yield page
+        elif fname.endswith(".docx"):
+            loop = asyncio.get_running_loop()
+            for paragraph in await loop.run_in_executor(get_extraction_pool(), _extract_docx_paragraphs, content):
+                yield paragraph
+        else:
+            yield content.decode(errors="ignore")
+    except Exception as e:
+        logger.warning(f"Text extraction failed for {filename or 'document'}: {e}")
+
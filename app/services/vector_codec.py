@@ -0,0 +1,60 @@
+import numpy as np
+import os
+import json
+from typing import Iterable, Optional, Sequence, Tuple
+
+# Binary storage formats for rag_embedding.vector_blob
+STORAGE_DTYPES = {
+    "float32": np.dtype("<f4"),
+    "float16": np.dtype("<f2"),
+    "int8": np.dtype("i1"),  # symmetric quantization, value = int8 * vector_scale
+}
+
+
+def default_storage_dtype() -> str:
+    dtype = os.getenv("EMBEDDING_STORAGE_DTYPE", "float32")
+    if dtype not in STORAGE_DTYPES:
+        raise ValueError(f"Unsupported EMBEDDING_STORAGE_DTYPE '{dtype}'. Expected one of {', '.join(STORAGE_DTYPES)}.")
+    return dtype
+
+
+def encode_vector(vector: Sequence[float], dtype: Optional[str] = None) -> Tuple[bytes, str, Optional[float]]:
+    """Packs a vector for storage; returns (blob, dtype, scale). Scale is only set for int8."""
+    dtype = dtype or default_storage_dtype()
+    arr = np.asarray(vector, dtype=np.float32)
+    if dtype == "int8":
+        max_abs = float(np.abs(arr).max()) if arr.size else 0.0
+        scale = max_abs / 127.0 if max_abs > 0 else 1.0
+        return np.round(arr / scale).astype(STORAGE_DTYPES["int8"]).tobytes(), dtype, scale
+    return arr.astype(STORAGE_DTYPES[dtype]).tobytes(), dtype, None
+
+
+def decode_vector(blob: bytes, dtype: str, scale: Optional[float] = None) -> np.ndarray:
+    """Unpacks a single stored vector to float32."""
+    arr = np.frombuffer(blob, dtype=STORAGE_DTYPES[dtype]).astype(np.float32)
+    if scale is not None:
+        arr *= np.float32(scale)
+    return arr
+
+
+def decode_rows(rows: Iterable[Tuple], dim: int) -> np.ndarray:
+    """Decodes (vector_blob, vector_dtype, vector_scale, vector_json) rows into an (n, dim) float32 array.
+
+    Rows of the same dtype are decoded with one `np.frombuffer` over their
+    concatenated blobs; rows not yet migrated fall back to the JSON text column.
+    """
+    rows = list(rows)
+    out = np.empty((len(rows), dim), dtype=np.float32)
+    by_dtype = {}
+    for i, (blob, dtype, scale, vector_json) in enumerate(rows):
+        if blob is None:
+            out[i] = json.loads(vector_json)
+        else:
+            by_dtype.setdefault(dtype, []).append(i)
+    for dtype, idx in by_dtype.items():
+        idx = np.asarray(idx)
+        stored = np.frombuffer(b"".join(rows[i][0] for i in idx), dtype=STORAGE_DTYPES[dtype]).reshape(-1, dim)
+        out[idx] = stored
+        if dtype == "int8":
+            out[idx] *= np.array([rows[i][2] for i in idx], dtype=np.float32)[:, None]
+    return out